@@ -7,6 +7,9 @@ BIN_PATH = ROOT / "Bin"
 # TEMPLATE_PATH = ROOT / "Template" 
 LOG_PATH = ROOT / "Logs"
 HISTORY_PATH = ROOT / "Bin" / "projects.json"
+RESULTS_PATH = ROOT / "Bin" / "results.sqlite"
+QUEUE_PATH = ROOT / "Bin" / "queue.json"
+QUEUE_HEARTBEAT = 10 # seconds between two heartbeats of a running batch queue, see Libs.batchqueue
 
 POS_INF = math.inf
 NEG_INF = math.inf*(-1)
@@ -25,6 +28,14 @@ RAW_FORMAT_INDICATOR = "-position*.csv"
 RAW_FORMAT_SEPARATOR = "Well"
 BATCH_FOLDER_FORMAT = "Batch {}"
 
+# Binary copies of the parsed position csv files, kept inside the project directory
+TRAJECTORY_CACHE_DIR = ".trajectory_cache"
+TRAJECTORY_CACHE_BUDGET = 2 * 1024**3 # bytes
+# Consolidated memory-mapped trajectories of a Day folder, <DAY_STORE_NAME>.dat/.json
+DAY_STORE_NAME = "trajectories"
+# Inputs and endpoints of the last analysis of each worm, Day N/<RUN_MANIFEST_DIR>/<treatment char>.json
+RUN_MANIFEST_DIR = ".run_manifest"
+
 OLD_DEFAULT_PARAMS = {
     "CONVERSION RATE": 82,
     "FRAME RATE": 30,
@@ -102,9 +113,18 @@ CENTER_RANGE = 1.5
 
 SPEED_THRESHOLD = 6 * 100 / 3600 # cm/s
 FAST_FORWARD_FACTOR = 10
+SPEED_SPIKE_POLICY = "previous" # "previous", "interpolate" or "median", see calculation.correct_speed_spikes
 
 FREEZING_THRESHOLD = 0.06
 AV_SPEED_THRESHOLD = 90
+AV_INTERVAL = 30 # frames between two points of the turning angles used for the angular velocity
+AV_PROFILE_INTERVALS = [1, 5, 10, 15, 30] # intervals compared by Angle.velocity_profile, the ones not dividing the frame rate are skipped
+
+STREAM_CHUNK_FRAMES = 100000 # frames read at a time by the streaming analysis, see Libs.stream
+EXPORT_FORMAT = "excel" # "excel", "csv", "parquet" or "feather", see Libs.export
+COPY_WORKERS = 8 # threads copying raw files when importing a project
+ANALYSIS_WORKERS = 1 # processes analyzing the batches of a treatment, 1 runs them in the Executor itself
+SCHEDULER_WORKERS = 4 # processes analyzing treatments (and days) concurrently, see Libs.scheduler
 
 DAY_FORMAT = "Day {}"
 TREATMENT_REP_FORMAT = "Treatment {}"
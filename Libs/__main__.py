@@ -0,0 +1,180 @@
+"""
+Headless entry point, runs the analysis without the GUI (and without tkinter)
+
+    python -m Libs analyze <project dir or history name> [--days 1 2] [--treatments A B]
+                           [--workers 4] [--format excel] [--overwrite skip|replace]
+    python -m Libs queue add [--projects P1 P2] [--days 1] [--treatments A] [--priority 0]
+    python -m Libs queue list | run | cancel [ids] | priority <value> <ids> | clear
+
+The run summary is printed to stdout as JSON, the logs go to stderr.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+from Libs.misc import resolve_project
+from Libs.scheduler import ProjectScheduler, project_jobs
+from Libs.export import EXPORTERS
+from Libs.batchqueue import BatchQueue
+from . import AV_INTERVAL, AV_PROFILE_INTERVALS, SCHEDULER_WORKERS, EXPORT_FORMAT
+
+logger = logging.getLogger(__name__)
+
+
+def analyze(args):
+    """
+    Analyze the selected days and treatments of a project
+    :return: the run summary, a JSON serializable dictionary
+    """
+    _starttime = time.time()
+
+    project_name, project_dir, project_data = resolve_project(args.project)
+    jobs = project_jobs(project_dir,
+                        project_data = project_data,
+                        days = args.days,
+                        treatments = [x.upper() for x in args.treatments] if args.treatments else None)
+    if not jobs:
+        logger.error(f"No treatment to analyze in {project_dir} for days {args.days} and treatments {args.treatments}")
+        raise ValueError(f"No treatment to analyze in {project_dir} for days {args.days} and treatments {args.treatments}")
+
+    scheduler = ProjectScheduler(project_dir = project_dir,
+                                 jobs = jobs,
+                                 workers = args.workers,
+                                 export_format = args.format,
+                                 results_store = None if args.no_results else True,
+                                 AV_interval = args.av_interval,
+                                 AV_profile = AV_PROFILE_INTERVALS if args.av_profile else None,
+                                 streaming = args.streaming,
+                                 OVERWRITE = args.overwrite == "replace",
+                                 day_store = args.day_store)
+    reports = scheduler.run()
+
+    summary = {"project": project_name,
+               "project_dir": str(project_dir),
+               "workers": scheduler.workers,
+               "export_format": args.format,
+               "overwrite": args.overwrite,
+               "jobs": [],
+               "outputs": {str(day_num): str(path) for day_num, path in scheduler.output_paths.items()},
+               "total_time": None}
+    for day_num, treatment_char, treatment_name in jobs:
+        result = reports[(day_num, treatment_char)]
+        job = {"day": day_num,
+               "treatment": treatment_char,
+               "name": treatment_name,
+               "report": result["report"],
+               "timing": result.get("timing", {})}
+        if "error" in result:
+            job["error"] = str(result["error"])
+        summary["jobs"].append(job)
+    summary["total_time"] = time.time() - _starttime
+
+    return summary
+
+
+def queue(args):
+    """
+    Edit or run the batch queue of Bin/queue.json
+    :return: the jobs concerned, a JSON serializable dictionary
+    """
+    batch_queue = BatchQueue()
+
+    if args.action == "add":
+        return {"added": batch_queue.add_projects(projects = args.projects,
+                                                  days = args.days,
+                                                  treatments = [x.upper() for x in args.treatments] if args.treatments else None,
+                                                  priority = args.priority)}
+    if args.action == "list":
+        return {"jobs": batch_queue.jobs(statuses = args.status)}
+    if args.action == "cancel":
+        return {"cancelled": batch_queue.cancel(job_ids = args.ids or None)}
+    if args.action == "priority":
+        return {"changed": batch_queue.set_priority(job_ids = args.ids, priority = args.value)}
+    if args.action == "clear":
+        return {"removed": batch_queue.clear()}
+
+    _starttime = time.time()
+    jobs = batch_queue.run(workers = args.workers,
+                           export_format = args.format,
+                           results_store = None if args.no_results else True,
+                           AV_interval = args.av_interval,
+                           AV_profile = AV_PROFILE_INTERVALS if args.av_profile else None,
+                           streaming = args.streaming,
+                           OVERWRITE = args.overwrite == "replace",
+                           day_store = args.day_store)
+    return {"jobs": jobs, "total_time": time.time() - _starttime}
+
+
+def add_run_arguments(parser):
+    # Options shared by "analyze" and "queue run"
+    parser.add_argument("--workers", type = int, default = SCHEDULER_WORKERS, help = "treatments analyzed concurrently")
+    parser.add_argument("--format", choices = sorted(EXPORTERS), default = EXPORT_FORMAT, help = "EndPoints export format")
+    parser.add_argument("--overwrite", choices = ["skip", "replace"], default = "skip",
+                        help = "what to do with treatments already in the EndPoints file")
+    parser.add_argument("--av-interval", type = int, default = AV_INTERVAL, help = "frames between two points of the angular velocity")
+    parser.add_argument("--av-profile", action = "store_true", help = "add the angular velocity profile endpoints")
+    parser.add_argument("--streaming", action = "store_true", help = "read the trajectories in chunks")
+    parser.add_argument("--day-store", action = "store_true", help = "read the trajectories from a memory-mapped store of each day")
+    parser.add_argument("--no-results", action = "store_true", help = "do not write the endpoints to the results database")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog = "python -m Libs", description = "Analyze EwA projects without the GUI")
+    parser.add_argument("--log-level", default = "INFO", help = "level of the logs written to stderr")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    analyze_parser = subparsers.add_parser("analyze", help = "analyze the treatments of a project")
+    analyze_parser.add_argument("project", help = "project directory, or project name in the history")
+    analyze_parser.add_argument("--days", type = int, nargs = "+", help = "day numbers, all days by default")
+    analyze_parser.add_argument("--treatments", nargs = "+", help = "treatment chars, all treatments by default")
+    add_run_arguments(analyze_parser)
+    analyze_parser.set_defaults(func = analyze)
+
+    queue_parser = subparsers.add_parser("queue", help = "queue the projects of the history and run them")
+    queue_actions = queue_parser.add_subparsers(dest = "action", required = True)
+
+    add_parser = queue_actions.add_parser("add", help = "queue the treatments of projects in the history")
+    add_parser.add_argument("--projects", nargs = "+", help = "project names, all projects of the history by default")
+    add_parser.add_argument("--days", type = int, nargs = "+", help = "day numbers, all days by default")
+    add_parser.add_argument("--treatments", nargs = "+", help = "treatment chars, all treatments by default")
+    add_parser.add_argument("--priority", type = int, default = 0, help = "higher priorities run first")
+
+    list_parser = queue_actions.add_parser("list", help = "list the jobs in running order")
+    list_parser.add_argument("--status", nargs = "+", help = "statuses to show, e.g. pending running")
+
+    cancel_parser = queue_actions.add_parser("cancel", help = "cancel pending jobs")
+    cancel_parser.add_argument("ids", type = int, nargs = "*", help = "job ids, all pending jobs by default")
+
+    priority_parser = queue_actions.add_parser("priority", help = "change the priority of pending jobs")
+    priority_parser.add_argument("value", type = int, help = "new priority, higher runs first")
+    priority_parser.add_argument("ids", type = int, nargs = "+", help = "job ids")
+
+    queue_actions.add_parser("clear", help = "remove the finished jobs")
+
+    run_parser = queue_actions.add_parser("run", help = "run the pending jobs with a shared worker pool")
+    add_run_arguments(run_parser)
+
+    queue_parser.set_defaults(func = queue)
+
+    return parser
+
+
+def main(argv = None):
+    args = build_parser().parse_args(argv)
+
+    logging.basicConfig(stream = sys.stderr,
+                        level = args.log_level.upper(),
+                        format = "%(asctime)s %(levelname)-8s [%(name)s] %(message)s")
+
+    summary = args.func(args)
+    json.dump(summary, sys.stdout, indent = 4)
+    sys.stdout.write("\n")
+
+    failed = [job for job in summary.get("jobs", []) if job.get("report") == "Error" or job.get("status") == "error"]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,428 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from Libs.dirFetch import get_treatment_dir
+from Libs.export import get_exporter
+from Libs.results import open_results_store
+from Libs.misc import load_history, FileLock
+from Libs.scheduler import run_treatment, prepare_day_store, project_jobs, sheet_name_of
+from . import QUEUE_PATH, QUEUE_HEARTBEAT, RAW_FORMAT_INDICATOR, AV_INTERVAL, EXPORT_FORMAT, SCHEDULER_WORKERS
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Jobs still to do, and jobs whose report is final
+OPEN_STATUSES = ("pending", "running")
+FINAL_STATUSES = ("completed", "existed", "error", "cancelled")
+
+
+def estimate_cost(project_dir, day_num, treatment_char):
+    """
+    Estimate the analysis cost of a treatment
+    :return: total size in bytes of its position csv files, 0 if the treatment folder is missing
+    """
+    try:
+        treatment_dir = get_treatment_dir(project_dir, day_num, treatment_char)
+    except FileNotFoundError:
+        return 0
+    return sum(x.stat().st_size for x in treatment_dir.rglob(f"*{RAW_FORMAT_INDICATOR}"))
+
+
+def runner_alive(runner, stale_after = 6 * QUEUE_HEARTBEAT):
+    """
+    Check if the runner recorded in the queue file is still working
+    :param runner: {"owner", "host", "pid", "heartbeat"}, or None
+    :param stale_after: seconds without heartbeat after which the runner is considered dead
+    """
+    if runner is None:
+        return False
+    if time.time() - runner["heartbeat"] > stale_after:
+        return False
+    # os.kill(pid, 0) only probes the process on POSIX, on Windows it would terminate it
+    if runner["host"] == socket.gethostname() and os.name != "nt":
+        try:
+            os.kill(runner["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+    return True
+
+
+def job_order(job):
+    # Highest priority first, then the most expensive jobs so the small ones fill the pool at the end
+    return (-job["priority"], -job["cost"], job["id"])
+
+
+class BatchQueue():
+    """
+    Queue of (project, day, treatment) analyses persisted to Bin/queue.json.
+    The file is re-read before every dispatch, so jobs can be listed, reprioritized or cancelled
+    from another process (python -m Libs queue ...) while run() is working.
+    Only one run() works on a queue file at a time, it records itself as the runner with a heartbeat
+    and owns the jobs it claims.
+    """
+
+    def __init__(self, queue_path = QUEUE_PATH, lock_timeout = 30):
+        self.queue_path = Path(queue_path)
+        self.lock_path = self.queue_path.with_name(f"{self.queue_path.name}.lock")
+        self.lock_timeout = lock_timeout
+        # An update holds the lock for milliseconds, a lock older than two heartbeats was left by a dead process
+        self.file_lock = FileLock(self.lock_path, timeout = lock_timeout, stale_after = 2 * QUEUE_HEARTBEAT)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    ##################################################################################################
+    # Persistence
+
+    def lock(self):
+        """
+        Take the queue lock file, waiting up to lock_timeout seconds for another process to release it.
+        The lock records its owner and time, a lock left by a dead process is broken.
+        """
+        self.file_lock.acquire()
+
+    def unlock(self):
+        self.file_lock.release()
+
+    def load(self):
+        if not self.queue_path.exists():
+            return {"next_id": 1, "jobs": []}
+        with open(self.queue_path, "r") as file:
+            return json.load(file)
+
+    def save(self, state):
+        temp_path = self.queue_path.with_name(f"{self.queue_path.name}.tmp")
+        with open(temp_path, "w") as file:
+            json.dump(state, file, indent = 4)
+        os.replace(temp_path, self.queue_path)
+
+    def update(self, change):
+        """
+        Apply change(state) to the queue file under the lock
+        :return: what change returned
+        """
+        self.lock()
+        try:
+            state = self.load()
+            output = change(state)
+            self.save(state)
+        finally:
+            self.unlock()
+        return output
+
+    ##################################################################################################
+    # Queue edition
+
+    def jobs(self, statuses = None):
+        """
+        :param statuses: statuses to keep, all jobs by default
+        :return: list of jobs, in running order
+        """
+        jobs = sorted(self.load()["jobs"], key = job_order)
+        if statuses is not None:
+            jobs = [job for job in jobs if job["status"] in statuses]
+        return jobs
+
+    def add_projects(self, projects = None, days = None, treatments = None, priority = 0):
+        """
+        Queue the treatments of the projects in the history
+        :param projects: project names, all projects of the history by default
+        :param days: day numbers to keep, all days by default
+        :param treatments: treatment chars to keep, all treatments by default
+        :return: list of the new jobs, the treatments already pending or running are not queued twice
+        """
+        history = load_history()
+        if projects is None:
+            projects = list(history.keys())
+
+        candidates = []
+        for project_name in projects:
+            if project_name not in history:
+                logger.error(f"Project {project_name} not found in the history")
+                raise KeyError(f"Project {project_name} not found in the history")
+
+            project_dir = Path(history[project_name]["DIRECTORY"])
+            if not project_dir.is_dir():
+                logger.warning(f"Directory of project {project_name} not found at {project_dir}, skipped")
+                continue
+
+            for day_num, treatment_char, treatment_name in project_jobs(project_dir, history[project_name], days, treatments):
+                candidates.append({"project": project_name,
+                                   "project_dir": str(project_dir),
+                                   "day": day_num,
+                                   "treatment": treatment_char,
+                                   "name": treatment_name,
+                                   "cost": estimate_cost(project_dir, day_num, treatment_char)})
+
+        def change(state):
+            queued = {(job["project_dir"], job["day"], job["treatment"]) for job in state["jobs"] if job["status"] in OPEN_STATUSES}
+            added = []
+            for job in candidates:
+                if (job["project_dir"], job["day"], job["treatment"]) in queued:
+                    continue
+                job.update({"id": state["next_id"],
+                            "priority": priority,
+                            "status": "pending",
+                            "owner": None,
+                            "added": time.time(),
+                            "started": None,
+                            "finished": None,
+                            "timing": {}})
+                state["next_id"] += 1
+                state["jobs"].append(job)
+                added.append(job)
+            return added
+
+        added = self.update(change)
+        logger.info(f"Queued {len(added)} jobs, {len(candidates) - len(added)} were already queued")
+        return added
+
+    def set_priority(self, job_ids, priority):
+        """
+        Change the priority of pending jobs, higher runs first
+        :return: ids of the changed jobs
+        """
+        def change(state):
+            changed = []
+            for job in state["jobs"]:
+                if job["id"] in job_ids and job["status"] == "pending":
+                    job["priority"] = priority
+                    changed.append(job["id"])
+            return changed
+        return self.update(change)
+
+    def cancel(self, job_ids = None):
+        """
+        Cancel pending jobs, running jobs are left to finish
+        :param job_ids: ids of the jobs, all pending jobs by default
+        :return: ids of the cancelled jobs
+        """
+        def change(state):
+            cancelled = []
+            for job in state["jobs"]:
+                if job["status"] == "pending" and (job_ids is None or job["id"] in job_ids):
+                    job["status"] = "cancelled"
+                    job["finished"] = time.time()
+                    cancelled.append(job["id"])
+            return cancelled
+        return self.update(change)
+
+    def clear(self):
+        """
+        Remove the finished jobs from the queue file
+        :return: number of removed jobs
+        """
+        def change(state):
+            kept = [job for job in state["jobs"] if job["status"] not in FINAL_STATUSES]
+            removed = len(state["jobs"]) - len(kept)
+            state["jobs"] = kept
+            return removed
+        return self.update(change)
+
+    def reset_running(self):
+        """
+        Put back to pending the running jobs whose owner is not the live runner of the queue
+        :return: ids of the reset jobs
+        """
+        def change(state):
+            runner = state.get("runner")
+            live_owner = runner["owner"] if runner_alive(runner) else None
+            reset = []
+            for job in state["jobs"]:
+                if job["status"] == "running" and job.get("owner") != live_owner:
+                    job["status"] = "pending"
+                    job["started"] = None
+                    job["owner"] = None
+                    reset.append(job["id"])
+            return reset
+        return self.update(change)
+
+    def acquire_runner(self):
+        """
+        Record this process as the runner of the queue
+        :raise RuntimeError: another runner is still alive
+        """
+        def change(state):
+            runner = state.get("runner")
+            if runner_alive(runner) and runner["owner"] != self.owner:
+                return runner
+            state["runner"] = {"owner": self.owner,
+                               "host": socket.gethostname(),
+                               "pid": os.getpid(),
+                               "heartbeat": time.time()}
+            return None
+
+        other = self.update(change)
+        if other is not None:
+            logger.error(f"Queue {self.queue_path} is already run by {other['owner']}, wait for it to finish or stop it first")
+            raise RuntimeError(f"Queue {self.queue_path} is already run by {other['owner']}")
+
+    def heartbeat(self):
+        def change(state):
+            if (state.get("runner") or {}).get("owner") == self.owner:
+                state["runner"]["heartbeat"] = time.time()
+        self.update(change)
+
+    def release_runner(self):
+        def change(state):
+            if (state.get("runner") or {}).get("owner") == self.owner:
+                state["runner"] = None
+        self.update(change)
+
+    ##################################################################################################
+    # Running
+
+    def claim_next(self):
+        """
+        Mark the first pending job as running
+        :return: the job, or None if nothing is pending
+        """
+        def change(state):
+            pending = sorted([job for job in state["jobs"] if job["status"] == "pending"], key = job_order)
+            if len(pending) == 0:
+                return None
+            pending[0]["status"] = "running"
+            pending[0]["started"] = time.time()
+            pending[0]["owner"] = self.owner
+            return dict(pending[0])
+        return self.update(change)
+
+    def finish(self, job_id, status, timing = None, error = None):
+        def change(state):
+            for job in state["jobs"]:
+                if job["id"] == job_id:
+                    job["status"] = status
+                    job["finished"] = time.time()
+                    job["timing"] = timing or {}
+                    if error is not None:
+                        job["error"] = str(error)
+                    return dict(job)
+        return self.update(change)
+
+    def run(self, workers = SCHEDULER_WORKERS, export_format = EXPORT_FORMAT, results_store = True,
+            AV_interval = AV_INTERVAL, AV_profile = None, streaming = False, OVERWRITE = False, EPA = True, day_store = False):
+        """
+        Run the queue with a worker pool shared by all projects, until no job is pending.
+        Each day's EndPoints file is written as soon as none of its jobs is pending or running.
+        :param results_store: True for the default ResultsStore, a ResultsStore, or None to skip it
+        :param OVERWRITE: re-analyze treatments that already have their sheet
+        :param EPA: run the EndPoints analysis, passed to each Executor
+        :param day_store: read the trajectories from a DayStore, built once per day before its first job runs
+        :return: list of the jobs run, with their final status
+        """
+        _starttime = time.time()
+        workers = max(1, int(workers))
+
+        self.acquire_runner()
+        reset = self.reset_running()
+        if reset:
+            logger.warning(f"Jobs {reset} were left running by an interrupted queue, put back to pending")
+
+        writers = {} # {(project_dir, day_num): exporter}
+        day_stores = {} # {(project_dir, day_num): True if its DayStore is ready}
+        in_flight = {} # {future: job}
+        finished = []
+
+        def writer_of(job):
+            key = (job["project_dir"], job["day"])
+            if key not in writers:
+                writers[key] = get_exporter(job["project_dir"], job["day"], export_format = export_format)
+            return writers[key]
+
+        def already_analyzed(job):
+            # Checked without keeping a writer, a day whose jobs are all skipped has nothing to write
+            key = (job["project_dir"], job["day"])
+            writer = writers.get(key) or get_exporter(job["project_dir"], job["day"], export_format = export_format)
+            return writer.exists(sheet_name_of(job["name"]))
+
+        def close_idle_writers():
+            # A day is done once none of its jobs is open, in the queue file or in this run
+            open_days = {(job["project_dir"], job["day"]) for job in self.jobs(OPEN_STATUSES)}
+            for key in [key for key in writers if key not in open_days]:
+                writers.pop(key).close()
+
+        store, own_store = open_results_store(results_store)
+
+        try:
+            with ProcessPoolExecutor(max_workers = workers) as pool:
+                while True:
+                    # Fill the free workers, re-reading the queue so edits made meanwhile are honoured
+                    while len(in_flight) < workers:
+                        job = self.claim_next()
+                        if job is None:
+                            break
+
+                        if EPA and already_analyzed(job):
+                            if not OVERWRITE:
+                                logger.info(f"{job['project']}, Day {job['day']}, {job['name']} is already analyzed, skipped")
+                                finished.append(self.finish(job["id"], "existed"))
+                                continue
+                            writer_of(job).remove(sheet_name_of(job["name"]))
+
+                        key = (job["project_dir"], job["day"])
+                        if day_store and key not in day_stores:
+                            day_stores[key] = prepare_day_store(*key)
+
+                        future = pool.submit(run_treatment,
+                                             project_dir = job["project_dir"],
+                                             day_num = job["day"],
+                                             treatment_char = job["treatment"],
+                                             treatment_name = job["name"],
+                                             AV_interval = AV_interval,
+                                             AV_profile = AV_profile,
+                                             streaming = streaming,
+                                             EPA = EPA,
+                                             day_store = day_stores.get(key, False))
+                        in_flight[future] = job
+
+                    if len(in_flight) == 0:
+                        break
+
+                    done, _ = wait(in_flight, timeout = QUEUE_HEARTBEAT, return_when = FIRST_COMPLETED)
+                    self.heartbeat()
+                    for future in done:
+                        job = in_flight.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            logger.error(f"Error during analysis of {job['project']}, Day {job['day']}, {job['name']}: {e}")
+                            result = {"report": "Error", "error": str(e), "timing": {}}
+
+                        if result["report"] == "Completed" and result["table"] is not None:
+                            writer_of(job).add(sheet_name_of(job["name"]), result["table"])
+                            if store:
+                                try:
+                                    store.write_run(project_dir = job["project_dir"],
+                                                    day_num = job["day"],
+                                                    treatment_char = job["treatment"],
+                                                    treatment_name = sheet_name_of(job["name"]),
+                                                    params_hash = result["params_hash"],
+                                                    endpoints = result["endpoints"])
+                                except sqlite3.Error as e:
+                                    logger.warning(f"Failed to store the endpoints of job {job['id']} in the results database: {e}")
+
+                        finished.append(self.finish(job["id"],
+                                                    status = result["report"].lower(),
+                                                    timing = result.get("timing"),
+                                                    error = result.get("error")))
+                        logger.info(f"Job {job['id']} ({job['project']}, Day {job['day']}, {job['name']}): {result['report']}")
+
+                    # The queue file is only re-read when a day may just have finished
+                    if done:
+                        close_idle_writers()
+        finally:
+            for writer in writers.values():
+                writer.close()
+            if own_store:
+                store.close()
+            self.release_runner()
+
+        logger.info(f"Queue ran {len(finished)} jobs in {time.time() - _starttime:.2f} s")
+
+        return finished
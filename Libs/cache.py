@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+
+from Libs.loader import read_trajectory
+from Libs.misc import FileLock
+from . import TRAJECTORY_CACHE_BUDGET
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TrajectoryCache():
+    """
+    Batch-level cache of parsed trajectories, owned by an Executor run and shared by its Loaders.
+    Each Batch folder is globbed and parsed once, then evicted when the batch is finished.
+    """
+
+    def __init__(self, sidecar=None):
+
+        self.groups = {} # {group_path: {worm_num: DataFrame}}
+        self.sidecar = sidecar # SidecarCache of binary copies on disk, or None
+        self.hits = 0
+        self.misses = 0
+
+    def get_group(self, group_path, group_reader):
+        """
+        Return the trajectories of a Batch folder, parsing them on the first request only.
+        :param group_path: path of the Batch folder
+        :param group_reader: callable(group_path) returning {worm_num: DataFrame}, used on a miss
+        :return: {worm_num: DataFrame}
+        """
+        key = Path(group_path)
+        if key in self.groups:
+            self.hits += 1
+            return self.groups[key]
+
+        self.misses += 1
+        logger.debug(f"Trajectory cache miss, parsing {key}")
+        self.groups[key] = group_reader(key)
+        return self.groups[key]
+
+    def read_trajectory(self, csv_path):
+        """
+        Read one position csv, through the sidecar cache when there is one.
+        :return: (coords, frames, axes), see Libs.loader.read_trajectory
+        """
+        if self.sidecar is not None:
+            return self.sidecar.read(csv_path)
+        return read_trajectory(csv_path)
+
+    def evict(self, group_path):
+        if self.groups.pop(Path(group_path), None) is not None:
+            logger.debug(f"Evicted {group_path} from the trajectory cache")
+        # The batch is done, keep what it added to the sidecar cache
+        if self.sidecar is not None:
+            self.sidecar.flush()
+
+    def clear(self):
+        self.groups = {}
+
+    def __len__(self):
+        return len(self.groups)
+
+
+class SidecarCache():
+    """
+    On-disk cache of parsed position csv files as .npy arrays, read back memory-mapped.
+    Entries are keyed by the csv path and validated against its size, mtime and sha1,
+    the least recently used entries are removed once the cache exceeds budget bytes.
+    New entries are only kept in memory until flush(), called once per batch and at the end of a run,
+    which merges them into the index on disk under a lock, so runs sharing the cache keep each other's entries.
+    """
+
+    INDEX_NAME = "index.json"
+    LOCK_NAME = "index.lock"
+    ORPHAN_AGE = 3600 # seconds, younger unindexed files may belong to a run that has not flushed yet
+
+    def __init__(self, cache_dir, budget=TRAJECTORY_CACHE_BUDGET):
+
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.cache_dir / self.INDEX_NAME
+        self.lock = FileLock(self.cache_dir / self.LOCK_NAME)
+        self.budget = budget
+
+        self.hits = 0
+        self.misses = 0
+
+        self.index = self.load_index()
+        self.total_size = sum(entry.get("bytes", 0) for entry in self.index.values())
+        self.dirty = False # index changed since it was last saved
+        self.touched = set() # keys added or used since the last flush
+        self.dropped = set() # keys removed since the last flush
+
+    def load_index(self):
+        if not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            logger.warning(f"Unreadable trajectory cache index at {self.index_path}, starting empty")
+            return {}
+
+    def merge_index(self):
+        """
+        Apply the changes of this run to the index on disk, which other runs may have changed since it was loaded
+        """
+        merged = self.load_index()
+        for key in self.dropped - self.touched:
+            merged.pop(key, None)
+        for key in self.touched:
+            entry = self.index.get(key)
+            if entry is None:
+                continue
+            on_disk = merged.get(key)
+            if on_disk is not None and on_disk["hash"] == entry["hash"]:
+                entry["last_used"] = max(entry["last_used"], on_disk["last_used"])
+            merged[key] = entry
+
+        self.index = merged
+        self.total_size = sum(entry.get("bytes", 0) for entry in self.index.values())
+
+    def save_index(self):
+        # unique temp name, two runs on the same project must not write the same temp file
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix="index-", suffix=".tmp")
+        try:
+            with os.fdopen(handle, 'w') as file:
+                json.dump(self.index, file, indent=4)
+            os.replace(temp_path, self.index_path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+        self.dirty = False
+        self.touched = set()
+        self.dropped = set()
+
+    def flush(self):
+        """
+        Merge with the index on disk, evict down to the budget and save the index, if anything changed since the last flush
+        """
+        if not self.dirty:
+            return
+        with self.lock:
+            self.merge_index()
+            self.evict_to_budget()
+            self.sweep_orphans()
+            self.save_index()
+
+    @staticmethod
+    def file_hash(csv_path):
+        sha1 = hashlib.sha1()
+        with open(csv_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def is_valid(self, entry, csv_path, stat):
+        """
+        An entry stays valid while the csv keeps its size and mtime,
+        or, when only the mtime moved (copy, touch), while its content hash is unchanged.
+        """
+        if entry["size"] != stat.st_size:
+            return False
+        if not all((self.cache_dir / entry[name]).exists() for name in ("coords", "frames")):
+            return False
+        if entry["mtime"] == stat.st_mtime_ns:
+            return True
+        if entry["hash"] == self.file_hash(csv_path):
+            entry["mtime"] = stat.st_mtime_ns
+            return True
+        return False
+
+    def read(self, csv_path):
+        """
+        Return the trajectory of csv_path, memory-mapped from the cache or parsed and stored on a miss.
+        Hits only update last_used in memory, call flush() at the end of the run to keep them.
+        :return: (coords, frames, axes), see Libs.loader.read_trajectory
+        """
+        key = str(Path(csv_path).resolve())
+        stat = os.stat(csv_path)
+        entry = self.index.get(key)
+
+        if entry is not None and self.is_valid(entry, csv_path, stat):
+            self.hits += 1
+            entry["last_used"] = time.time()
+            self.touched.add(key)
+            self.dirty = True
+            coords = np.load(self.cache_dir / entry["coords"], mmap_mode='r')
+            frames = np.load(self.cache_dir / entry["frames"], mmap_mode='r')
+            return coords, frames, entry["axes"]
+
+        self.misses += 1
+        if entry is not None:
+            logger.debug(f"{csv_path} changed since it was cached, parsing again")
+            self.remove(key)
+
+        coords, frames, axes = read_trajectory(csv_path)
+
+        name = hashlib.sha1(key.encode()).hexdigest()
+        entry = {"coords": f"{name}.npy",
+                 "frames": f"{name}-frames.npy",
+                 "axes": axes,
+                 "size": stat.st_size,
+                 "mtime": stat.st_mtime_ns,
+                 "hash": self.file_hash(csv_path),
+                 "last_used": time.time()}
+        np.save(self.cache_dir / entry["coords"], coords)
+        np.save(self.cache_dir / entry["frames"], frames)
+        entry["bytes"] = sum((self.cache_dir / entry[name]).stat().st_size for name in ("coords", "frames"))
+        self.index[key] = entry
+        self.total_size += entry["bytes"]
+        self.touched.add(key)
+        self.dirty = True
+
+        return coords, frames, axes
+
+    def remove(self, key):
+        entry = self.index.pop(key, None)
+        if entry is None:
+            return
+        self.total_size -= entry.get("bytes", 0)
+        self.touched.discard(key)
+        self.dropped.add(key)
+        self.dirty = True
+        for name in ("coords", "frames"):
+            try:
+                (self.cache_dir / entry[name]).unlink(missing_ok=True)
+            except OSError as e:
+                # e.g. the file is still memory-mapped on Windows, it will be overwritten later
+                logger.warning(f"Could not remove {entry[name]} from the trajectory cache: {e}")
+
+    def total_bytes(self):
+        return self.total_size
+
+    def evict_to_budget(self):
+        if self.total_size <= self.budget:
+            return
+        # Least recently used first
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_used"]):
+            if self.total_size <= self.budget:
+                break
+            logger.debug(f"Trajectory cache over budget, evicting {key}")
+            self.remove(key)
+
+    def sweep_orphans(self, min_age=ORPHAN_AGE):
+        """
+        Delete the cached arrays and temp files that no index entry refers to, e.g. left by a crashed run
+        or by a run whose index was replaced by another one
+        :param min_age: seconds, younger files are kept
+        """
+        referenced = {entry[name] for entry in self.index.values() for name in ("coords", "frames")}
+        now = time.time()
+        for path in list(self.cache_dir.glob("*.npy")) + list(self.cache_dir.glob("*.tmp")):
+            if path.name in referenced:
+                continue
+            try:
+                if now - path.stat().st_mtime < min_age:
+                    continue
+                path.unlink()
+                logger.debug(f"Removed {path.name}, not in the trajectory cache index")
+            except OSError as e:
+                logger.warning(f"Could not remove {path.name} from the trajectory cache: {e}")
+
+    def clear(self):
+        with self.lock:
+            self.merge_index()
+            for key in list(self.index):
+                self.remove(key)
+            self.sweep_orphans(min_age=0)
+            self.save_index()
@@ -9,6 +9,137 @@ def calculate_distance(start_point, end_point):
     return math.sqrt((start_point[0]-end_point[0])**2 + (start_point[1]-end_point[1])**2)
 
 
+def step_lengths(coords, conversion_rate=1, decimals=None):
+    """
+    Compute every frame-to-frame displacement of a 2D or 3D trajectory in one array operation.
+    :param coords: array-like of shape (FRAMES, AXES), one column per axis (X, Y[, Z])
+    :param conversion_rate: divisor applied to every step (pixel/cm)
+    :param decimals: if given, round the steps to this number of decimals
+    :return: ndarray of shape (FRAMES-1,)
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if coords.ndim != 2:
+        raise ValueError(f"Expected coordinates of shape (FRAMES, AXES), got {coords.shape}")
+
+    deltas = np.diff(coords, axis=0)
+
+    # Accumulate axis by axis, same order as the scalar loop, so the sums are bit-identical
+    squared = deltas[:, 0] ** 2
+    for axis in range(1, deltas.shape[1]):
+        squared += deltas[:, axis] ** 2
+
+    steps = np.sqrt(squared)
+    steps /= conversion_rate
+    if decimals is not None:
+        steps = np.round(steps, decimals)
+
+    return steps
+
+
+def center_points(center_params, worm_nums=None):
+    """
+    Convert a CENTER block of parameters.json into an array of center points.
+    :param center_params: one well, e.g. {"X": 252, "Y": 209}, or the whole block, e.g. {"1": {"X": 252, "Y": 209}, ...}
+    :param worm_nums: wells to take from the whole block, in stacking order (default: all wells, sorted)
+    :return: (axes, centers) with centers of shape (AXES,) for one well or (WORMS, AXES) for the whole block
+    """
+    if all(isinstance(value, dict) for value in center_params.values()):
+        if worm_nums is None:
+            worm_nums = sorted(center_params.keys(), key=int)
+        wells = [center_params[str(worm_num)] for worm_num in worm_nums]
+        axes = list(wells[0].keys())
+        centers = np.array([[well[axis] for axis in axes] for well in wells], dtype=np.float64)
+    else:
+        axes = list(center_params.keys())
+        centers = np.array([center_params[axis] for axis in axes], dtype=np.float64)
+
+    return axes, centers
+
+
+def center_distances(coords, centers, conversion_rate=1, center_range=None, decimals=None):
+    """
+    Compute the distance of every frame to its well center and the in-center mask in one pass.
+    A stack of worms can be processed together, each one against its own center.
+    :param coords: array-like of shape (FRAMES, AXES), or (WORMS, FRAMES, AXES) for a stack of worms
+    :param centers: array-like of shape (AXES,), or (WORMS, AXES) with one center per worm
+    :param conversion_rate: divisor applied to every distance (pixel/cm)
+    :param center_range: frames with distance <= center_range are in the center, if None no mask is computed
+    :param decimals: if given, round the distances to this number of decimals (before the range test)
+    :return: (distances, in_center) with distances of shape coords.shape[:-1] and in_center a boolean array or None
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    centers = np.asarray(centers, dtype=np.float64)
+    if coords.shape[-1] != centers.shape[-1]:
+        raise ValueError(f"Coordinates have {coords.shape[-1]} axes but centers have {centers.shape[-1]}")
+
+    deltas = coords - centers[..., np.newaxis, :]
+
+    squared = deltas[..., 0] ** 2
+    for axis in range(1, deltas.shape[-1]):
+        squared += deltas[..., axis] ** 2
+
+    distances = np.sqrt(squared)
+    distances /= conversion_rate
+    if decimals is not None:
+        distances = np.round(distances, decimals)
+
+    if center_range is None:
+        in_center = None
+    else:
+        in_center = distances <= center_range
+
+    return distances, in_center
+
+
+SPIKE_POLICIES = ("previous", "interpolate", "median")
+
+
+def correct_speed_spikes(speeds, threshold, policy="previous", window=31):
+    """
+    Replace the tracking spikes (speed >= threshold) of a speed series, in linear time.
+    :param speeds: array-like of speeds
+    :param threshold: speeds at or above this value are spikes
+    :param policy: "previous": last valid speed before the spike (forward fill), spikes with no valid speed before are kept
+                   "interpolate": linear interpolation between the valid speeds around the spike, clamped at both ends
+                   "median": median of the valid speeds in a centered window, spikes with no valid speed in the window are kept
+    :param window: window size in frames, for the "median" policy
+    :return: (corrected speeds, number of replaced frames)
+    """
+    if policy not in SPIKE_POLICIES:
+        raise ValueError(f"Unknown spike policy {policy}, expected one of {SPIKE_POLICIES}")
+
+    speeds = np.asarray(speeds, dtype=np.float64)
+    corrected = speeds.copy()
+
+    spikes = np.flatnonzero(speeds >= threshold)
+    valid = speeds < threshold
+    if spikes.size == 0 or not valid.any():
+        return corrected, 0
+
+    if policy == "previous":
+        # Index of the last valid frame at or before every frame, -1 if there is none
+        last_valid = np.maximum.accumulate(np.where(valid, np.arange(speeds.size), -1))
+        source = last_valid[spikes]
+        replaced = source >= 0
+        corrected[spikes[replaced]] = speeds[source[replaced]]
+        replace_count = int(np.count_nonzero(replaced))
+
+    elif policy == "interpolate":
+        valid_index = np.flatnonzero(valid)
+        corrected[spikes] = np.interp(spikes, valid_index, speeds[valid_index])
+        replace_count = int(spikes.size)
+
+    elif policy == "median":
+        valid_speeds = pd.Series(np.where(valid, speeds, np.nan))
+        medians = valid_speeds.rolling(window, center=True, min_periods=1).median().to_numpy()
+        fill = medians[spikes]
+        replaced = ~np.isnan(fill)
+        corrected[spikes[replaced]] = fill[replaced]
+        replace_count = int(np.count_nonzero(replaced))
+
+    return corrected, replace_count
+
+
 def calculate_turning_angle(x1, y1, x2, y2, x3, y3):
     """
     Compute the turning angle (in degrees) at point B=(x2, y2) for a path defined by points A=(x1, y1), B=(x2, y2), and C=(x3, y3).
@@ -50,295 +181,333 @@ def calculate_turning_angle(x1, y1, x2, y2, x3, y3):
     return theta_deg
 
 
-def FD_Entropy_Calculator_2D(input_df):
-    EPSILON = 1e-10
+def turning_angles_array(coords, interval=1):
+    """
+    Compute the signed turning angles (in degrees) of a whole trajectory in one array operation.
+    Same formula and convention as calculate_turning_angle: arccos of the clamped cosine, a positive cross product
+    gives a negative angle, and a zero-length step gives +90 degrees.
+    arccos is kept (rather than arctan2) for its values at reversals, most give 179.9999988 and not 180,
+    which the modulo 180 of the angular velocity would fold to 0.
+    :param coords: array-like of shape (FRAMES, 2), X and Y
+    :param interval: the interval between two points
+    :return: ndarray of shape (len(coords[::interval]) - 2,)
+    """
+    points = np.asarray(coords, dtype=np.float64)[::interval]
+    if len(points) < 3:
+        return np.empty(0, dtype=np.float64)
+
+    D1 = points[1:-1] - points[:-2]
+    D2 = points[2:] - points[1:-1]
 
-    def countif(input_list, threshold, less=True):
-        count = 0
-        for value in input_list:
-            if less and value < threshold:
-                count += 1
-            elif not less and value > threshold:
-                count += 1
-        return count
+    dot_product = D1[:, 0]*D2[:, 0] + D1[:, 1]*D2[:, 1]
+    cross_product = D1[:, 0]*D2[:, 1] - D1[:, 1]*D2[:, 0]
+
+    # float_power is the libm pow of the scalar x**2, which is not always the rounded x*x
+    mag_D1 = np.sqrt(np.float_power(D1[:, 0], 2) + np.float_power(D1[:, 1], 2))
+    mag_D2 = np.sqrt(np.float_power(D2[:, 0], 2) + np.float_power(D2[:, 1], 2))
+    magnitudes = mag_D1 * mag_D2
+
+    zero_step = magnitudes == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_theta = dot_product / magnitudes
+    cos_theta[zero_step] = 0
+    cos_theta[np.isnan(cos_theta)] = 1 # missing coordinates, max(-1, min(1, nan)) == 1 in the scalar version
+    np.clip(cos_theta, -1, 1, out=cos_theta)
+
+    theta_deg = np.degrees(np.arccos(cos_theta))
+
+    np.negative(theta_deg, out=theta_deg, where=cross_product > 0)
+
+    return theta_deg
+
+
+RAGGED_RULES = ("keep", "drop")
+
+
+def angular_velocity_bins(turning_angles, chunk_size, ragged="keep"):
+    """
+    Sum the turning angles of every chunk (one chunk per second) and fold the absolute sums into [0, 180).
+    :param turning_angles: array-like of signed turning angles (degree)
+    :param chunk_size: number of turning angles per chunk
+    :param ragged: rule for a last chunk shorter than chunk_size,
+                   "keep" sums it as a chunk of its own, "drop" discards it
+    :return: ndarray of angular velocities (degree/s), one per chunk
+    """
+    if ragged not in RAGGED_RULES:
+        raise ValueError(f"Unknown ragged chunk rule {ragged}, expected one of {RAGGED_RULES}")
+    if chunk_size < 1:
+        raise ValueError(f"Chunk size must be at least 1, got {chunk_size}")
 
-    x_list = input_df['X'] # A
-    y_list = input_df['Y'] # B
+    angles = np.asarray(turning_angles, dtype=np.float64)
+    full_chunks = len(angles) // chunk_size
+    ragged_tail = angles[full_chunks * chunk_size:]
+    if ragged == "drop" or ragged_tail.size == 0:
+        ragged_tail = None
 
-    FRAMES = len(x_list)
+    # One row per chunk. Columns are added left to right, like sum() over a slice, because the
+    # modulo 180 below turns a rounding difference near a multiple of 180 into a large jump
+    chunks = angles[:full_chunks * chunk_size].reshape(full_chunks, chunk_size)
+    chunk_sums = np.zeros(full_chunks, dtype=np.float64)
+    for k in range(chunk_size):
+        chunk_sums += chunks[:, k]
 
-    times = [i/50 for i in range(FRAMES)] # C
+    if ragged_tail is not None:
+        chunk_sums = np.append(chunk_sums, np.cumsum(ragged_tail)[-1])
 
-    delta_x = {} # D
-    delta_y = {} # E
-    delta_r = {} # F
-    thetas = {}  # G
+    return np.abs(chunk_sums) % 180
 
-    for i in range(FRAMES):
-        if i == 0:
+
+def profile_intervals(intervals, frame_rate):
+    """
+    Keep the intervals of an angular velocity profile that divide the frame rate,
+    a second of angular velocity must hold a whole number of sampled points.
+    :param intervals: list of intervals (frames), e.g. AV_PROFILE_INTERVALS
+    :param frame_rate: frames per second
+    :return: list of int intervals, in the given order and without repeats
+    """
+    kept = []
+    for interval in intervals:
+        interval = int(interval)
+        if interval < 1 or interval > frame_rate or frame_rate % interval != 0:
+            logger.warning(f"Interval {interval} does not divide {frame_rate=}, it is left out of the angular velocity profile")
             continue
-        temp_x = x_list[i] - x_list[i-1]
-        temp_y = y_list[i] - y_list[i-1]
-        temp_r = math.sqrt(temp_x**2 + temp_y**2)
-
-        delta_x[i] = temp_x
-        delta_y[i] = temp_y
-        delta_r[i] = temp_r
-
-        if i>1:
-            dot_product = (delta_x[i]*delta_x[i-1] + delta_y[i]*delta_y[i-1])
-            product_of_magnitudes = (delta_r[i]*delta_r[i-1])
-            value = dot_product / (product_of_magnitudes + EPSILON)
-            value = max(-1, min(1, value))
-            temp_theta = math.acos(value)*180/math.pi
-            thetas[i] = temp_theta
-
-    # r is renamed as thresholds # H
-    N1 = {} # I
-    # N2 = {} # J
-    Cr = {} # K
-    sigma = {} # L
-    logr = {} # M
-    logCr = {} # N
-    
-    thresholds = [(i+1)/10 for i in range(FRAMES)]
-    index_1 = thresholds.index(1)
-    thresholds = thresholds[:index_1] + [1.01] + thresholds[(index_1+1):]
-    # thresholds[:20] 
+        if interval not in kept:
+            kept.append(interval)
+
+    return kept
 
-    for i in range(FRAMES):
-        N1[i] = countif(list(delta_r.values()), thresholds[i])
-        Cr[i] = N1[i] / (FRAMES - 1)
 
-        try:
-            logCr[i] = math.log10(Cr[i])
-        except Exception as e:
-            logger.error(f"At i = {i}, Cr[i] = {Cr[i]}")
-            logger.error(f"Set Cr[i] to 10e-10")
-            Cr[i] = 10e-10
-            logCr[i] = math.log10(Cr[i])
+FD_TABLE_INDEX = list(range(5, -6, -1)) # rows of the log-log regression table, around log r = 0
+FD_MIN_FRAMES = 14 # the regression reads thresholds up to (13+1)/10
 
-        sigma[i] = math.log10(Cr[i]) / math.log10(thresholds[i])
-        logr[i] = math.log10(thresholds[i])
 
+def fd_thresholds(frames):
+    """
+    Return the r thresholds that enter the log-log regression, in table order.
+    The spreadsheet method builds (i+1)/10 for every frame, with r = 1 replaced by 1.01,
+    but only the 11 thresholds around log r = 0 are used, so only those are built here.
+    :param frames: number of frames of the trajectory
+    :return: list of 11 thresholds
+    """
+    if frames < FD_MIN_FRAMES:
+        raise ValueError(f"At least {FD_MIN_FRAMES} frames are needed for the fractal dimension, got {frames}")
+
+    thresholds = [(i+1)/10 for i in range(FD_MIN_FRAMES)]
+    index_1 = thresholds.index(1)
+    thresholds = thresholds[:index_1] + [1.01] + thresholds[(index_1+1):]
+
+    # Position of the largest log r below 0
     APPROCH = 0.000
     neg_close = -math.inf
     neg_close_pos = -1
-    for i, value in enumerate(list(logr.values())):
+    for i, threshold in enumerate(thresholds):
+        value = math.log10(threshold)
         if value < APPROCH and value > neg_close:
             neg_close = value
             neg_close_pos = i
 
-    table_index = list(range(-5, 6))
-    table_index.reverse()
-
-    FD_df = pd.DataFrame(columns=['number', 'logr', 'logCr', 'x-xbar', 'y-ybar', 
-                                  '(x-xbar)(y-ybar)', '(x-xbar)2', '(y-ybar)2', '[yi-(a+bxi)]2'])
-    FD_df['number'] = table_index
-    LEN = len(table_index)
-
-    for row in range(LEN):
-        num = table_index[row]
-        num = num + neg_close_pos
-        FD_df.iloc[row, 1] = logr[num]
-        FD_df.iloc[row, 2] = logCr[num]
-
-    col1 = np.array(FD_df['logr'])
-    col2 = np.array(FD_df['logCr'])
-    col1_avg = np.average(col1)
-    col2_avg = np.average(col2)
-
-    for row in range(LEN):
-        FD_df.iloc[row, 3] = FD_df.iloc[row, 1] - col1_avg
-        FD_df.iloc[row, 4] = FD_df.iloc[row, 2] - col2_avg
-        FD_df.iloc[row, 5] = FD_df.iloc[row, 3] * FD_df.iloc[row, 4]
-        FD_df.iloc[row, 6] = FD_df.iloc[row, 3]**2
-        FD_df.iloc[row, 7] = FD_df.iloc[row, 4]**2
-
-    variable_b = np.sum(np.array(list(FD_df['(x-xbar)(y-ybar)']))) / np.sum(np.array(list(FD_df['(x-xbar)2'])))
-    variable_a = col2_avg - col1_avg * variable_b
-
-    for row in range(LEN):
-        FD_df.iloc[row, 8] = (FD_df.iloc[row, 2] - (variable_a + variable_b * FD_df.iloc[row, 1]))**2
-
-    variable_s = np.sqrt(np.sum(FD_df['[yi-(a+bxi)]2']) / (LEN - 2))
-    variable_bErr = variable_s / np.sqrt(np.sum(FD_df['(x-xbar)2']))
-    variable_aErr = variable_s * np.sqrt((1 / LEN) + col1_avg**2 / np.sum(FD_df['(x-xbar)2']))
+    return [thresholds[num + neg_close_pos] for num in FD_TABLE_INDEX]
 
-    def get_entropy():
-        G_array = np.array(list(thetas.values()))
-        G_count = (G_array >= 90).sum()
-        G_count2 = (G_array < 90).sum()
-        G_len = G_array.size
 
-        result = (-1) * G_count/G_len * np.log2(G_count/G_len) - G_count2/G_len * np.log2(G_count2/G_len)
-
-        return result
+def log_correlation(delta_r, frames):
+    """
+    Compute log r and log C(r) at the regression thresholds.
+    The step lengths are sorted once and counted with binary search, instead of one full scan per threshold.
+    :param delta_r: array of step lengths, FRAMES-1 values
+    :param frames: number of frames of the trajectory
+    :return: (logr, logCr), two lists in table order
+    """
+    thresholds = fd_thresholds(frames)
+    counts = correlation_counts(delta_r, thresholds)
 
-    #H (Entropy)
-    Entropy = get_entropy()
+    return log_correlation_from_counts(counts, frames)
 
-    FractalDimension = variable_b
 
-    # Entropy calculation for 2D movement (optional)
-    # Entropy calculation in 2D is context-dependent and might require different approaches
+def correlation_counts(delta_r, thresholds):
+    """
+    Count the step lengths strictly shorter than each threshold.
+    Counts of consecutive pieces of a trajectory add up, so a long recording can be counted chunk by chunk.
+    :param delta_r: array of step lengths
+    :param thresholds: thresholds from fd_thresholds
+    :return: ndarray of counts, one per threshold
+    """
+    sorted_r = np.sort(np.asarray(delta_r, dtype=np.float64))
+    # NaN are sorted last and never counted
+    return np.searchsorted(sorted_r, thresholds, side='left')
 
-    return FractalDimension, Entropy
 
-# Example usage
-# input_df = pd.DataFrame({'X': [1, 2, 3], 'Y': [4, 5, 6]})
-# FD, Entropy = FD_Entropy_Calculator_2D(input_df)
+def log_correlation_from_counts(counts, frames):
+    """
+    Compute log r and log C(r) from the counts of correlation_counts.
+    :param counts: counts at the thresholds of fd_thresholds(frames)
+    :param frames: number of frames of the trajectory
+    :return: (logr, logCr), two lists in table order
+    """
+    thresholds = fd_thresholds(frames)
+    counts = np.asarray(counts).tolist()
 
+    logr = []
+    logCr = []
+    for threshold, count in zip(thresholds, counts):
+        Cr = count / (frames - 1)
+        if Cr == 0:
+            logger.error(f"At r = {threshold}, Cr = {Cr}")
+            logger.error(f"Set Cr to 10e-10")
+            Cr = 10e-10
+        logr.append(math.log10(threshold))
+        logCr.append(math.log10(Cr))
 
+    return logr, logCr
 
-def FD_Entropy_Calculator_3D(input_df):
 
-    def countif(input_list, threshold, less=True):
-        count = 0
-        for value in input_list:
-            if less and value < threshold:
-                count+=1
-            elif not less and value > threshold:
-                count+=1
-            
-        return count
-
-    x_list = input_df['X']
-    y_list = input_df['Y']
-    z_list = input_df['Z']
-
-    FRAMES = len(x_list)
-    
-    times = [i/50 for i in range(FRAMES)] # D
+def turning_entropy(deltas, delta_r, EPSILON = 1e-10):
+    """
+    Compute the entropy of the turning directions, split into turns of at least 90 degrees and the rest.
+    :param deltas: array of shape (FRAMES-1, AXES), frame-to-frame displacements
+    :param delta_r: array of shape (FRAMES-1,), their lengths
+    :return: entropy (bits)
+    """
+    wide = wide_turns(deltas, delta_r, EPSILON = EPSILON)
 
-    delta_x = {} #E
-    delta_y = {} #F
-    delta_z = {} #G
-    delta_r = {} #H
-    thetas = {}  #I  
+    return entropy_from_counts(int(np.count_nonzero(wide)), wide.size)
 
-    for i in range(FRAMES):
-        if i==0:
-            continue
-        temp_x = x_list[i] - x_list[i-1]
-        temp_y = y_list[i] - y_list[i-1]
-        temp_z = z_list[i] - z_list[i-1]
-        temp_r = math.sqrt(temp_x**2+temp_y**2+temp_z**2)
-
-        delta_x[i] = temp_x
-        delta_y[i] = temp_y
-        delta_z[i] = temp_z
-        delta_r[i] = temp_r
-
-        if i>1:
-            dot_product = (delta_x[i]*delta_x[i-1] + delta_y[i]*delta_y[i-1] + delta_z[i]*delta_z[i-1])
-            product_of_magnitudes = (delta_r[i]*delta_r[i-1])
-            value = dot_product / (product_of_magnitudes + EPSILON)
-            value = max(-1, min(1, value))
-            temp_theta = math.acos(value)*180/math.pi
-            thetas[i] = temp_theta
-
-    # r          #J
-    N1 = {}      #K
-    # N2 = {}       #L
-    Cr = {}      #M
-    sigma = {}   #N
-    logr = {}    #O
-    logCr = {}   #P
-    
-    thresholds = [(i+1)/10 for i in range(FRAMES)]
-    index_1 = thresholds.index(1)
-    thresholds = thresholds[:index_1] + [1.01] + thresholds[(index_1+1):]
-    thresholds[:20]
 
-    for i in range(FRAMES):
-        N1[i] = countif(list(delta_r.values()), thresholds[i])
-        Cr[i] = N1[i] / (FRAMES - 1)
+def wide_turns(deltas, delta_r, EPSILON = 1e-10):
+    """
+    Flag the turns of at least 90 degrees between consecutive displacements.
+    :param deltas: array of shape (STEPS, AXES), frame-to-frame displacements
+    :param delta_r: array of shape (STEPS,), their lengths
+    :return: boolean array of shape (STEPS-1,)
+    """
+    dot_product = deltas[1:, 0] * deltas[:-1, 0]
+    for axis in range(1, deltas.shape[1]):
+        dot_product += deltas[1:, axis] * deltas[:-1, axis]
+    product_of_magnitudes = delta_r[1:] * delta_r[:-1]
 
-        try:
-            logCr[i] = math.log10(Cr[i])
-        except Exception as e:
-            logger.error(f"At i = {i}, Cr[i] = {Cr[i]}")
-            logger.error(f"Set Cr[i] to 10e-10")
-            Cr[i] = 10e-10
-            logCr[i] = math.log10(Cr[i])
+    value = dot_product / (product_of_magnitudes + EPSILON)
+    value[np.isnan(value)] = 1 # max(-1, min(1, nan)) == 1
+    value = np.clip(value, -1, 1)
 
-        sigma[i] = math.log10(Cr[i])/math.log10(thresholds[i])
-        logr[i] = math.log10(thresholds[i])
+    # acos is decreasing, so theta >= 90 is value <= 0, except for values that round to 90 degrees exactly
+    wide = value <= 0
+    near = np.flatnonzero(np.abs(value) < 1e-8)
+    for i in near.tolist():
+        wide[i] = math.acos(value[i])*180/math.pi >= 90
 
-        
+    return wide
 
-    APPROCH = 0.000
-    neg_close = math.inf*(-1)
-    neg_close_pos = -1
-    for i, value in enumerate(list(logr.values())):
-        if value < APPROCH and value > neg_close:
-            neg_close = value
-            neg_close_pos = i
 
-    table_index = list(range(-5, 6))
-    table_index.reverse()
+def entropy_from_counts(G_count, G_len):
+    """
+    Entropy of G_count wide turns out of G_len turns, see turning_entropy
+    """
+    G_count2 = G_len - G_count
 
-    FD_df = pd.DataFrame(columns = ['number', 'logari', 'logariC', 'x-xbar', 'y-ybar', 
-                            '(x-xbar)(y-ybar)', '(x-xbar)2', '(y-ybar)2', '[yi-(a+bxi)]2'])
+    result = (-1) * G_count/G_len * np.log2(G_count/G_len) - G_count2/G_len * np.log2(G_count2/G_len)
 
-    FD_df['number'] = table_index
-    LEN = len(table_index)
+    return result
 
-    for row in range(LEN):
-        num = table_index[row]
-        num = num + neg_close_pos
-        FD_df.iloc[row,1] = logr[num]                             # R
-        FD_df.iloc[row,2] = logCr[num]                            # S
 
-    col1 = np.array(list(FD_df['logari']))
-    col2 = np.array(list(FD_df['logariC']))
-    col1_avg = np.average(col1)                                     # average of R
-    col2_avg = np.average(col2)                                     # average of S
+def loglog_fit(logr, logCr, fit_stats=False):
+    """
+    Least-squares fit of log C(r) against log r, in closed form.
+    Sums are taken in the same order as the spreadsheet table, so the slope is bit-identical to it.
+    :param logr: array of shape (..., LEN), one row per worm
+    :param logCr: array of shape (..., LEN)
+    :param fit_stats: also compute the intercept, standard errors and R squared
+    :return: slope b of shape (...,), and with fit_stats a dict with a, s, bErr, aErr and RR
+    """
+    col1 = np.asarray(logr, dtype=np.float64)
+    col2 = np.asarray(logCr, dtype=np.float64)
+    LEN = col1.shape[-1]
 
-    for row in range(LEN):
-        FD_df.iloc[row,3] = FD_df.iloc[row,1] - col1_avg             # T
-        FD_df.iloc[row,4] = FD_df.iloc[row,2] - col2_avg             # U
-        FD_df.iloc[row,5] = FD_df.iloc[row,3] * FD_df.iloc[row,4]    # V
-        FD_df.iloc[row,6] = FD_df.iloc[row,3]**2                     # W
-        FD_df.iloc[row,7] = FD_df.iloc[row,4]**2                     # X
+    # Left-to-right averages, like np.average over the object columns of the table
+    col1_sum = col1[..., 0].copy()
+    col2_sum = col2[..., 0].copy()
+    for k in range(1, LEN):
+        col1_sum += col1[..., k]
+        col2_sum += col2[..., k]
+    col1_avg = col1_sum / LEN
+    col2_avg = col2_sum / LEN
 
-    #P4 =SUM(U16:U26)/SUM(V16:V26)
-    #P5 =AVERAGE(Q16:Q26)-P4*AVERAGE(P16:P26)
+    x_xbar = col1 - col1_avg[..., np.newaxis]
+    y_ybar = col2 - col2_avg[..., np.newaxis]
+    sum_xy = np.sum(x_xbar * y_ybar, axis=-1)
+    sum_xx = np.sum(x_xbar ** 2, axis=-1)
 
-    variable_b = np.sum(np.array(list(FD_df['(x-xbar)(y-ybar)']))) / np.sum(np.array(list(FD_df['(x-xbar)2'])))     # P4
-    variable_a = col2_avg - col1_avg*variable_b                                                                     # P5
+    variable_b = sum_xy / sum_xx
 
-    # '[yi-(a+bxi)]2' =(Q16-($P$5+$P$4*P16))^2
-    for row in range(LEN):
-            FD_df.iloc[row,8] = (FD_df.iloc[row,2]-(variable_a+variable_b*FD_df.iloc[row,1]))**2     # Y
-        
-    #P6 =SQRT(SUM(X16:X26)/(COUNT(X16:X26)-2))
-    variable_s = np.sqrt( np.sum(np.array(list(FD_df['[yi-(a+bxi)]2']))) / (LEN-2) )
+    if not fit_stats:
+        return variable_b
 
-    #R4 =P6/SQRT(SUM(V16:V26))
-    variable_bErr = variable_s / np.sqrt(np.sum(np.array(list(FD_df['(x-xbar)2'])))) 
+    variable_a = col2_avg - col1_avg * variable_b
+    residuals = (col2 - (variable_a[..., np.newaxis] + variable_b[..., np.newaxis] * col1)) ** 2
+    sum_yy = np.sum(y_ybar ** 2, axis=-1)
 
-    #R5 =P6*SQRT((1/COUNT(X16:X26))+(AVERAGE(P16:P26)^2)/SUM(V16:V26))
-    variable_aErr = variable_s*np.sqrt((1/LEN)+col1_avg**2/np.sum(np.array(list(FD_df['(x-xbar)2']))))
+    variable_s = np.sqrt(np.sum(residuals, axis=-1) / (LEN - 2))
+    stats = {
+        "a": variable_a,
+        "s": variable_s,
+        "bErr": variable_s / np.sqrt(sum_xx),
+        "aErr": variable_s * np.sqrt((1 / LEN) + col1_avg ** 2 / sum_xx),
+        "RR": sum_xy ** 2 / (sum_xx * sum_yy),
+    }
 
-    #RR = =(SUM(U16:U26)^2)/(SUM(V16:V26)*SUM(W16:W26))
-    variable_RR = np.sum(np.array(list(FD_df['(x-xbar)(y-ybar)'])))**2 / (np.sum(np.array(list(FD_df['(x-xbar)2']))) * np.sum(np.array(list(FD_df['(y-ybar)2']))))
+    return variable_b, stats
 
-    def get_entropy():
-        G_array = np.array(list(thetas.values()))
-        G_count = (G_array >= 90).sum()
-        G_count2 = (G_array < 90).sum()
-        G_len = G_array.size
 
-        result = (-1) * G_count/G_len * np.log2(G_count/G_len) - G_count2/G_len * np.log2(G_count2/G_len)
+def FD_Entropy_Calculator(coords, fit_stats=False):
+    """
+    Compute the fractal dimension and the entropy of one trajectory, or of a batch of trajectories, for any number of axes.
+    :param coords: array-like of shape (FRAMES, AXES), a stack of shape (WORMS, FRAMES, AXES),
+                   or a list of (FRAMES, AXES) arrays of different lengths
+    :param fit_stats: also return the regression statistics of loglog_fit
+    :return: (FractalDimension, Entropy), scalars for one trajectory or arrays for a batch,
+             followed by the statistics dict when fit_stats is True
+    """
+    single = isinstance(coords, (np.ndarray, pd.DataFrame)) and np.ndim(coords) == 2
+    trajectories = [coords] if single else list(coords)
+
+    logr_rows = []
+    logCr_rows = []
+    entropies = []
+    for trajectory in trajectories:
+        trajectory = np.asarray(trajectory, dtype=np.float64)
+        FRAMES = len(trajectory)
+
+        deltas = np.diff(trajectory, axis=0)
+        squared = deltas[:, 0] ** 2
+        for axis in range(1, deltas.shape[1]):
+            squared += deltas[:, axis] ** 2
+        delta_r = np.sqrt(squared)
+
+        logr, logCr = log_correlation(delta_r, FRAMES)
+        logr_rows.append(logr)
+        logCr_rows.append(logCr)
+        entropies.append(turning_entropy(deltas, delta_r))
+
+    result = loglog_fit(logr_rows, logCr_rows, fit_stats=fit_stats)
+    if fit_stats:
+        FractalDimension, stats = result
+    else:
+        FractalDimension = result
+    Entropy = np.array(entropies, dtype=np.float64)
+
+    if single:
+        FractalDimension = FractalDimension[0]
+        Entropy = Entropy[0]
+        if fit_stats:
+            stats = {key: value[0] for key, value in stats.items()}
+
+    if fit_stats:
+        return FractalDimension, Entropy, stats
+    return FractalDimension, Entropy
 
-        return result
 
-    #H (Entropy)
-    variable_Entropy = get_entropy()
+def FD_Entropy_Calculator_2D(input_df):
+    # Only the XY plane is used, even when the trajectory has a Z column
+    return FD_Entropy_Calculator(input_df[['X', 'Y']].to_numpy())
 
-    FractalDimension = variable_b
-    Entropy = variable_Entropy
 
-    return FractalDimension, Entropy
\ No newline at end of file
+def FD_Entropy_Calculator_3D(input_df):
+    return FD_Entropy_Calculator(input_df[['X', 'Y', 'Z']].to_numpy())
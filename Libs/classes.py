@@ -10,7 +10,7 @@ from pathlib import Path
 from . import HISTORY_PATH, PARAMS_FILE_NAME
 from . import DEFAULT_PARAMS, PARAMS_UNITS
 from Libs.dirFetch import get_static_dir
-from Libs.misc import index_to_char, to_int_or_float
+from Libs.misc import index_to_char, to_int_or_float, copy_files
 
 import logging
 logger = logging.getLogger(__name__)
@@ -1109,6 +1109,8 @@ class Importer():
         source_dir = self.source_dir
         destination_dir = self.destination_dir
 
+        copy_pairs = [] # (source csv, destination csv), copied together at the end
+
         # Generate Day folder based on self.project_data[self.project_name]
         for day_name, day_value in self.project_data[self.project_name].items():
             if day_name == "DIRECTORY":
@@ -1162,8 +1164,9 @@ class Importer():
                     # Copy all .csv file within _source_batch to destination_batch
                     for file in _source_batch.iterdir():
                         if file.suffix == ".csv":
-                            shutil.copy(file, destination_batch)
-                            logger.debug(f"Copied {file} to {destination_batch}")
+                            copy_pairs.append((file, destination_batch / file.name))
+
+        copy_files(copy_pairs)
 
 class NK_button(customtkinter.CTkButton):
     def __init__(self, parent, text, command, row, column, columnspan=1, *args, **kwargs):
@@ -1,12 +1,22 @@
 import pandas as pd
+import sqlite3
 import time
+import queue
+from multiprocessing import Manager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 
 from Libs.analyzer import GeneralAnalysis
+from Libs.stream import StreamingAnalysis
 from Libs.general import Parameters
-from Libs.misc import count_csv_file, append_df_to_excel, excel_polish, merge_cells, check_sheet_existence, remove_sheet_by_name
+from Libs.cache import TrajectoryCache, SidecarCache
+from Libs.store import DayStore
+from Libs.manifest import RunManifest, options_digest
+from Libs.misc import count_csv_file, find_worm_files
+from Libs.export import get_exporter, day_excel_path
+from Libs.results import open_results_store
 from Libs.dirFetch import get_working_dir, get_treatment_dir
-from . import CHARS
+from . import CHARS, BATCH_FOLDER_FORMAT, TRAJECTORY_CACHE_DIR, EXPORT_FORMAT, ANALYSIS_WORKERS
 
 import logging
 
@@ -86,6 +96,17 @@ def EndPoints_Adder(object):
     unit = "times"
     add_endpoint(name, value, unit)
 
+    for interval, angular_velocity in getattr(object, "angular_velocity_profile", {}).items():
+        name = f"Slow Angular Velocity Percentage (interval {interval})"
+        value = angular_velocity.slow
+        unit = "%"
+        add_endpoint(name, value, unit)
+
+        name = f"Fast Angular Velocity Percentage (interval {interval})"
+        value = angular_velocity.fast
+        unit = "%"
+        add_endpoint(name, value, unit)
+
     name = "Fractal Dimension"
     value = object.fractal_dimension
     unit = ""
@@ -99,6 +120,59 @@ def EndPoints_Adder(object):
     return endpoints
 
 
+def create_analysis(project_dir, day_num, treatment_char, group_num, worm_num, params, streaming = False, cache = None, store = None):
+    if streaming:
+        return StreamingAnalysis(project_dir = project_dir,
+                                 day_num = day_num,
+                                 treatment_char = treatment_char,
+                                 group_num = group_num,
+                                 worm_num = worm_num,
+                                 params = params)
+
+    return GeneralAnalysis(project_dir = project_dir,
+                           day_num = day_num,
+                           treatment_char = treatment_char,
+                           group_num = group_num,
+                           worm_num = worm_num,
+                           params = params,
+                           cache = cache,
+                           store = store)
+
+
+def analyze_batch(project_dir, day_num, treatment_char, group_num, worm_quantity, params,
+                  AV_interval = 1, AV_profile = None, streaming = False, day_store_dir = None, worm_nums = None, progress_queue = None):
+    """
+    Analyze the worms of one batch, run in a worker process by Executor.Worm_Adder_Parallel
+    :param day_store_dir: Day folder of an already built DayStore, or None to read the csv files
+    :param worm_nums: worms to analyze, all worm_quantity worms by default
+    :param progress_queue: queue shared with the parent, (group_num, worm_num) is put in it as each worm is done
+    :return: dictionary {worm_num: endpoints}, endpoints as returned by EndPoints_Adder
+    """
+    cache = TrajectoryCache()
+    store = DayStore(day_store_dir) if day_store_dir is not None else None
+
+    if worm_nums is None:
+        worm_nums = range(1, worm_quantity+1)
+
+    endpoints = {}
+    for worm_num in worm_nums:
+        worm = create_analysis(project_dir = project_dir,
+                               day_num = day_num,
+                               treatment_char = treatment_char,
+                               group_num = group_num,
+                               worm_num = worm_num,
+                               params = params,
+                               streaming = streaming,
+                               cache = cache,
+                               store = store)
+        worm.BasicCalculation(DEFAULT_INTERVAL = AV_interval, AV_PROFILE = AV_profile)
+        endpoints[worm_num] = EndPoints_Adder(worm)
+        if progress_queue is not None:
+            progress_queue.put((group_num, worm_num))
+
+    return endpoints
+
+
 class Executor():
         
     def __init__(self, 
@@ -107,7 +181,15 @@ class Executor():
                  treatment_char="A",
                  treatment_name="Control",
                  EndPointsAnalyze=True, 
-                 progress_window=None):
+                 progress_window=None,
+                 sidecar_cache=False,
+                 day_store=False,
+                 streaming=False,
+                 writer=None,
+                 export_format=EXPORT_FORMAT,
+                 results_store=True,
+                 workers=ANALYSIS_WORKERS,
+                 manifest=True):
 
         self.ERROR = None
 
@@ -115,6 +197,26 @@ class Executor():
 
         self.EPA = EndPointsAnalyze
 
+        self.streaming = streaming # bounded-memory analysis of very long recordings, see Libs.stream
+
+        # Day-level exporter (Libs.export) shared by the treatments of the day, closed by its owner.
+        # Without one, the Executor writes its own table in export_format at the end of ENDPOINTS_ANALYSIS
+        self.writer = writer
+        self.own_writer = writer is None
+
+        # SQLite store of the endpoints (Libs.results), True for the default Bin/results.sqlite, None to skip
+        self.results_store = results_store
+
+        self.WORM_IDS = {} # {"Group g - Well w": (g, w)}
+
+        # Reuse the endpoints of worms whose csv, parameters and code are unchanged, see Libs.manifest
+        self.use_manifest = manifest
+        self.manifest = None
+        self.REUSED = {} # {"Group g - Well w": endpoints} taken from the manifest
+        self.WORM_INPUTS = {} # {"Group g - Well w": inputs} to record in the manifest
+
+        self.workers = max(1, int(workers)) # > 1 analyzes the batches in a process pool
+
         self.progress_window = progress_window
 
 
@@ -128,12 +230,28 @@ class Executor():
         else:
             self.project_dir = project_dir
 
+        # each Batch folder is parsed once per run, and each csv once across runs with the sidecar cache,
+        # opt-in as it keeps up to TRAJECTORY_CACHE_BUDGET bytes in the project folder
+        if sidecar_cache and self.project_dir != "":
+            sidecar = SidecarCache(Path(self.project_dir) / TRAJECTORY_CACHE_DIR)
+        else:
+            sidecar = None
+        self.trajectory_cache = TrajectoryCache(sidecar = sidecar)
+
         try:
             _ = int(day_num)
         except:
             day_num = 1
         self.day_num = day_num
 
+        # Optional memory-mapped store of the whole day, True to open (or build) it, or an opened DayStore
+        if isinstance(day_store, DayStore):
+            self.day_store = day_store
+        elif day_store:
+            self.day_store = DayStore.open(get_working_dir(self.project_dir, self.day_num))
+        else:
+            self.day_store = None
+
         if treatment_char == None or treatment_char not in CHARS:
             self.treatment_char = "A"
             logger.warning("No treatment index specified. Using 'A' instead.")
@@ -149,6 +267,9 @@ class Executor():
         
         self.excel_path = self.get_excel_path()
 
+        if self.writer is None:
+            self.writer = get_exporter(self.project_dir, self.day_num, export_format = export_format)
+
 
     def PARAMS_LOADING(self):
 
@@ -173,6 +294,7 @@ class Executor():
         return None
 
     def GROUP_LOADING(self):
+        _starttime = time.time()
         self.treatment_dir = get_treatment_dir(self.project_dir, self.day_num, self.treatment_char)
         logger.debug(f"Accessing treatment directory... {self.treatment_dir}")
         group_dirs = [x for x in Path(self.treatment_dir).iterdir() if x.is_dir()]
@@ -184,10 +306,12 @@ class Executor():
         # remove group with csv count == 0
         self.GROUP_INFO = {k:v for k,v in self.GROUP_INFO.items() if v > 0}
 
+        self.timing["Group loading"] = time.time() - _starttime
+
         logger.debug(f"self.GROUP_INFO = {self.GROUP_INFO}")
 
 
-    def ENDPOINTS_ANALYSIS(self, OVERWRITE=False, AV_interval=None):
+    def ENDPOINTS_ANALYSIS(self, OVERWRITE=False, AV_interval=None, AV_profile=None):
 
         # ENDPOINTS ANALYSIS
         _starttime = time.time()
@@ -205,7 +329,7 @@ class Executor():
                 logger.info(f"Removing existing sheet of {self.treatment_name}...")
 
                 try:
-                    remove_sheet_by_name(self.excel_path, self.treatment_name)
+                    self.writer.remove(self.treatment_name)
                     logger.info(f"Existing sheet of {self.treatment_name} removed.")
                 except:
                     logger.error(f"Failed to remove existing sheet of {self.treatment_name}.")
@@ -226,11 +350,21 @@ class Executor():
         self.WORMS = {}
         self.EndPoints = {}
 
-        self.Worm_Adder(EPA = self.EPA, AV_interval = AV_interval)
+        if self.EPA and self.use_manifest:
+            self.Reuse_EndPoints(AV_interval = AV_interval, AV_profile = AV_profile)
+
+        self.Worm_Adder(EPA = self.EPA, AV_interval = AV_interval, AV_profile = AV_profile)
+
+        if self.manifest is not None:
+            self.Record_Manifest()
 
         if self.EPA:
-            self.Export_To_Excel(excel_path = self.excel_path)
-            return_excel_path = self.excel_path
+            self.Export_EndPoints(writer = self.writer)
+            if self.own_writer:
+                self.writer.close()
+            if self.results_store:
+                self.Store_Results(store = self.results_store)
+            return_excel_path = self.writer.output_path
         else:
             return_excel_path = None
 
@@ -243,24 +377,74 @@ class Executor():
             self.progress_window.task_update(value, text)
     
     def get_excel_path(self):
-        working_dir = get_working_dir(self.project_dir, self.day_num)
-        excel_path = working_dir / "EndPoints.xlsx"
-        return excel_path
+        return day_excel_path(self.project_dir, self.day_num)
 
 
 
     def analyzed_check(self):
-        if not self.excel_path.exists():
-            return "Not analyzed"
-        
-        # open the workbook to see if there is sheetname == self.treatment_char
-        if check_sheet_existence(self.excel_path, self.treatment_name):
+        # tables queued in the day exporter, or already written
+        if self.writer.exists(self.treatment_name):
             return "Analyzed"
         
         return "Not analyzed"
     
 
-    def Export_To_Excel(self, excel_path):
+    def Reuse_EndPoints(self, AV_interval, AV_profile = None):
+        """
+        Fill self.REUSED with the manifest endpoints of the worms whose inputs did not change
+        """
+        self.manifest = RunManifest(get_working_dir(self.project_dir, self.day_num), self.treatment_char)
+        params_hash = self.PARAMS.digest()
+        options_hash = options_digest(AV_interval, AV_profile, streaming = self.streaming)
+
+        self.REUSED = {}
+        self.WORM_INPUTS = {}
+        for group_num, worm_quantity in self.GROUP_INFO.items():
+            worm_files = find_worm_files(self.treatment_dir / BATCH_FOLDER_FORMAT.format(group_num))
+            for worm_num in range(1, worm_quantity+1):
+                if str(worm_num) not in worm_files:
+                    continue
+                key = f"Group {group_num} - Well {worm_num}"
+                self.WORM_INPUTS[key] = self.manifest.inputs(group_num, worm_num, worm_files[str(worm_num)], params_hash, options_hash)
+                endpoints = self.manifest.lookup(group_num, worm_num, self.WORM_INPUTS[key])
+                if endpoints is not None:
+                    self.REUSED[key] = endpoints
+
+        logger.info(f"Run manifest: {self.manifest.hits} worms unchanged, {self.manifest.misses} to analyze")
+
+    def Record_Manifest(self):
+        for key, endpoints in self.EndPoints.items():
+            if key not in self.REUSED and key in self.WORM_INPUTS:
+                group_num, worm_num = self.WORM_IDS[key]
+                self.manifest.record(group_num, worm_num, self.WORM_INPUTS[key], endpoints)
+        self.manifest.save()
+
+    def Export_EndPoints(self, writer):
+        df_endpoints = self.endpoints_frame()
+        logger.debug(f"df_endpoints = {df_endpoints}")
+
+        writer.add(self.treatment_name, df_endpoints)
+        logger.debug(f"EndPoints of {self.treatment_name} queued for {writer.output_path}")
+
+    def Store_Results(self, store = True):
+        # The EndPoints are already exported, a database failure must not fail the analysis
+        store, own_store = open_results_store(store)
+        if store is None:
+            return
+        try:
+            store.write_run(project_dir = self.project_dir,
+                            day_num = self.day_num,
+                            treatment_char = self.treatment_char,
+                            treatment_name = self.treatment_name,
+                            params_hash = self.PARAMS.digest(),
+                            endpoints = {self.WORM_IDS[key]: endpoints for key, endpoints in self.EndPoints.items()})
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to store the endpoints of {self.treatment_name} in the results database: {e}")
+        finally:
+            if own_store:
+                store.close()
+
+    def endpoints_frame(self):
         EndPoints_dict = {}
         for fish_num in self.EndPoints.keys():
             EndPoints_dict[fish_num] = {}
@@ -270,37 +454,34 @@ class Executor():
                 else:
                     EndPoints_dict[fish_num][f"{key} ({value['unit']})"] = value["value"]
 
-        df_endpoints = pd.DataFrame(EndPoints_dict).T
-        print()
-        print()
-        logger.debug(f"df_endpoints = {df_endpoints}")
-        print()
-        print()
-
-
-        append_df_to_excel(filename = excel_path,
-                   df = df_endpoints,
-                   sheet_name=self.treatment_name)
-        logger.debug(f"EndPoints.xlsx is saved to {excel_path}")
+        return pd.DataFrame(EndPoints_dict).T
 
-        excel_polish(excel_path)
-        logger.debug(f"EndPoints.xlsx is polished.")
 
+    def Worm_Adder(self, EPA=True, AV_interval = 1, AV_profile = None):
 
-    def Worm_Adder(self, EPA=True, AV_interval = 1):
+        if EPA and self.workers > 1:
+            return self.Worm_Adder_Parallel(AV_interval = AV_interval, AV_profile = AV_profile)
 
         for group_num, worm_quantity in self.GROUP_INFO.items():
             _starttime = time.time()
             for worm_num in range(1, worm_quantity+1):
-                self.WORMS[f"Group {group_num} - Well {worm_num}"] = GeneralAnalysis(project_dir = self.project_dir,
+                self.WORM_IDS[f"Group {group_num} - Well {worm_num}"] = (group_num, worm_num)
+                if EPA == True and f"Group {group_num} - Well {worm_num}" in self.REUSED:
+                    logger.info(f"EndPoints of Group {group_num} - Well {worm_num} reused, inputs unchanged")
+                    self.EndPoints[f"Group {group_num} - Well {worm_num}"] = self.REUSED[f"Group {group_num} - Well {worm_num}"]
+                    continue
+                self.WORMS[f"Group {group_num} - Well {worm_num}"] = create_analysis(project_dir = self.project_dir,
                                                                                     day_num = self.day_num,
                                                                                     treatment_char = self.treatment_char,
                                                                                     group_num = group_num,
                                                                                     worm_num = worm_num,
-                                                                                    params = self.PARAMS)
+                                                                                    params = self.PARAMS,
+                                                                                    streaming = self.streaming,
+                                                                                    cache = self.trajectory_cache,
+                                                                                    store = self.day_store)
                 if EPA == True:
                     logger.info(f"EndPoints analysis for Group {group_num} - Well {worm_num} initiated...")
-                    self.WORMS[f"Group {group_num} - Well {worm_num}"].BasicCalculation(DEFAULT_INTERVAL = AV_interval)
+                    self.WORMS[f"Group {group_num} - Well {worm_num}"].BasicCalculation(DEFAULT_INTERVAL = AV_interval, AV_PROFILE = AV_profile)
                     self.EndPoints[f"Group {group_num} - Well {worm_num}"] = EndPoints_Adder(self.WORMS[f"Group {group_num} - Well {worm_num}"])
                     logger.debug(f'After processing {worm_num}, self.EndPoints = {self.EndPoints[f"Group {group_num} - Well {worm_num}"]}')
                 else:
@@ -311,7 +492,17 @@ class Executor():
                 progress = (group_num-1) / len(self.GROUP_INFO) * 100 + worm_num / worm_quantity / len(self.GROUP_INFO) * 100
                 self.update_progress_bar(value=progress, text = f"Analyze Group {group_num} - Well {worm_num}")
 
-            logger.debug(f'After processing {group_num}, self.EndPoints = {self.EndPoints[f"Group {group_num} - Well {worm_num}"]}')
+            # The batch is done, release its trajectories before loading the next one
+            self.trajectory_cache.evict(self.treatment_dir / BATCH_FOLDER_FORMAT.format(group_num))
+
+            logger.debug(f'After processing {group_num}, self.EndPoints = {self.EndPoints.get(f"Group {group_num} - Well {worm_num}")}')
+
+        logger.debug(f"Trajectory cache: {self.trajectory_cache.misses} batch parses, {self.trajectory_cache.hits} reuses")
+
+        sidecar = self.trajectory_cache.sidecar
+        if sidecar is not None:
+            sidecar.flush()
+            logger.info(f"Sidecar trajectory cache: {sidecar.hits} hits, {sidecar.misses} misses, {sidecar.total_bytes()} bytes")
             
     
     
@@ -322,4 +513,64 @@ class Executor():
 
     
 
+    def Worm_Adder_Parallel(self, AV_interval = 1, AV_profile = None):
+        """
+        Analyze the batches in a process pool, one task per batch so each worker parses its batch once.
+        Workers return the endpoint dicts only, self.WORMS is left empty.
+        The progress bar moves per worm, workers report each worm done through a shared queue.
+        """
+        _starttime = time.time()
+
+        # Workers map the same day store file instead of copying trajectories
+        day_store_dir = self.day_store.day_dir if self.day_store is not None else None
+
+        # Worms left to analyze in each batch, the others come from the run manifest
+        todo = {group_num: [worm_num for worm_num in range(1, worm_quantity+1) if f"Group {group_num} - Well {worm_num}" not in self.REUSED]
+                for group_num, worm_quantity in self.GROUP_INFO.items()}
+
+        total_worms = sum(len(worm_nums) for worm_nums in todo.values())
+        analyzed = 0
+
+        results = {group_num: {} for group_num in self.GROUP_INFO}
+        with Manager() as manager, ProcessPoolExecutor(max_workers = self.workers) as pool:
+            progress_queue = manager.Queue()
+            futures = {pool.submit(analyze_batch,
+                                   project_dir = self.project_dir,
+                                   day_num = self.day_num,
+                                   treatment_char = self.treatment_char,
+                                   group_num = group_num,
+                                   worm_quantity = worm_quantity,
+                                   params = self.PARAMS,
+                                   AV_interval = AV_interval,
+                                   AV_profile = AV_profile,
+                                   streaming = self.streaming,
+                                   day_store_dir = day_store_dir,
+                                   worm_nums = todo[group_num],
+                                   progress_queue = progress_queue): group_num for group_num, worm_quantity in self.GROUP_INFO.items() if todo[group_num]}
+
+            running = set(futures)
+            while running:
+                done, running = wait(running, timeout = 0.1, return_when = FIRST_COMPLETED)
+
+                # A worker puts its worms before returning, so those of the finished batches are all in
+                while True:
+                    try:
+                        group_num, worm_num = progress_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    analyzed += 1
+                    self.update_progress_bar(value = analyzed / total_worms * 100, text = f"Analyze Group {group_num} - Well {worm_num}")
+
+                for future in done:
+                    group_num = futures[future]
+                    results[group_num] = future.result()
+                    self.timing[f"Analyze Group {group_num}"] = time.time() - _starttime
+
+        # Same Group/Well order as the sequential run
+        for group_num, worm_quantity in self.GROUP_INFO.items():
+            for worm_num in range(1, worm_quantity+1):
+                key = f"Group {group_num} - Well {worm_num}"
+                self.WORM_IDS[key] = (group_num, worm_num)
+                self.EndPoints[key] = self.REUSED[key] if key in self.REUSED else results[group_num][worm_num]
 
+        logger.info(f"Analyzed {len(self.EndPoints)} worms with {self.workers} workers in {time.time() - _starttime:.2f} s")
@@ -0,0 +1,305 @@
+import os
+import re
+import shutil
+from abc import ABC, abstractmethod
+import pandas as pd
+from pathlib import Path
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from Libs.misc import polish_worksheet, list_sheet_names
+from Libs.dirFetch import get_working_dir
+from . import EXPORT_FORMAT
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def day_excel_path(project_dir, day_num):
+    return get_working_dir(project_dir, day_num) / "EndPoints.xlsx"
+
+
+def day_table_dir(project_dir, day_num):
+    return get_working_dir(project_dir, day_num) / "EndPoints"
+
+
+class EndpointsExporter(ABC):
+    """
+    Day-level destination of the endpoint tables, one table per treatment.
+    Every table has one row per worm and one "Endpoint (unit)" column per endpoint, see Executor.endpoints_frame.
+    Tables are queued with add() and written by close(), the owner of the exporter closes it once per day.
+    """
+
+    # Path reported to the user once the day is written
+    output_path = None
+
+    @abstractmethod
+    def exists(self, sheet_name):
+        ...
+
+    @abstractmethod
+    def remove(self, sheet_name):
+        ...
+
+    @abstractmethod
+    def add(self, sheet_name, df):
+        ...
+
+    @abstractmethod
+    def close(self):
+        ...
+
+
+class DayExcelWriter(EndpointsExporter):
+    """
+    Day-level writer of EndPoints.xlsx.
+    The treatment sheets are collected in memory, the sheet names already in the file are read once,
+    and close() writes the workbook once, polished like excel_polish, to a temp file that then replaces it.
+    """
+
+    def __init__(self, excel_path):
+
+        self.excel_path = Path(excel_path)
+        self.output_path = self.excel_path
+        self.sheets = {} # {sheet_name: DataFrame}, in writing order
+        self.removed = set() # existing sheets to drop
+        self._existing = None
+
+    @classmethod
+    def for_day(cls, project_dir, day_num):
+        return cls(day_excel_path(project_dir, day_num))
+
+    @property
+    def existing(self):
+        # Sheet names of the file on disk, read on first use only
+        if self._existing is None:
+            if self.excel_path.exists():
+                self._existing = list_sheet_names(self.excel_path)
+            else:
+                self._existing = []
+        return self._existing
+
+    def exists(self, sheet_name):
+        if sheet_name in self.sheets:
+            return True
+        return sheet_name in self.existing and sheet_name not in self.removed
+
+    def remove(self, sheet_name):
+        self.sheets.pop(sheet_name, None)
+        if sheet_name in self.existing:
+            self.removed.add(sheet_name)
+
+    def add(self, sheet_name, df):
+        self.sheets[sheet_name] = df
+        self.removed.discard(sheet_name)
+
+    def close(self):
+        """
+        Write the collected sheets, return the path of EndPoints.xlsx or None if there was nothing to write
+        """
+        if len(self.sheets) == 0 and len(self.removed) == 0:
+            return None
+
+        temp_path = self.excel_path.with_name(f"{self.excel_path.stem}.tmp{self.excel_path.suffix}")
+        appending = self.excel_path.exists()
+        if appending:
+            shutil.copy2(self.excel_path, temp_path)
+
+        try:
+            with pd.ExcelWriter(temp_path,
+                                engine = 'openpyxl',
+                                mode = 'a' if appending else 'w',
+                                **({'if_sheet_exists': 'replace'} if appending else {})) as writer:
+                for sheet_name in self.removed:
+                    if sheet_name in writer.book.sheetnames:
+                        del writer.book[sheet_name]
+
+                for sheet_name, df in self.sheets.items():
+                    df.to_excel(writer, sheet_name = sheet_name)
+                    logger.info(f"Successful write to {self.excel_path}/{sheet_name}")
+
+                # Same polish as excel_polish, without reloading the file
+                for sheet in writer.book.worksheets:
+                    if "analysis" in sheet.title.lower():
+                        continue
+                    polish_worksheet(sheet)
+
+            os.replace(temp_path, self.excel_path)
+        except Exception:
+            logger.error(f"UNSUCCESS write to {self.excel_path}")
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
+
+        logger.info(f"EndPoints.xlsx is saved to {self.excel_path}")
+
+        self._existing = None
+        self.sheets = {}
+        self.removed = set()
+
+        return self.excel_path
+
+
+
+class TableExporter(EndpointsExporter):
+    """
+    Day-level writer of one file per treatment in Day N/EndPoints, without openpyxl.
+    The worm labels become a "Worm" column, the endpoint columns are the same as in EndPoints.xlsx.
+    Each file is written to a temp file that then replaces it.
+    """
+
+    suffix = None
+
+    def __init__(self, table_dir):
+
+        self.table_dir = Path(table_dir)
+        self.output_path = self.table_dir
+        self.tables = {} # {sheet_name: DataFrame}, in writing order
+        self.removed = set()
+
+    @classmethod
+    def for_day(cls, project_dir, day_num):
+        return cls(day_table_dir(project_dir, day_num))
+
+    def table_path(self, sheet_name):
+        # Treatment names are free text, keep them usable as file names
+        file_name = re.sub(r'[\\/:*?"<>|]', '_', sheet_name)
+        return self.table_dir / f"{file_name}{self.suffix}"
+
+    def exists(self, sheet_name):
+        if sheet_name in self.tables:
+            return True
+        return self.table_path(sheet_name).exists() and sheet_name not in self.removed
+
+    def remove(self, sheet_name):
+        self.tables.pop(sheet_name, None)
+        self.removed.add(sheet_name)
+
+    def add(self, sheet_name, df):
+        self.tables[sheet_name] = df
+        self.removed.discard(sheet_name)
+
+    @abstractmethod
+    def write_table(self, df, path):
+        ...
+
+    def close(self):
+        """
+        Write the queued tables, return the table directory or None if there was nothing to write
+        """
+        if len(self.tables) == 0 and len(self.removed) == 0:
+            return None
+
+        self.table_dir.mkdir(parents=True, exist_ok=True)
+
+        for sheet_name in self.removed:
+            self.table_path(sheet_name).unlink(missing_ok=True)
+
+        for sheet_name, df in self.tables.items():
+            path = self.table_path(sheet_name)
+            temp_path = path.with_name(f"{path.stem}.tmp{path.suffix}")
+            try:
+                self.write_table(df.rename_axis("Worm").reset_index(), temp_path)
+                os.replace(temp_path, path)
+            except Exception:
+                logger.error(f"UNSUCCESS write to {path}")
+                temp_path.unlink(missing_ok=True)
+                raise
+            logger.info(f"Successful write to {path}")
+
+        self.tables = {}
+        self.removed = set()
+
+        return self.table_dir
+
+
+
+class CSVExporter(TableExporter):
+
+    suffix = ".csv"
+
+    def write_table(self, df, path):
+        df.to_csv(path, index=False)
+
+
+
+class ParquetExporter(TableExporter):
+
+    suffix = ".parquet"
+
+    def __init__(self, table_dir):
+
+        if pyarrow is None:
+            logger.error("Parquet export needs pyarrow, please install it")
+            raise ImportError("Parquet export needs pyarrow, please install it")
+        super().__init__(table_dir)
+
+    def write_table(self, df, path):
+        df.to_parquet(path, index=False)
+
+
+
+class FeatherExporter(TableExporter):
+
+    suffix = ".feather"
+
+    def __init__(self, table_dir):
+
+        if pyarrow is None:
+            logger.error("Feather export needs pyarrow, please install it")
+            raise ImportError("Feather export needs pyarrow, please install it")
+        super().__init__(table_dir)
+
+    def write_table(self, df, path):
+        df.to_feather(path)
+
+
+
+class MemoryExporter(EndpointsExporter):
+    """
+    Exporter that only keeps the tables, for Executors whose tables are written by someone else
+    (the project scheduler collects them from its workers and writes each day once).
+    """
+
+    def __init__(self):
+
+        self.tables = {}
+
+    def exists(self, sheet_name):
+        return sheet_name in self.tables
+
+    def remove(self, sheet_name):
+        self.tables.pop(sheet_name, None)
+
+    def add(self, sheet_name, df):
+        self.tables[sheet_name] = df
+
+    def close(self):
+        return None
+
+
+
+EXPORTERS = {
+    "excel": DayExcelWriter,
+    "csv": CSVExporter,
+    "parquet": ParquetExporter,
+    "feather": FeatherExporter,
+}
+
+
+def get_exporter(project_dir, day_num, export_format = EXPORT_FORMAT):
+    """
+    Create the exporter of a day
+    :param export_format: one of EXPORTERS, "excel", "csv", "parquet" or "feather"
+    :return: an EndpointsExporter
+    """
+    try:
+        exporter_class = EXPORTERS[export_format.lower()]
+    except KeyError:
+        logger.error(f"Unknown export format {export_format}, expected one of {list(EXPORTERS)}")
+        raise ValueError(f"Unknown export format {export_format}, expected one of {list(EXPORTERS)}")
+
+    return exporter_class.for_day(project_dir, day_num)
@@ -5,7 +5,7 @@ import math
 from pathlib import Path
 import json
 import re
-from statistics import mean
+import hashlib
 import matplotlib.pyplot as plt
 from scipy.optimize import linear_sum_assignment
 from scipy.stats import pearsonr
@@ -13,8 +13,10 @@ from scipy.stats import pearsonr
 from Libs.misc import *
 from . import ALLOWED_DECIMALS, RAW_FORMAT_SEPARATOR, RAW_FORMAT_INDICATOR
 from . import BATCH_FOLDER_FORMAT, CHARS, NEG_INF, POS_INF, DEFAULT_PARAMS
-from . import WELL_CENTER_POINTS, CENTER_RANGE
+from . import WELL_CENTER_POINTS, CENTER_RANGE, AV_SPEED_THRESHOLD
 from Libs.dirFetch import get_static_dir, get_treatment_dir
+from Libs.calculation import step_lengths, center_points, center_distances, angular_velocity_bins, profile_intervals
+from Libs.loader import read_trajectory
 
 import logging
 
@@ -117,17 +119,27 @@ class Parameters():
         return data
 
 
+    def digest(self):
+        """
+        Short hash of the loaded parameters, to tell apart results computed with different parameter sets
+        :return: 16 hex characters
+        """
+        return hashlib.sha1(json.dumps(self.PARAMS, sort_keys=True).encode()).hexdigest()[:16]
+
+
 
 
 class Loader():
     
-    def __init__(self, project_dir, day_num, treatment_char, group_num, worm_num, params):
+    def __init__(self, project_dir, day_num, treatment_char, group_num, worm_num, params, cache=None, store=None):
 
         self.project_dir = project_dir
         self.day_num = day_num
         self.treatment_char = treatment_char
         self.worm_num = worm_num
         self.PARAMS = params
+        self.cache = cache # Libs.cache.TrajectoryCache shared by the Executor run, or None
+        self.store = store # Libs.store.DayStore of the day, or None
 
         self.group_name = BATCH_FOLDER_FORMAT.format(group_num)
 
@@ -168,14 +180,20 @@ class Loader():
     def GroupLoader(self):
 
         group_path = self.treatment_dir / self.group_name
-        # find all file with RAW_FORMAT_INDICATOR
-        raw_files = list(group_path.glob(f"*{RAW_FORMAT_INDICATOR}"))
 
-        if len(list(raw_files)) == 0:
-            logger.error(f"No raw files found at {group_path}")
-            raise FileNotFoundError(f"No raw files found at {group_path}")
+        if self.store is not None:
+            # zero-copy views into the memory-mapped day store
+            return self.store.group(self.treatment_dir.name, self.group_name)
+
+        if self.cache is not None:
+            return self.cache.get_group(group_path, self.read_group)
+
+        return self.read_group(group_path)
 
-        group_dict = find_uncommon_substrings_in_paths_general(raw_files)
+    def read_group(self, group_path):
+
+        # find all file with RAW_FORMAT_INDICATOR
+        group_dict = find_worm_files(group_path)
         # group_dict = {f.name.split(RAW_FORMAT_SEPARATOR)[-1].split(RAW_FORMAT_INDICATOR)[0].strip():f for f in raw_files}
         logger.debug(f"Loaded group_dict: {group_dict}")
         for worm_num, csv_path in group_dict.items():
@@ -184,175 +202,238 @@ class Loader():
         return group_dict
 
     def WormLoader(self, csv_path):
-        df = pd.read_csv(csv_path, header=0, index_col=0)
-        if len(df.columns) == 2:
-            df.columns = ["X", "Y"]
-        elif len(df.columns) == 3:
-            df.columns = ["X", "Y", "Z"]
-        return df
+        if self.cache is not None:
+            coords, frames, axes = self.cache.read_trajectory(csv_path)
+        else:
+            coords, frames, axes = read_trajectory(csv_path)
+        return pd.DataFrame(coords, index=frames, columns=axes)
     
     def distance_traveled(self):
-        distance_list = []
-
-        for i in range(len(self.WORM)-1):
-            distance = 0
-            for axis in self.WORM.columns:
-                distance += (self.WORM[axis].iloc[i+1] - self.WORM[axis].iloc[i])**2
-            distance = math.sqrt(distance)
-            distance = distance / self.PARAMS["CONVERSION RATE"]
-            distance = round(distance, ALLOWED_DECIMALS)
-            distance_list.append(distance)
-            # UNIT: cm
+        distance_list = step_lengths(coords = self.WORM.to_numpy(),
+                                     conversion_rate = self.PARAMS["CONVERSION RATE"],
+                                     decimals = ALLOWED_DECIMALS)
+        # UNIT: cm
 
         return Distance(distance_list = distance_list)
     
     def distance_to(self, TARGET = "CENTER"):
-        distance_list = []
-        try:
-            all_worm_target_params = self.PARAMS[TARGET]
-        except KeyError:
+        distance, _ = self.target_zone(TARGET = TARGET)
+
+        return distance
+
+    def target_zone(self, TARGET = "CENTER"):
+        # Distance of every frame to the target and the boolean within-range mask, in one pass
+        all_worm_target_params = self.PARAMS[TARGET]
+        if all_worm_target_params is None:
             logger.error(f"Failed to load {TARGET} from parameters.json")
             raise KeyError(f"Failed to load {TARGET} from parameters.json")
-        
+
         try:
             target_params = all_worm_target_params[str(self.worm_num)]
         except KeyError:
             logger.error(f"Failed to load {TARGET} for worm {self.worm_num}")
             raise KeyError(f"Failed to load {TARGET} for worm {self.worm_num}")
-        
-        for _, row in self.WORM.iterrows():
-            distance = 0
-            for axis, param_coord in target_params.items():
-                try:
-                    row_value = row[axis]
-                except KeyError:
-                    _message = f"No {axis} coordinate found in Treatment {self.treatment_char}, {self.group_name}, Worm {self.worm_num}"
-                    logger.error(_message)
-                    raise KeyError(_message)
-                distance += (row_value - param_coord) ** 2
-
-            distance = np.sqrt(distance)
-            distance = distance/self.PARAMS["CONVERSION RATE"]
-            distance = round(distance, ALLOWED_DECIMALS)
-            distance_list.append(distance)
-
-        return Distance(distance_list)
-    
+
+        axes, target_point = center_points(target_params)
+        for axis in axes:
+            if axis not in self.WORM.columns:
+                _message = f"No {axis} coordinate found in Treatment {self.treatment_char}, {self.group_name}, Worm {self.worm_num}"
+                logger.error(_message)
+                raise KeyError(_message)
+
+        distance_list, within = center_distances(coords = self.WORM[axes].to_numpy(),
+                                                 centers = target_point,
+                                                 conversion_rate = self.PARAMS["CONVERSION RATE"],
+                                                 center_range = self.PARAMS["THIGMOTAXIS RANGE"],
+                                                 decimals = ALLOWED_DECIMALS)
+
+        return Distance(distance_list), within
+
     def within_range(self, distance_list):
-        return [1 if distance <= self.PARAMS["THIGMOTAXIS RANGE"] else 0 for distance in distance_list]
+        return (np.asarray(distance_list) <= self.PARAMS["THIGMOTAXIS RANGE"]).astype(int)
 
 
-class CustomDisplay():
+class lazy_stat():
+    """
+    Summary statistic computed on first access, then cached in the "_<name>" slot of the instance.
+    """
+
+    def __init__(self, method):
+
+        self.method = method
+        self.name = method.__name__
+        self.slot = f"_{method.__name__}"
+
+    def __get__(self, instance, owner=None):
 
-    def __init__(self):
+        if instance is None:
+            return self
+        try:
+            return getattr(instance, self.slot)
+        except AttributeError:
+            value = self.method(instance)
+            setattr(instance, self.slot, value)
+            return value
+
+
+class CustomDisplay():
 
-        pass
+    __slots__ = ()
 
     def get_variables(self, magic = False):
 
-        self_dir = [x for x in dir(self) if x not in dir(CustomDisplay)]
+        # Public slots and lazy statistics of the class hierarchy, without walking dir()
+        self_dir = []
+        for cls in reversed(type(self).__mro__):
+            for name in getattr(cls, '__slots__', ()):
+                if name not in self_dir and not isinstance(getattr(cls, name[1:], None), lazy_stat):
+                    self_dir.append(name)
+            for name, value in vars(cls).items():
+                if isinstance(value, lazy_stat) and name not in self_dir:
+                    self_dir.append(name)
+
         if magic:
             return self_dir
         else:
-            return [x for x in self_dir if not x.startswith('__')]
+            return [x for x in self_dir if not x.startswith('_')]
+
+    def clear_cache(self):
+
+        for cls in type(self).__mro__:
+            for value in vars(cls).values():
+                if isinstance(value, lazy_stat) and hasattr(self, value.slot):
+                    delattr(self, value.slot)
 
     def __str__(self):
 
         message = "Variables:\n"
         for variable in self.get_variables():
-            message += f'{str(variable)}: {str(getattr(self, variable))}\n'
+            message += f'{str(variable)}: {str(getattr(self, variable, None))}\n'
 
         return message
 
 
 class Time(CustomDisplay):
 
-    def __init__(self, time_list):
+    __slots__ = ('list', 'unit', '_duration', '_percentage', '_not_duration', '_not_percentage')
 
-        self.list = time_list  # [1, 1, 1, 0, 0, 0, 1, 0]
+    def __init__(self, time_list):
 
-        self.duration = sum(self.list)  # in frames
-        # print(f'Duration: {self.duration} / {len(self.list)}')
-        self.percentage = self.duration / len(self.list) * 100
-        self.not_duration = len(self.list) - self.duration  # in frames
-        self.not_percentage = 100 - self.percentage
+        self.list = np.asarray(time_list, dtype=bool)  # [1, 1, 1, 0, 0, 0, 1, 0]
         self.unit = 'frames'
 
+    @lazy_stat
+    def duration(self):
+        return int(np.count_nonzero(self.list))  # in frames
+
+    @lazy_stat
+    def percentage(self):
+        return self.duration / len(self.list) * 100
+
+    @lazy_stat
+    def not_duration(self):
+        return len(self.list) - self.duration  # in frames
+
+    @lazy_stat
+    def not_percentage(self):
+        return 100 - self.percentage
+
     
 
 class Events(CustomDisplay):
 
-    def __init__(self, event_dict, duration):
+    __slots__ = ('starts', 'ends', 'lengths', 'count', 'longest', 'percentage', 'unit', '_dict')
 
-        self.dict = event_dict
+    def __init__(self, event_dict = None, duration = 1, runs = None):
 
-        if '-1' in event_dict.keys():
-            self.count = 0
-            self.longest = 0
-            self.percentage = 0
-            # take out this key
-            self.dict.pop('-1')
-        else:
-            self.count = len(self.dict)
-            try:
-                self.longest = max(self.dict.values())
-            except ValueError:
-                self.longest = 0
-            self.percentage = self.longest / duration * 100
+        # runs = (starts, ends, lengths) from misc.event_runs, event_dict = {(start, end): length} from misc.event_extractor
+        if runs is None:
+            if '-1' in event_dict.keys():
+                event_dict = {}
+            runs = (np.array([key[0] for key in event_dict.keys()], dtype=np.int64),
+                    np.array([key[1] for key in event_dict.keys()], dtype=np.int64),
+                    np.array(list(event_dict.values()), dtype=np.int64))
+
+        self.starts, self.ends, self.lengths = runs
+
+        self.count = len(self.lengths)
+        self.longest = int(np.max(self.lengths)) if self.count > 0 else 0
+        self.percentage = self.longest / duration * 100
 
         self.unit = 'frames'
 
+    @lazy_stat
+    def dict(self):
+        return {(start, end): length for start, end, length in zip(self.starts.tolist(), self.ends.tolist(), self.lengths.tolist())}
+
 
 
 class Area(CustomDisplay):
 
+    __slots__ = ('list', 'unit', '_avg')
+
     def __init__(self, area_list):
 
-        self.list = area_list
-        self.avg = round(mean(self.list), ALLOWED_DECIMALS)
+        self.list = np.asarray(area_list, dtype=np.float64)
         self.unit = 'cm^2'
-    
+
+    @lazy_stat
+    def avg(self):
+        return round(float(np.mean(self.list)), ALLOWED_DECIMALS)
 
     def __add__(self, other):
 
-        temp_list = self.list + other.list
-        return Area(temp_list, self.hyp)
+        return Area(np.concatenate((self.list, other.list)))
     
 
 
 class Distance(CustomDisplay):
 
-    def __init__(self, distance_list):
+    __slots__ = ('list', 'unit', '_total', '_avg')
 
-        self.list = distance_list
+    def __init__(self, distance_list):
 
-        self.total = round(sum(self.list), ALLOWED_DECIMALS)
-        self.avg = round(mean(self.list), ALLOWED_DECIMALS)
+        self.list = np.asarray(distance_list, dtype=np.float64)
         self.unit = 'cm'
 
+    @lazy_stat
+    def total(self):
+        return round(float(np.sum(self.list)), ALLOWED_DECIMALS)
+
+    @lazy_stat
+    def avg(self):
+        return round(float(np.mean(self.list)), ALLOWED_DECIMALS)
 
     def __add__(self, other):
 
-        temp_list = self.list + other.list
-        return Distance(temp_list, self.hyp)
+        return Distance(np.concatenate((self.list, other.list)))
     
 
 
 class Speed(CustomDisplay):
 
+    __slots__ = ('list', 'total_frames', 'threshold', 'unit', 'slow', 'fast', '_max', '_min', '_avg')
+
     def __init__(self, speed_list, total_frames, threshold):
 
-        self.list = speed_list
+        self.list = np.asarray(speed_list, dtype=np.float64)
         self.total_frames = total_frames
         self.threshold = threshold
-
-        self.max = round(max(self.list), ALLOWED_DECIMALS)
-        self.min = round(min(self.list), ALLOWED_DECIMALS)
-        self.avg = round(mean(self.list), ALLOWED_DECIMALS)
         self.unit = 'cm/s'
 
         self.Classifier()
 
+    @lazy_stat
+    def max(self):
+        return round(float(np.max(self.list)), ALLOWED_DECIMALS)
+
+    @lazy_stat
+    def min(self):
+        return round(float(np.min(self.list)), ALLOWED_DECIMALS)
+
+    @lazy_stat
+    def avg(self):
+        return round(float(np.mean(self.list)), ALLOWED_DECIMALS)
     
     def __add__(self, other):
 
@@ -360,23 +441,17 @@ class Speed(CustomDisplay):
         if not hasattr(other, 'list') or not hasattr(other, 'total_frames'):
             raise AttributeError("Other object doesn't have 'list' or 'total_frames' attribute")
 
-        temp_list = self.list + other.list
+        temp_list = np.concatenate((self.list, other.list))
 
         if self.total_frames != other.total_frames:
             raise ValueError(f"Total frames of self and other are not the same, {self.total_frames=} != {other.total_frames=}")
         else:
-            return Speed(temp_list, self.total_frames)
+            return Speed(temp_list, self.total_frames, self.threshold)
 
     def Classifier(self):
 
-        slow_count = 0
-        fast_count = 0
-
-        for speed in self.list:
-            if speed < self.threshold:
-                slow_count += 1
-            else:
-                fast_count += 1
+        slow_count = int(np.count_nonzero(self.list < self.threshold))
+        fast_count = len(self.list) - slow_count
 
         self.slow = round(slow_count / self.total_frames * 100, ALLOWED_DECIMALS)
         self.fast = round(fast_count / self.total_frames * 100, ALLOWED_DECIMALS)
@@ -385,10 +460,14 @@ class Speed(CustomDisplay):
 
 class Angle(CustomDisplay):
 
-    def __init__(self, angle_class, frame_rate, interval=1):
+    __slots__ = ('angle_class', 'frame_rate', 'interval', 'ragged', 'list', 'absolute', 'unit', '_total', '_avg', '_velocity')
+
+    def __init__(self, angle_class, frame_rate, interval=1, ragged="keep"):
 
         self.angle_class = angle_class
         self.frame_rate = frame_rate
+        self.ragged = ragged # rule for the last, shorter second, see calculation.angular_velocity_bins
+        self.unit = 'degree'
 
         self.interval = -1
         self.set_interval(interval=interval)
@@ -396,19 +475,13 @@ class Angle(CustomDisplay):
 
     def calculate_velocity(self):
 
-        def chunk_calc(input_list : list[float], chunk_size : int) -> list[float]:
-            logger.debug(f"Calculated angular velocity using chunk_calc(), {chunk_size=}")
-            return [abs(sum(input_list[i:i+chunk_size]))%180 for i in range(0, len(input_list), chunk_size)]
-        
-        # angular_velocity_list = []
-        # for i in range(len(self.list)):
-        #     # Angular velocity = Turning angle/Time
-        #     angular_velocity = self.list[i]
-        #     angular_velocity_list.append(angular_velocity)
-        #     # UNIT: degree/s
+        # Angular velocity = Turning angle/Time, summed per second
+        # UNIT: degree/s
         chunk_size = int(self.frame_rate/self.interval)
-        print(f"{chunk_size=}, {self.frame_rate=} {self.interval=}")
-        angular_velocity_list = chunk_calc(input_list=self.list, chunk_size=chunk_size)
+        logger.debug(f"Calculating angular velocity, {chunk_size=}, {self.frame_rate=}, {self.interval=}, {self.ragged=}")
+        angular_velocity_list = angular_velocity_bins(turning_angles = self.list,
+                                                      chunk_size = chunk_size,
+                                                      ragged = self.ragged)
 
         # [NOTE] Used same name for the class and the variablwe to save memory, but they are different
             
@@ -425,46 +498,85 @@ class Angle(CustomDisplay):
             logger.info(f"Setting interval to {interval}")
             self.interval = interval
             
-            self.list = self.angle_class.turning_angles(interval=self.interval)
-            self.absolute = [abs(x) for x in self.list]
-            self.total = round(sum(self.absolute), ALLOWED_DECIMALS)
-            self.avg = round(mean(self.absolute), ALLOWED_DECIMALS)
-            self.unit = 'degree'
-
-            self.velocity = self.calculate_velocity()
+            self.list = np.asarray(self.angle_class.turning_angles(interval=self.interval), dtype=np.float64)
+            self.absolute = np.abs(self.list)
+            self.clear_cache()
+
+    @lazy_stat
+    def total(self):
+        return round(float(np.sum(self.absolute)), ALLOWED_DECIMALS)
+
+    @lazy_stat
+    def avg(self):
+        return round(float(np.mean(self.absolute)), ALLOWED_DECIMALS)
+
+    @lazy_stat
+    def velocity(self):
+        return self.calculate_velocity()
+
+    def velocity_profile(self, intervals, THRESHOLD = AV_SPEED_THRESHOLD):
+        """
+        Compute the angular velocity for several intervals in one call.
+        This is a loop over the intervals: each interval computes its own turning angles from a strided
+        view of the coordinates, only the angles already computed (cached per interval by the angle class)
+        and the velocity of the current interval are reused.
+        :param intervals: list of intervals (frames), the ones that do not divide the frame rate are left out
+        :param THRESHOLD: slow/fast threshold of the angular velocity (degree/s)
+        :return: dict of {interval: Speed_A}
+        """
+        profile = {}
+        for interval in profile_intervals(intervals, self.frame_rate):
+            if interval == self.interval and THRESHOLD == AV_SPEED_THRESHOLD:
+                profile[interval] = self.velocity
+                continue
+
+            turning_angles = self.angle_class.turning_angles(interval=interval)
+            angular_velocity_list = angular_velocity_bins(turning_angles = turning_angles,
+                                                          chunk_size = int(self.frame_rate/interval),
+                                                          ragged = self.ragged)
+            profile[interval] = Speed_A(speed_a_list = angular_velocity_list, THRESHOLD = THRESHOLD)
+
+        return profile
 
 
 
 class Speed_A(CustomDisplay):
 
-    def __init__(self, speed_a_list, THRESHOLD = 90):
+    __slots__ = ('list', 'total_instances', 'unit', 'slow', 'fast', '_max', '_min', '_avg')
 
-        self.list = speed_a_list
-        self.total_instances = len(self.list)
+    def __init__(self, speed_a_list, THRESHOLD = AV_SPEED_THRESHOLD):
 
-        self.max = round(max(self.list), ALLOWED_DECIMALS)
-        self.min = round(min(self.list), ALLOWED_DECIMALS)
-        self.avg = round(mean(self.list), ALLOWED_DECIMALS)
+        self.list = np.asarray(speed_a_list, dtype=np.float64)
+        self.total_instances = len(self.list)
         self.unit = 'degree/s'
 
         self.Classifier(THRESHOLD)
 
+    @lazy_stat
+    def max(self):
+        return round(float(np.max(self.list)), ALLOWED_DECIMALS)
+
+    @lazy_stat
+    def min(self):
+        return round(float(np.min(self.list)), ALLOWED_DECIMALS)
+
+    @lazy_stat
+    def avg(self):
+        return round(float(np.mean(self.list)), ALLOWED_DECIMALS)
 
-    def Classifier(self, THRESHOLD):
 
-        slow_count = 0
-        fast_count = 0
+    def Classifier(self, THRESHOLD):
 
-        for i, speed in enumerate(self.list):
+        out_of_range = np.flatnonzero((self.list < 0) | (self.list > 181))
+        if out_of_range.size > 0:
+            i = out_of_range[0]
+            speed = self.list[i]
             if speed < 0:
                 raise Exception(f"Negative speed, {speed=} found, please check your input.")
-            if speed > 181:
-                raise Exception(f"Speed > 180, {speed=} found at position {i}/{len(self.list)} please check your input.")
-            
-            if speed <= THRESHOLD:
-                slow_count += 1
-            else:
-                fast_count += 1
+            raise Exception(f"Speed > 180, {speed=} found at position {i}/{len(self.list)} please check your input.")
+
+        slow_count = int(np.count_nonzero(self.list <= THRESHOLD))
+        fast_count = self.total_instances - slow_count
 
         self.slow = round(slow_count / self.total_instances * 100, ALLOWED_DECIMALS)
         self.fast = round(fast_count / self.total_instances * 100, ALLOWED_DECIMALS)
@@ -1,8 +1,19 @@
 import json
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_csv = None
 
 import logging
 logger = logging.getLogger(__name__)
 
+COORDINATE_AXES = ["X", "Y", "Z"]
+
 def hyploader(hyp_path):
 
     with open(hyp_path, 'r') as file:
@@ -12,4 +23,123 @@ def hyploader(hyp_path):
     for key, value in data.items():
         data[key] = int(float(value))
 
-    return data
\ No newline at end of file
+    return data
+
+
+def trajectory_columns(csv_path):
+    """
+    Read the header of a position csv and find its coordinate columns, the other columns are ignored.
+    Columns named x, y and z (any case) are the coordinates, without such names the 2 or 3 columns
+    after the frame index are, and only the first 2 when there are more.
+    :return: (header, positions, axes), header the column count of the file, positions the indices
+             of the coordinate columns and axes their names, ["X", "Y"] or ["X", "Y", "Z"]
+    """
+    header = pd.read_csv(csv_path, nrows = 0).columns
+    names = [str(name).strip().upper() for name in header]
+
+    if "X" in names[1:] and "Y" in names[1:]:
+        axes = [axis for axis in COORDINATE_AXES if axis in names[1:]]
+        positions = [names.index(axis, 1) for axis in axes]
+    else:
+        axes_num = len(header) - 1
+        if axes_num < 2:
+            logger.error(f"Expected at least 2 coordinate columns in {csv_path}, found {axes_num}")
+            raise ValueError(f"Expected at least 2 coordinate columns in {csv_path}, found {axes_num}")
+        if axes_num > 3:
+            logger.warning(f"{csv_path} has {axes_num} unnamed columns after the frame index, using the first 2 as X and Y")
+            axes_num = 2
+        axes = COORDINATE_AXES[:axes_num]
+        positions = list(range(1, axes_num + 1))
+
+    return len(header), positions, axes
+
+
+def trajectory_axes(csv_path):
+    """
+    Read the header of a position csv
+    :return: the coordinate names of the file, ["X", "Y"] or ["X", "Y", "Z"]
+    """
+    return trajectory_columns(csv_path)[2]
+
+
+def arrow_column_names(columns_num, positions, axes):
+    # pyarrow needs a name for every column of the file, the ignored ones get placeholders
+    names = [f"column {i}" for i in range(columns_num)]
+    names[0] = "Frame"
+    for position, axis in zip(positions, axes):
+        names[position] = axis
+    return names
+
+
+def file_ordered(positions, axes):
+    # pandas names the usecols columns in file order, whatever the order of usecols
+    return [axis for _, axis in sorted(zip(positions, axes))]
+
+
+def read_trajectory(csv_path, dtype=np.float64):
+    """
+    Read a position csv (frame index column followed by 2 or 3 coordinate columns, see trajectory_columns)
+    with fixed dtypes, using pyarrow when it is installed and the pandas C parser otherwise.
+    Only the frame index and the coordinate columns are parsed.
+    :param csv_path: path to the position csv
+    :param dtype: float dtype of the coordinates, e.g. np.float32 to halve the memory
+    :return: (coords, frames, axes) with coords a C-contiguous (frames, axes) ndarray,
+             frames the frame index and axes the column names, e.g. ["X", "Y"]
+    """
+    columns_num, positions, axes = trajectory_columns(csv_path)
+
+    if pa_csv is not None:
+        table = pa_csv.read_csv(csv_path,
+                                read_options = pa_csv.ReadOptions(column_names = arrow_column_names(columns_num, positions, axes), skip_rows = 1),
+                                convert_options = pa_csv.ConvertOptions(include_columns = ["Frame"] + axes,
+                                                                        column_types = {axis: pa.float64() for axis in axes}))
+        coords = np.column_stack([table[axis].to_numpy() for axis in axes]).astype(dtype, copy=False)
+        frames = table["Frame"].to_numpy()
+    else:
+        df = pd.read_csv(csv_path,
+                         header = None,
+                         skiprows = 1,
+                         usecols = [0] + positions,
+                         names = ["Frame"] + file_ordered(positions, axes),
+                         index_col = 0,
+                         dtype = {axis: np.float64 for axis in axes},
+                         engine = "c")
+        coords = df[axes].to_numpy(dtype = dtype)
+        frames = df.index.to_numpy()
+
+    return np.ascontiguousarray(coords), frames, axes
+
+
+def iter_trajectory(csv_path, chunk_frames, dtype=np.float64):
+    """
+    Read a position csv in pieces, see read_trajectory, so that memory use does not grow with the recording length.
+    :param csv_path: path to the position csv
+    :param chunk_frames: number of frames per piece (approximate with pyarrow, which reads by blocks of bytes)
+    :return: generator of (coords, axes), coords a C-contiguous (frames, axes) ndarray
+    """
+    columns_num, positions, axes = trajectory_columns(csv_path)
+
+    if pa_csv is not None:
+        # about 32 bytes of text per frame
+        reader = pa_csv.open_csv(csv_path,
+                                 read_options = pa_csv.ReadOptions(column_names = arrow_column_names(columns_num, positions, axes),
+                                                                   skip_rows = 1,
+                                                                   block_size = max(chunk_frames * 32, 1 << 16)),
+                                 convert_options = pa_csv.ConvertOptions(include_columns = axes,
+                                                                         column_types = {axis: pa.float64() for axis in axes}))
+        for batch in reader:
+            coords = np.column_stack([batch.column(axis).to_numpy(zero_copy_only=False) for axis in axes]).astype(dtype, copy=False)
+            yield np.ascontiguousarray(coords), axes
+    else:
+        reader = pd.read_csv(csv_path,
+                             header = None,
+                             skiprows = 1,
+                             usecols = [0] + positions,
+                             names = ["Frame"] + file_ordered(positions, axes),
+                             index_col = 0,
+                             dtype = {axis: np.float64 for axis in axes},
+                             engine = "c",
+                             chunksize = chunk_frames)
+        with reader:
+            for df in reader:
+                yield np.ascontiguousarray(df[axes].to_numpy(dtype = dtype)), axes
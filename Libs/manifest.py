@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+
+from Libs.cache import SidecarCache
+from . import RUN_MANIFEST_DIR, SPEED_SPIKE_POLICY
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    """
+    Version of the analysis code, the sha1 of the Libs/*.py sources, so any code edit invalidates the manifests
+    :return: first 16 hex digits, or None when the sources are not available (frozen build)
+    """
+    sources = sorted(Path(__file__).parent.glob("*.py"))
+    if len(sources) == 0:
+        logger.warning(f"No source files found in {Path(__file__).parent}, cached endpoints will not be reused")
+        return None
+
+    sha1 = hashlib.sha1()
+    for source in sources:
+        sha1.update(source.name.encode())
+        sha1.update(source.read_bytes())
+    return sha1.hexdigest()[:16]
+
+
+def options_digest(AV_interval, AV_profile, streaming = False):
+    """
+    Hash of the analysis options that change the endpoints without being in parameters.json
+    """
+    options = {"AV_interval": AV_interval,
+               "AV_profile": sorted(AV_profile) if AV_profile else None,
+               "SPIKE_POLICY": SPEED_SPIKE_POLICY,
+               "streaming": bool(streaming)}
+    return hashlib.sha1(json.dumps(options, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def to_builtin(value):
+    # numpy scalars to python numbers, so the endpoints can be written as json
+    return value.item() if hasattr(value, "item") else value
+
+
+class RunManifest():
+    """
+    Record of the last analysis of each worm of a treatment: hash of its position csv,
+    digest of the resolved parameters, analysis options and code version, with the endpoints it gave.
+    A worm whose inputs are all unchanged gets its endpoints back instead of being analyzed again.
+    One file per treatment, so treatments of the same day analyzed concurrently never write the same file.
+    """
+
+    def __init__(self, day_dir, treatment_char):
+
+        self.manifest_path = Path(day_dir) / RUN_MANIFEST_DIR / f"{treatment_char}.json"
+        self.entries = self.load() # {"group/worm": entry} of the last run
+        self.current = {} # {"group/worm": entry} of this run
+
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        if not self.manifest_path.exists():
+            return {}
+        try:
+            with open(self.manifest_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            logger.warning(f"Unreadable run manifest at {self.manifest_path}, every worm will be analyzed")
+            return {}
+
+    def save(self):
+        """
+        Write the entries of this run, worms that are gone are dropped
+        """
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.manifest_path.with_suffix(".tmp")
+        with open(temp_path, 'w') as file:
+            json.dump(self.current, file, indent=4)
+        os.replace(temp_path, self.manifest_path)
+
+    @staticmethod
+    def key(group_num, worm_num):
+        return f"{group_num}/{worm_num}"
+
+    def inputs(self, group_num, worm_num, csv_path, params_hash, options_hash):
+        """
+        Describe the inputs of a worm, the csv is only hashed again when its size or mtime changed
+        :return: dictionary to compare with, and store in, the manifest
+        """
+        stat = os.stat(csv_path)
+        previous = self.entries.get(self.key(group_num, worm_num), {})
+        if previous.get("csv") == str(csv_path) and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime_ns:
+            csv_hash = previous["csv_hash"]
+        else:
+            csv_hash = SidecarCache.file_hash(csv_path)
+
+        return {"csv": str(csv_path),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "csv_hash": csv_hash,
+                "params_hash": params_hash,
+                "options_hash": options_hash,
+                "code_version": code_version()}
+
+    def lookup(self, group_num, worm_num, inputs):
+        """
+        :return: the endpoints of the last run if the worm's inputs are unchanged, else None
+        """
+        entry = self.entries.get(self.key(group_num, worm_num))
+        if entry is None or inputs["code_version"] is None:
+            self.misses += 1
+            return None
+
+        for name in ("csv_hash", "params_hash", "options_hash", "code_version"):
+            if entry.get(name) != inputs[name]:
+                self.misses += 1
+                return None
+
+        self.hits += 1
+        self.current[self.key(group_num, worm_num)] = dict(entry, **inputs)
+        return entry["endpoints"]
+
+    def record(self, group_num, worm_num, inputs, endpoints):
+        endpoints = {name: {"value": to_builtin(endpoint["value"]), "unit": endpoint["unit"]} for name, endpoint in endpoints.items()}
+        self.current[self.key(group_num, worm_num)] = dict(inputs, endpoints = endpoints)
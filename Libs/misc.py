@@ -8,9 +8,15 @@ import sys
 from scipy.spatial import ConvexHull
 import numpy as np
 import openpyxl
+import socket
 import subprocess
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+import zipfile
+from xml.etree import ElementTree
 
-from . import HISTORY_PATH, TREATMENT_REP_FORMAT, DAY_FORMAT
+from . import HISTORY_PATH, TREATMENT_REP_FORMAT, DAY_FORMAT, RAW_FORMAT_INDICATOR, COPY_WORKERS
 
 import logging
 logger = logging.getLogger(__name__)
@@ -137,58 +143,93 @@ def find_treatment_num(given_string):
 
     return indicator
     
-# Create event_dict from event binary list
-def event_extractor(binary_list, positive_token = None):
+# Run-length encode the events of a binary list
+def event_runs(binary_list, positive_token = None, min_duration = 1, merge_gap = 0):
+    """
+    Find the runs of positive tokens in a sequence with array operations.
+    :param binary_list: list or ndarray of tokens, e.g. [0, 1, 1, 0] or a boolean mask
+    :param positive_token: token marking an event, by default the non-zero value of a binary list
+    :param min_duration: drop events shorter than this number of frames (after merging)
+    :param merge_gap: merge events separated by at most this number of frames
+    :return: (starts, ends, lengths), int arrays, with inclusive ends like the keys of event_extractor
+    """
 
-    # find unique values in the binary list
-    # binary_list is a list
-    unique_values = list(set(binary_list))
+    values = np.asarray(binary_list)
+    unique_values = np.unique(values)
 
     if len(unique_values) == 2:
         if positive_token is None:
             # positive_token = non zero value in unique_values
-            positive_token = [i for i in unique_values if i != 0][0]
-        else:
-            if positive_token not in unique_values:
-                raise ValueError("The specified positive token is not in the binary list.")
+            positive_token = unique_values[unique_values != 0][0]
+        elif positive_token not in unique_values:
+            raise ValueError("The specified positive token is not in the binary list.")
     elif len(unique_values) > 2:
         if positive_token is None:
             raise ValueError("The binary list has more than two unique values. Please specify the positive token.")
-        else:
-            if positive_token not in unique_values:
-                raise ValueError("The specified positive token is not in the binary list.")
-    
-    binary_list = [1 if i == positive_token else 0 for i in binary_list]
+        elif positive_token not in unique_values:
+            raise ValueError("The specified positive token is not in the binary list.")
+
+    is_event = values == positive_token
+
+    # +1 where an event starts, -1 one frame after it ends
+    edges = np.diff(np.concatenate(([0], is_event.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+
+    if merge_gap > 0 and len(starts) > 1:
+        separated = (starts[1:] - ends[:-1] - 1) > merge_gap
+        starts = starts[np.concatenate(([True], separated))]
+        ends = ends[np.concatenate((separated, [True]))]
+
+    lengths = ends - starts + 1
+
+    if min_duration > 1:
+        kept = lengths >= min_duration
+        starts, ends, lengths = starts[kept], ends[kept], lengths[kept]
 
-    result = {}
-    start, end = None, None
+    return starts, ends, lengths
 
-    for i in range(len(binary_list)):
-        if binary_list[i] == 1:
-            if start is None:
-                start = i
-            end = i
-        elif start is not None:
-            result[(start, end)] = end - start + 1
-            start, end = None, None
 
-    if start is not None:
-        result[(start, end)] = end - start + 1
+# Create event_dict from event binary list
+def event_extractor(binary_list, positive_token = None):
+
+    starts, ends, lengths = event_runs(binary_list, positive_token = positive_token)
 
-    return result
+    return {(start, end): length for start, end, length in zip(starts.tolist(), ends.tolist(), lengths.tolist())}
 
 
 # Excel related functions
-def check_sheet_existence(file_path, sheet_name):
-    # Load the Excel workbook
-    workbook = openpyxl.load_workbook(filename=file_path)
+SPREADSHEET_NAMESPACE = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
 
-    if sheet_name in workbook.sheetnames:
-        return True
-    else:
+def list_sheet_names(file_path):
+    """
+    List the sheet names of an .xlsx file from its manifest (xl/workbook.xml) only,
+    without loading the worksheets. Falls back to openpyxl for files that are not plain xlsx zips.
+    :param file_path: path to the workbook
+    :return: list of sheet names, in workbook order
+    """
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            root = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        return [sheet.get("name") for sheet in root.iter(f"{SPREADSHEET_NAMESPACE}sheet")]
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        logger.debug(f"Could not read the manifest of {file_path} ({e}), loading it with openpyxl")
+        workbook = openpyxl.load_workbook(filename=file_path, read_only=True)
+        sheet_names = list(workbook.sheetnames)
+        workbook.close()
+        return sheet_names
+
+def check_sheet_existence(file_path, sheet_name):
+    if not os.path.isfile(file_path):
         return False
+
+    return sheet_name in list_sheet_names(file_path)
     
 def remove_sheet_by_name(file_path, sheet_name):
+    # Nothing to rewrite if the sheet is not there
+    if not check_sheet_existence(file_path, sheet_name):
+        return False
+
     # Load the Excel workbook
     workbook = openpyxl.load_workbook(filename=file_path)
 
@@ -328,6 +369,23 @@ def merge_cells(file_path, input_sheet_name = None, input_column_name = 'Shoalin
         logger.warning(f"UNSUCCESS merge for {file_path}")
 
 
+def polish_worksheet(sheet, width=17.00):
+    """
+    Set every column of an openpyxl worksheet to the same width and wrap the header row
+    :param sheet: openpyxl worksheet
+    :param width: column width, 17.00 is 160 pixels
+    """
+    # Loop through each column in the sheet
+    for col_idx in range(1, sheet.max_column + 1):
+        sheet.column_dimensions[openpyxl.utils.get_column_letter(col_idx)].width = width
+
+    logger.debug(f"Set {sheet.max_column} columns of {sheet.title} to width {width}")
+
+    # Enable text wrapping for the header row
+    for cell in sheet[1]:
+        cell.alignment = openpyxl.styles.Alignment(wrapText=True, horizontal='center', vertical='center')
+
+
 def excel_polish(file_path, batch_num=1, inplace=True):
 
     logger.debug("Polishing excel file...")
@@ -344,19 +402,7 @@ def excel_polish(file_path, batch_num=1, inplace=True):
 
         if "analysis" in sheet_name.lower():
             continue
-        # Select the sheet
-        sheet = workbook[sheet_name]
-        
-        # Loop through each column in the sheet
-        for col in sheet.columns:
-            # Set the width of the column to 17.00 (160 pixels)
-            sheet.column_dimensions[col[0].column_letter].width = 17.00
-
-            logger.debug(f"Set column {col[0].column_letter} width to 17.00")
-        
-        # Enable text wrapping for the header row
-        for cell in sheet[1]:
-            cell.alignment = openpyxl.styles.Alignment(wrapText=True, horizontal='center', vertical='center')
+        polish_worksheet(workbook[sheet_name])
 
 
     # Save the modified workbook
@@ -407,6 +453,53 @@ def string_diff(string1, string2):
 
     return diff_count
 
+def load_history(history_path=HISTORY_PATH):
+    """
+    Read the projects history file (Bin/projects.json) without the GUI
+    :return: dictionary {project_name: project_data}, empty if there is no history file
+    """
+    if not Path(history_path).exists():
+        return {}
+    with open(history_path, 'r') as file:
+        return json.load(file)
+
+
+def resolve_project(project, history_path=HISTORY_PATH):
+    """
+    Find a project by directory or by its name in the history file
+    :param project: project directory, or project name
+    :return: (project_name, project_dir, project_data), project_data is None for a directory missing from the history
+    """
+    history = load_history(history_path)
+
+    if Path(project).is_dir():
+        project_dir = Path(project).resolve()
+        for project_name, project_data in history.items():
+            if Path(project_data.get("DIRECTORY", "")).resolve() == project_dir:
+                return project_name, project_dir, project_data
+        return project_dir.name, project_dir, None
+
+    if project in history:
+        project_dir = Path(history[project]["DIRECTORY"])
+        if not project_dir.is_dir():
+            logger.error(f"Directory of project {project} not found at {project_dir}")
+            raise FileNotFoundError(f"Directory of project {project} not found at {project_dir}")
+        return project, project_dir, history[project]
+
+    logger.error(f"{project} is neither a project directory nor a project in {history_path}")
+    raise FileNotFoundError(f"{project} is neither a project directory nor a project in {history_path}")
+
+
+def treatment_display_name(treatment_info):
+    """
+    Name of a treatment as shown in the GUI, from its [substance, dose, unit, note] history entry
+    """
+    substance, dose, unit = treatment_info[:3]
+    if unit == "":
+        return substance
+    return f"{substance} {dose} {unit}"
+
+
 def get_folder_info(project_dir, day_num, treatment_char):
     # open HISTORY_PATH
     with open(HISTORY_PATH, 'r') as file:
@@ -560,4 +653,175 @@ def find_uncommon_substrings_in_paths_general(list_of_paths):
         for part in numeric_parts:
             substrings[part] = path
 
-    return substrings
\ No newline at end of file
+    return substrings
+
+
+def find_worm_files(group_path):
+    """
+    Find the position csv files of a Batch folder
+    :param group_path: path of the Batch folder
+    :return: dictionary {worm_num: csv_path}, worm_num as string
+    """
+    raw_files = list(Path(group_path).glob(f"*{RAW_FORMAT_INDICATOR}"))
+
+    if len(raw_files) == 0:
+        logger.error(f"No raw files found at {group_path}")
+        raise FileNotFoundError(f"No raw files found at {group_path}")
+
+    return find_uncommon_substrings_in_paths_general(raw_files)
+
+
+def is_same_file(source, destination, mtime_tolerance=2):
+    """
+    Check if destination is an up-to-date copy of source, by size and modification time
+    :param mtime_tolerance: seconds, network and FAT drives store mtimes with a 2 s resolution
+    """
+    try:
+        source_stat = os.stat(source)
+        destination_stat = os.stat(destination)
+    except FileNotFoundError:
+        return False
+    return source_stat.st_size == destination_stat.st_size and abs(source_stat.st_mtime - destination_stat.st_mtime) <= mtime_tolerance
+
+
+def copy_file(source, destination):
+    """
+    Copy source to destination with its metadata, unless destination is already the same file
+    The copy goes through a temp file, so an interrupted copy never looks complete
+    :return: number of bytes copied, None if skipped
+    """
+    if is_same_file(source, destination):
+        return None
+    temp_path = Path(destination).with_name(f".{Path(destination).name}.part")
+    shutil.copy2(source, temp_path)
+    os.replace(temp_path, destination)
+    return os.path.getsize(destination)
+
+
+def copy_files(copy_pairs, workers=COPY_WORKERS):
+    """
+    Copy files through a bounded thread pool, skipping the ones already copied. Safe to re-run.
+    :param copy_pairs: list of (source, destination) file paths
+    :param workers: number of copying threads
+    :return: (copied, skipped, bytes copied)
+    """
+    _starttime = time.time()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        copied_bytes = list(pool.map(lambda pair: copy_file(*pair), copy_pairs))
+
+    elapsed = max(time.time() - _starttime, 1e-9)
+    copied_bytes = [size for size in copied_bytes if size is not None]
+    copied = len(copied_bytes)
+    skipped = len(copy_pairs) - copied
+    total_bytes = sum(copied_bytes)
+
+    logger.info(f"Copied {copied} files ({total_bytes / 1024**2:.1f} MB), skipped {skipped} unchanged files in {elapsed:.2f} s "
+                f"({copied / elapsed:.1f} files/s, {total_bytes / 1024**2 / elapsed:.1f} MB/s)")
+
+    return copied, skipped, total_bytes
+
+
+class FileLock():
+    """
+    Inter-process lock on a file created with O_EXCL, usable as a context manager.
+    The lock file records its owner (host:pid) and the time it was taken, so a lock left behind
+    by a dead process is broken: when its owner is a finished process of this host, or when it is
+    older than stale_after seconds.
+    """
+
+    def __init__(self, lock_path, timeout=30, stale_after=60):
+
+        self.lock_path = Path(lock_path)
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def read(self):
+        """
+        :return: the {"owner", "host", "pid", "time"} of the lock file, None if it is gone or still being written
+        """
+        try:
+            with open(self.lock_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def is_stale(self, holder):
+        if holder is None:
+            # Gone, or created but not written yet: judge by the file age
+            try:
+                return time.time() - self.lock_path.stat().st_mtime > self.stale_after
+            except FileNotFoundError:
+                return False
+        if time.time() - holder["time"] > self.stale_after:
+            return True
+        # os.kill(pid, 0) only probes the process on POSIX, on Windows it would terminate it
+        if holder["host"] == socket.gethostname() and os.name != "nt":
+            try:
+                os.kill(holder["pid"], 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                return False
+        return False
+
+    def break_stale(self, holder):
+        # Move the lock aside before deleting it, and put it back if another process took it meanwhile
+        broken_path = self.lock_path.with_name(f"{self.lock_path.name}.{os.getpid()}.broken")
+        try:
+            os.replace(self.lock_path, broken_path)
+        except FileNotFoundError:
+            return
+        try:
+            with open(broken_path, 'r') as file:
+                moved = json.load(file)
+        except (OSError, ValueError):
+            moved = None
+        if moved is not None and moved != holder:
+            try:
+                os.link(broken_path, self.lock_path)
+            except FileExistsError:
+                pass
+        else:
+            logger.warning(f"Broke the stale lock {self.lock_path} of {holder['owner'] if holder else 'an unknown process'}")
+        broken_path.unlink(missing_ok=True)
+
+    def acquire(self):
+        """
+        Take the lock, waiting up to timeout seconds for another process to release it
+        """
+        _starttime = time.time()
+        while True:
+            try:
+                handle = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                holder = self.read()
+                if self.is_stale(holder):
+                    self.break_stale(holder)
+                    continue
+                if time.time() - _starttime > self.timeout:
+                    logger.error(f"Lock {self.lock_path} held by {holder['owner'] if holder else 'another process'} for more than {self.timeout} s")
+                    raise TimeoutError(f"Lock {self.lock_path} held for more than {self.timeout} s")
+                time.sleep(0.05)
+                continue
+
+            with os.fdopen(handle, 'w') as file:
+                json.dump({"owner": self.owner,
+                           "host": socket.gethostname(),
+                           "pid": os.getpid(),
+                           "time": time.time()}, file)
+            return
+
+    def release(self):
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,109 @@
+import sqlite3
+import time
+import pandas as pd
+from pathlib import Path
+
+from . import RESULTS_PATH
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ResultsStore():
+    """
+    SQLite database of the worm endpoints of every analyzed project, day and treatment, in long format
+    (one row per worm and endpoint), so results can be queried without reopening EndPoints.xlsx files.
+    A run replaces every row of its project, day, treatment and parameter set, so worms or endpoints that are gone
+    do not linger, while the runs of other parameter sets are kept.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS endpoints (
+            project_dir    TEXT    NOT NULL,
+            project        TEXT    NOT NULL,
+            day            INTEGER NOT NULL,
+            treatment      TEXT    NOT NULL,
+            treatment_name TEXT,
+            batch          INTEGER NOT NULL,
+            well           INTEGER NOT NULL,
+            params_hash    TEXT    NOT NULL,
+            endpoint       TEXT    NOT NULL,
+            unit           TEXT,
+            value          REAL,
+            created        REAL,
+            PRIMARY KEY (project_dir, day, treatment, batch, well, params_hash, endpoint)
+        );
+        CREATE INDEX IF NOT EXISTS idx_endpoints_project ON endpoints (project, day, treatment);
+        CREATE INDEX IF NOT EXISTS idx_endpoints_endpoint ON endpoints (endpoint, params_hash);
+    """
+
+    def __init__(self, db_path = RESULTS_PATH):
+
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.executescript(self.SCHEMA)
+
+    def write_run(self, project_dir, day_num, treatment_char, treatment_name, params_hash, endpoints):
+        """
+        Replace the rows of the treatment and parameter set by the endpoints of one run, in a single transaction
+        :param endpoints: dictionary {(batch, well): {endpoint_name: {"value": value, "unit": unit}}}
+        :return: number of rows written
+        """
+        project_dir = str(Path(project_dir).resolve())
+        project = Path(project_dir).name
+        created = time.time()
+
+        rows = []
+        for (batch, well), worm_endpoints in endpoints.items():
+            for name, endpoint in worm_endpoints.items():
+                value = endpoint["value"]
+                rows.append((project_dir, project, int(day_num), treatment_char, treatment_name,
+                             int(batch), int(well), params_hash,
+                             name, endpoint["unit"], None if value is None else float(value), created))
+
+        with self.connection:
+            self.connection.execute("DELETE FROM endpoints WHERE project_dir = ? AND day = ? AND treatment = ? AND params_hash = ?",
+                                    (project_dir, int(day_num), treatment_char, params_hash))
+            self.connection.executemany("INSERT OR REPLACE INTO endpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+        logger.info(f"Stored {len(rows)} endpoint values of {project}, Day {day_num}, {treatment_name} in {self.db_path}")
+
+        return len(rows)
+
+    def query(self, project = None, day_num = None, treatment_char = None, endpoint = None, params_hash = None):
+        """
+        Read endpoint rows, every given argument filters the rows
+        :return: DataFrame in long format, one row per worm and endpoint
+        """
+        filters = {"project": project, "day": day_num, "treatment": treatment_char,
+                   "endpoint": endpoint, "params_hash": params_hash}
+        conditions = [f"{column} = ?" for column, value in filters.items() if value is not None]
+        values = [value for value in filters.values() if value is not None]
+
+        sql = "SELECT * FROM endpoints"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY project, day, treatment, batch, well, endpoint"
+
+        return pd.read_sql_query(sql, self.connection, params=values)
+
+    def close(self):
+        self.connection.close()
+
+
+def open_results_store(results_store):
+    """
+    Resolve the results_store argument of the Executor, the scheduler and the batch queue
+    :param results_store: True for the default ResultsStore, a ResultsStore, or None to skip it
+    :return: (store or None, True when the store was opened here and must be closed by the caller)
+    """
+    if results_store is not True:
+        return results_store, False
+    try:
+        return ResultsStore(), True
+    except (sqlite3.Error, OSError) as e:
+        # The EndPoints exports do not depend on the database, run without it
+        logger.warning(f"Could not open the results database at {RESULTS_PATH}, endpoints will not be stored: {e}")
+        return None, False
@@ -0,0 +1,239 @@
+import re
+import sqlite3
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Libs.executor import Executor
+from Libs.store import DayStore
+from Libs.dirFetch import get_working_dir
+from Libs.export import get_exporter, MemoryExporter
+from Libs.results import open_results_store
+from Libs.misc import treatment_display_name
+from . import AV_INTERVAL, EXPORT_FORMAT, SCHEDULER_WORKERS, DAY_FORMAT
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def sheet_name_of(treatment_name):
+    # Executor keeps the first 30 characters of the treatment name as sheet name
+    return treatment_name[:30]
+
+
+def prepare_day_store(project_dir, day_num):
+    """
+    Build the DayStore of a day, or check it is up to date, in the parent process
+    before the treatments of that day are dispatched, so the workers only open it
+    :return: True if the workers can read the day store, False if they should read the csv files
+    """
+    try:
+        DayStore.open(get_working_dir(project_dir, day_num))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not build the day store of Day {day_num} in {project_dir}, the position files are read instead: {e}")
+        return False
+    return True
+
+
+def run_treatment(project_dir, day_num, treatment_char, treatment_name, AV_interval = AV_INTERVAL, AV_profile = None, streaming = False, EPA = True,
+                  day_store = False):
+    """
+    Analyze one treatment, run in a worker process by ProjectScheduler
+    :param EPA: run the EndPoints analysis, without it only the project structure is loaded
+    :param day_store: read the trajectories from the DayStore built by prepare_day_store
+    :return: dictionary with the report ("Completed" or "Error"), the endpoint table (None without EPA),
+             the endpoints per (batch, well), the parameter hash and the measured stage times (seconds)
+    """
+    _starttime = time.time()
+
+    if day_store:
+        try:
+            # Never built here, a worker per treatment would each build the whole day
+            day_store = DayStore.open(get_working_dir(project_dir, day_num), rebuild = False)
+        except FileNotFoundError:
+            logger.warning(f"Day store of Day {day_num} is missing or out of date, {treatment_name} reads the position files")
+            day_store = False
+
+    writer = MemoryExporter()
+    executor = Executor(project_dir = project_dir,
+                        day_num = day_num,
+                        treatment_char = treatment_char,
+                        treatment_name = treatment_name,
+                        EndPointsAnalyze = EPA,
+                        sidecar_cache = False, # workers of a project must not write the same cache index
+                        streaming = streaming,
+                        day_store = day_store,
+                        writer = writer,
+                        results_store = None)
+
+    ERROR = executor.PARAMS_LOADING()
+    if ERROR is not None:
+        return {"report": "Error", "error": ERROR, "timing": {"Total": time.time() - _starttime}}
+
+    executor.GROUP_LOADING()
+    REPORT, _ = executor.ENDPOINTS_ANALYSIS(OVERWRITE = True, AV_interval = AV_interval, AV_profile = AV_profile)
+
+    timing = {stage: executor.timing[stage] for stage in ("Project structure", "Parameters loading", "Group loading", "EndPoints analysis") if stage in executor.timing}
+    timing["Total"] = time.time() - _starttime
+
+    return {"report": REPORT,
+            "table": writer.tables.get(executor.treatment_name),
+            "endpoints": {executor.WORM_IDS[key]: endpoints for key, endpoints in executor.EndPoints.items()},
+            "params_hash": executor.PARAMS.digest(),
+            "timing": timing}
+
+
+def project_jobs(project_dir, project_data = None, days = None, treatments = None):
+    """
+    List the (day_num, treatment_char, treatment_name) jobs of a project
+    :param project_data: history entry of the project, for the treatment names shown in the GUI;
+                         without it the names come from the "<char> - <name>" treatment folders
+    :param days: day numbers to keep, all days by default
+    :param treatments: treatment chars to keep, all treatments by default
+    """
+    jobs = []
+    day_dirs = [x for x in Path(project_dir).iterdir() if x.is_dir() and re.fullmatch(DAY_FORMAT.format(r"\d+"), x.name)]
+    for day_dir in sorted(day_dirs, key = lambda x: int(x.name.split(" ")[-1])):
+        day_num = int(day_dir.name.split(" ")[-1])
+        if days is not None and day_num not in days:
+            continue
+
+        day_data = (project_data or {}).get(day_dir.name)
+        if day_data:
+            day_treatments = {key.split(" ")[-1]: treatment_display_name(value) for key, value in day_data.items()}
+        else:
+            day_treatments = {x.name.split(" - ")[0]: x.name.split(" - ", 1)[-1] for x in day_dir.iterdir() if x.is_dir() and " - " in x.name}
+
+        for treatment_char in sorted(day_treatments):
+            if treatments is not None and treatment_char not in treatments:
+                continue
+            jobs.append((day_num, treatment_char, day_treatments[treatment_char]))
+
+    return jobs
+
+
+class ProjectScheduler():
+    """
+    Run the treatments of one or several days of a project concurrently in a process pool.
+    Workers only analyze, the tables come back to the scheduler which writes each day's
+    EndPoints file once, as soon as the last treatment of that day is done.
+    """
+
+    def __init__(self, project_dir, jobs, workers = SCHEDULER_WORKERS, export_format = EXPORT_FORMAT, results_store = True,
+                 AV_interval = AV_INTERVAL, AV_profile = None, streaming = False, OVERWRITE = False, progress = None, EPA = True,
+                 day_store = False):
+        """
+        :param jobs: list of (day_num, treatment_char, treatment_name)
+        :param results_store: True for the default ResultsStore, a ResultsStore, or None to skip it
+        :param OVERWRITE: re-analyze treatments that already have their sheet
+        :param EPA: run the EndPoints analysis, passed to each Executor
+        :param day_store: read the trajectories from a DayStore, built once per day before its treatments run
+        :param progress: callable(value, text) called as treatments finish, e.g. ProgressWindow.group_update
+        """
+        self.project_dir = project_dir
+        self.jobs = list(jobs)
+        self.workers = max(1, int(workers))
+        self.export_format = export_format
+        self.results_store = results_store
+        self.AV_interval = AV_interval
+        self.AV_profile = AV_profile
+        self.streaming = streaming
+        self.OVERWRITE = OVERWRITE
+        self.progress = progress
+        self.EPA = EPA
+        self.day_store = day_store
+
+        self.writers = {} # {day_num: exporter}
+        self.reports = {} # {(day_num, treatment_char): result of run_treatment}
+        self.output_paths = {} # {day_num: EndPoints file or folder}
+
+    def writer(self, day_num):
+        if day_num not in self.writers:
+            self.writers[day_num] = get_exporter(self.project_dir, day_num, export_format = self.export_format)
+        return self.writers[day_num]
+
+    def existing(self):
+        """
+        :return: the jobs whose treatment is already in its day's EndPoints file
+        """
+        return [job for job in self.jobs if self.writer(job[0]).exists(sheet_name_of(job[2]))]
+
+    def update_progress(self, value, text):
+        if self.progress is not None:
+            self.progress(value, text)
+
+    def run(self):
+        """
+        :return: dictionary {(day_num, treatment_char): result}, the reports are "Completed", "Existed" or "Error"
+        """
+        _starttime = time.time()
+
+        tasks = []
+        pending = {} # {day_num: treatments not finished yet}
+        for day_num, treatment_char, treatment_name in self.jobs:
+            writer = self.writer(day_num)
+            self.output_paths[day_num] = writer.output_path
+            if self.EPA and writer.exists(sheet_name_of(treatment_name)):
+                if not self.OVERWRITE:
+                    logger.info(f"Day {day_num}, {treatment_name} is already analyzed, skipped")
+                    self.reports[(day_num, treatment_char)] = {"report": "Existed", "timing": {}}
+                    continue
+                writer.remove(sheet_name_of(treatment_name))
+            tasks.append((day_num, treatment_char, treatment_name))
+            pending[day_num] = pending.get(day_num, 0) + 1
+
+        day_stores = {day_num: prepare_day_store(self.project_dir, day_num) if self.day_store else False for day_num in pending}
+
+        store, own_store = open_results_store(self.results_store)
+
+        try:
+            with ProcessPoolExecutor(max_workers = self.workers) as pool:
+                futures = {pool.submit(run_treatment,
+                                       project_dir = self.project_dir,
+                                       day_num = day_num,
+                                       treatment_char = treatment_char,
+                                       treatment_name = treatment_name,
+                                       AV_interval = self.AV_interval,
+                                       AV_profile = self.AV_profile,
+                                       streaming = self.streaming,
+                                       EPA = self.EPA,
+                                       day_store = day_stores[day_num]): (day_num, treatment_char, treatment_name) for day_num, treatment_char, treatment_name in tasks}
+
+                for done, future in enumerate(as_completed(futures), start = 1):
+                    day_num, treatment_char, treatment_name = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Error during analysis of Day {day_num}, {treatment_name}: {e}")
+                        result = {"report": "Error", "error": str(e), "timing": {}}
+
+                    if result["report"] == "Completed" and result["table"] is not None:
+                        self.writers[day_num].add(sheet_name_of(treatment_name), result.pop("table"))
+                        if store:
+                            try:
+                                store.write_run(project_dir = self.project_dir,
+                                                day_num = day_num,
+                                                treatment_char = treatment_char,
+                                                treatment_name = sheet_name_of(treatment_name),
+                                                params_hash = result["params_hash"],
+                                                endpoints = result["endpoints"])
+                            except sqlite3.Error as e:
+                                logger.warning(f"Failed to store the endpoints of Day {day_num}, {treatment_name} in the results database: {e}")
+                    self.reports[(day_num, treatment_char)] = result
+
+                    # The day's file is written by this thread only, once its last treatment is in
+                    pending[day_num] -= 1
+                    if pending[day_num] == 0:
+                        self.writers[day_num].close()
+
+                    self.update_progress(done / len(futures) * 100, f"Analyzed Day {day_num}, {treatment_name}")
+        finally:
+            if own_store:
+                store.close()
+
+        logger.info(f"Analyzed {len(tasks)} treatments with {self.workers} workers in {time.time() - _starttime:.2f} s")
+
+        # In job order, whatever order the workers finished in
+        self.reports = {(day_num, treatment_char): self.reports[(day_num, treatment_char)] for day_num, treatment_char, _ in self.jobs}
+
+        return self.reports
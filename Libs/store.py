@@ -0,0 +1,212 @@
+import json
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from Libs.loader import trajectory_axes, read_trajectory
+from Libs.misc import find_worm_files, FileLock
+from . import BATCH_FOLDER_FORMAT, DAY_STORE_NAME
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class DayStore():
+    """
+    Consolidated trajectory store of one Day folder: every treatment/batch/well trajectory
+    stacked in a single memory-mapped float64 file, plus a JSON index of row offsets.
+    Worms are served as read-only views into the mapping, so nothing is loaded until it is used
+    and processes opening the same store share its pages through the OS cache.
+    """
+
+    BUILD_TIMEOUT = 600
+
+    def __init__(self, day_dir):
+
+        self.day_dir = Path(day_dir)
+        self.data_path, self.frames_path, self.index_path = self.store_paths(self.day_dir)
+
+        with open(self.index_path, 'r') as file:
+            index = json.load(file)
+
+        self.width = index["width"]
+        self.rows = index["rows"]
+        self.entries = index["entries"] # {"<treatment>/<batch>/<worm_num>": {start, stop, axes, source, size, mtime}}
+
+        self.coords = np.memmap(self.data_path, dtype=np.float64, mode='r', shape=(self.rows, self.width))
+        self.frames = np.memmap(self.frames_path, dtype=np.int64, mode='r', shape=(self.rows,))
+
+    @staticmethod
+    def store_paths(day_dir):
+        day_dir = Path(day_dir)
+        return (day_dir / f"{DAY_STORE_NAME}.dat",
+                day_dir / f"{DAY_STORE_NAME}-frames.dat",
+                day_dir / f"{DAY_STORE_NAME}.json")
+
+    @staticmethod
+    def key(treatment_name, group_name, worm_num):
+        return f"{treatment_name}/{group_name}/{worm_num}"
+
+    @staticmethod
+    def find_sources(day_dir):
+        """
+        List the position csv files of a Day folder
+        :return: list of (treatment_name, group_name, worm_num, csv_path)
+        """
+        sources = []
+        for treatment_dir in sorted(Path(day_dir).iterdir()):
+            if not treatment_dir.is_dir():
+                continue
+            for group_dir in sorted(treatment_dir.glob(BATCH_FOLDER_FORMAT.format("*"))):
+                if not group_dir.is_dir():
+                    continue
+                for worm_num, csv_path in find_worm_files(group_dir).items():
+                    sources.append((treatment_dir.name, group_dir.name, worm_num, Path(csv_path)))
+        return sources
+
+    @classmethod
+    def build(cls, day_dir):
+        """
+        Parse every position csv of the Day folder once and write them into a new store.
+        Trajectories are appended one at a time, so the day is never held in memory at once.
+        """
+        day_dir = Path(day_dir)
+        data_path, frames_path, index_path = cls.store_paths(day_dir)
+
+        sources = cls.find_sources(day_dir)
+        if len(sources) == 0:
+            logger.error(f"No position files found in {day_dir}")
+            raise FileNotFoundError(f"No position files found in {day_dir}")
+
+        width = max(len(trajectory_axes(csv_path)) for *_, csv_path in sources)
+
+        entries = {}
+        # unique temp names, a build must never write into the files of another one
+        temp_data, temp_frames, temp_index = [cls.temp_file(day_dir, path) for path in (data_path, frames_path, index_path)]
+        try:
+            cls.write_arrays(sources, width, temp_data, temp_frames, entries, day_dir)
+            rows = sum(entry["stop"] - entry["start"] for entry in entries.values())
+
+            os.replace(temp_data, data_path)
+            os.replace(temp_frames, frames_path)
+
+            # The index is written last, a store without it is never opened
+            with open(temp_index, 'w') as file:
+                json.dump({"width": width, "rows": rows, "entries": entries}, file, indent=4)
+            os.replace(temp_index, index_path)
+        finally:
+            for temp_path in (temp_data, temp_frames, temp_index):
+                temp_path.unlink(missing_ok=True)
+
+        logger.info(f"Built day store of {len(entries)} trajectories ({rows} frames) at {data_path}")
+
+        return cls(day_dir)
+
+    @staticmethod
+    def temp_file(day_dir, path):
+        handle, temp_path = tempfile.mkstemp(dir=day_dir, prefix=f".{path.stem}-", suffix=".tmp")
+        os.close(handle)
+        return Path(temp_path)
+
+    @classmethod
+    def write_arrays(cls, sources, width, data_path, frames_path, entries, day_dir):
+        """
+        Append the trajectories of sources to the data and frames files, one at a time,
+        so the day is never held in memory at once, and fill entries with their row ranges
+        """
+        rows = 0
+        with open(data_path, 'wb') as data_file, open(frames_path, 'wb') as frames_file:
+            for treatment_name, group_name, worm_num, csv_path in sources:
+                coords, frames, axes = read_trajectory(csv_path)
+                if coords.shape[1] < width:
+                    # 2D worms in a day holding 3D ones, pad Z with NaN
+                    coords = np.pad(coords, ((0, 0), (0, width - coords.shape[1])), constant_values=np.nan)
+
+                data_file.write(np.ascontiguousarray(coords, dtype=np.float64).tobytes())
+                frames_file.write(np.asarray(frames, dtype=np.int64).tobytes())
+
+                stat = csv_path.stat()
+                entries[cls.key(treatment_name, group_name, worm_num)] = {"start": rows,
+                                                                          "stop": rows + len(coords),
+                                                                          "axes": axes,
+                                                                          "source": str(csv_path.relative_to(day_dir)),
+                                                                          "size": stat.st_size,
+                                                                          "mtime": stat.st_mtime_ns}
+                rows += len(coords)
+
+    @classmethod
+    def open(cls, day_dir, rebuild=True):
+        """
+        Open the store of a Day folder, building it when it is missing or out of date
+        :param rebuild: if False, a missing or outdated store raises FileNotFoundError instead
+        """
+        *_, index_path = cls.store_paths(day_dir)
+        if index_path.exists():
+            store = cls(day_dir)
+            if store.is_current():
+                return store
+            logger.info(f"Day store at {day_dir} is out of date")
+        if not rebuild:
+            logger.error(f"No up-to-date day store at {day_dir}")
+            raise FileNotFoundError(f"No up-to-date day store at {day_dir}")
+
+        # Another run may be building the same day, wait for it and use its store
+        with FileLock(Path(day_dir) / f"{DAY_STORE_NAME}.lock", timeout=cls.BUILD_TIMEOUT, stale_after=cls.BUILD_TIMEOUT):
+            if index_path.exists():
+                store = cls(day_dir)
+                if store.is_current():
+                    return store
+            return cls.build(day_dir)
+
+    def is_current(self):
+        """
+        Check that the store covers the same csv files, with the same size and mtime, as the Day folder
+        """
+        sources = self.find_sources(self.day_dir)
+        if len(sources) != len(self.entries):
+            return False
+        for treatment_name, group_name, worm_num, csv_path in sources:
+            entry = self.entries.get(self.key(treatment_name, group_name, worm_num))
+            if entry is None:
+                return False
+            stat = csv_path.stat()
+            if (entry["size"], entry["mtime"]) != (stat.st_size, stat.st_mtime_ns):
+                return False
+        return True
+
+    def trajectory(self, treatment_name, group_name, worm_num):
+        """
+        Zero-copy views of one worm
+        :return: (coords, frames, axes), see Libs.loader.read_trajectory
+        """
+        key = self.key(treatment_name, group_name, worm_num)
+        try:
+            entry = self.entries[key]
+        except KeyError:
+            logger.error(f"No trajectory {key} in the day store of {self.day_dir}")
+            raise KeyError(f"No trajectory {key} in the day store of {self.day_dir}")
+
+        rows = slice(entry["start"], entry["stop"])
+        axes = entry["axes"]
+        return self.coords[rows, :len(axes)], self.frames[rows], axes
+
+    def group(self, treatment_name, group_name):
+        """
+        All worms of a Batch folder as DataFrames wrapping the mapped views
+        :return: dictionary {worm_num: DataFrame}
+        """
+        prefix = self.key(treatment_name, group_name, "")
+        group_dict = {}
+        for key in self.entries:
+            if key.startswith(prefix):
+                worm_num = key[len(prefix):]
+                coords, frames, axes = self.trajectory(treatment_name, group_name, worm_num)
+                group_dict[worm_num] = pd.DataFrame(coords, index=frames, columns=axes, copy=False)
+
+        if len(group_dict) == 0:
+            logger.error(f"No trajectories of {treatment_name}/{group_name} in the day store of {self.day_dir}")
+            raise FileNotFoundError(f"No trajectories of {treatment_name}/{group_name} in the day store of {self.day_dir}")
+
+        return group_dict
@@ -0,0 +1,454 @@
+import numpy as np
+
+from Libs.general import CustomDisplay
+from Libs.calculation import step_lengths, center_points, center_distances, correct_speed_spikes
+from Libs.calculation import turning_angles_array, angular_velocity_bins, profile_intervals
+from Libs.calculation import fd_thresholds, correlation_counts, log_correlation_from_counts
+from Libs.calculation import wide_turns, entropy_from_counts, loglog_fit, FD_MIN_FRAMES
+from Libs.loader import iter_trajectory
+from Libs.misc import find_worm_files, event_runs
+from Libs.dirFetch import get_treatment_dir
+from . import ALLOWED_DECIMALS, BATCH_FOLDER_FORMAT, STREAM_CHUNK_FRAMES
+from . import SPEED_THRESHOLD, FAST_FORWARD_FACTOR, FREEZING_THRESHOLD, SPEED_SPIKE_POLICY, AV_SPEED_THRESHOLD
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class RunningStats(CustomDisplay):
+    """
+    Count, sum, max and min of a series that arrives in chunks,
+    summarized like the in-memory containers (total, avg, max, min).
+    """
+
+    __slots__ = ('count', 'sum', 'maximum', 'minimum', 'unit')
+
+    def __init__(self, unit):
+
+        self.count = 0
+        self.sum = 0.0
+        self.maximum = -np.inf
+        self.minimum = np.inf
+        self.unit = unit
+
+    def update(self, values):
+
+        if values.size == 0:
+            return
+        self.count += values.size
+        self.sum += float(np.sum(values))
+        self.maximum = float(np.maximum(self.maximum, np.max(values)))
+        self.minimum = float(np.minimum(self.minimum, np.min(values)))
+
+    @property
+    def total(self):
+        return round(self.sum, ALLOWED_DECIMALS)
+
+    @property
+    def avg(self):
+        return round(self.sum / self.count, ALLOWED_DECIMALS)
+
+    @property
+    def max(self):
+        return round(self.maximum, ALLOWED_DECIMALS)
+
+    @property
+    def min(self):
+        return round(self.minimum, ALLOWED_DECIMALS)
+
+
+
+class RunningClasses(RunningStats):
+    """
+    RunningStats with the slow/fast percentages of Speed (values < threshold, out of total_frames)
+    or of Speed_A (values <= threshold, out of the number of values).
+    """
+
+    __slots__ = ('threshold', 'inclusive', 'total_frames', 'slow_count')
+
+    def __init__(self, unit, threshold, inclusive = False, total_frames = None):
+
+        super().__init__(unit = unit)
+        self.threshold = threshold
+        self.inclusive = inclusive
+        self.total_frames = total_frames
+        self.slow_count = 0
+
+    def update(self, values):
+
+        if self.inclusive:
+            self.slow_count += int(np.count_nonzero(values <= self.threshold))
+        else:
+            self.slow_count += int(np.count_nonzero(values < self.threshold))
+        super().update(values)
+
+    @property
+    def slow(self):
+        total = self.total_frames if self.total_frames is not None else self.count
+        return round(self.slow_count / total * 100, ALLOWED_DECIMALS)
+
+    @property
+    def fast(self):
+        total = self.total_frames if self.total_frames is not None else self.count
+        return round((self.count - self.slow_count) / total * 100, ALLOWED_DECIMALS)
+
+
+
+class RunningAngularVelocity(RunningClasses):
+    """
+    Running Speed_A, with the same range check on the angular velocities.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, THRESHOLD = AV_SPEED_THRESHOLD):
+
+        super().__init__(unit = 'degree/s', threshold = THRESHOLD, inclusive = True)
+
+    def update(self, values):
+
+        out_of_range = np.flatnonzero((values < 0) | (values > 181))
+        if out_of_range.size > 0:
+            i = out_of_range[0]
+            speed = values[i]
+            if speed < 0:
+                raise Exception(f"Negative speed, {speed=} found, please check your input.")
+            raise Exception(f"Speed > 180, {speed=} found at position {self.count + i} please check your input.")
+
+        super().update(values)
+
+
+
+class RunningTime(CustomDisplay):
+
+    __slots__ = ('frames', 'duration', 'unit')
+
+    def __init__(self):
+
+        self.frames = 0
+        self.duration = 0 # in frames
+        self.unit = 'frames'
+
+    def update(self, mask):
+
+        self.frames += mask.size
+        self.duration += int(np.count_nonzero(mask))
+
+    @property
+    def percentage(self):
+        return self.duration / self.frames * 100
+
+    @property
+    def not_duration(self):
+        return self.frames - self.duration
+
+    @property
+    def not_percentage(self):
+        return 100 - self.percentage
+
+
+
+class RunningEvents(CustomDisplay):
+    """
+    Count and longest run of an event mask that arrives in chunks, a run crossing a chunk border counts once.
+    """
+
+    __slots__ = ('duration', 'count', 'longest', 'current', 'unit')
+
+    def __init__(self, duration = 1):
+
+        self.duration = duration
+        self.count = 0
+        self.longest = 0
+        self.current = 0 # length of the run still open at the end of the last chunk
+        self.unit = 'frames'
+
+    def update(self, mask):
+
+        if mask.size == 0:
+            return
+
+        starts, ends, lengths = event_runs(mask, positive_token = True)
+        if len(lengths) == 0:
+            self.current = 0
+            return
+
+        if self.current > 0 and starts[0] == 0:
+            lengths[0] += self.current
+            self.count -= 1
+
+        self.count += len(lengths)
+        self.longest = max(self.longest, int(np.max(lengths)))
+        self.current = int(lengths[-1]) if ends[-1] == mask.size - 1 else 0
+
+    @property
+    def percentage(self):
+        return self.longest / self.duration * 100
+
+
+
+class RunningAngle(CustomDisplay):
+    """
+    Turning angles of one interval and their angular velocity bins, from XY chunks.
+    The last two sampled points and the angles of the unfinished second are carried to the next chunk,
+    so every angle and every bin sum is computed exactly as on the whole trajectory.
+    """
+
+    __slots__ = ('interval', 'chunk_size', 'ragged', 'next_frame', 'carry', 'pending', 'absolute', 'velocity', 'unit')
+
+    def __init__(self, frame_rate, interval = 1, ragged = "keep", THRESHOLD = AV_SPEED_THRESHOLD):
+
+        self.interval = interval
+        self.chunk_size = int(frame_rate/interval)
+        self.ragged = ragged
+        self.next_frame = 0 # index of the first frame of the next chunk
+        self.carry = np.empty((0, 2), dtype=np.float64)
+        self.pending = np.empty(0, dtype=np.float64)
+        self.absolute = RunningStats(unit = 'degree')
+        self.velocity = RunningAngularVelocity(THRESHOLD = THRESHOLD)
+        self.unit = 'degree'
+
+    def update(self, xy):
+
+        # Frames 0, interval, 2*interval, ... of the whole trajectory
+        first = (-self.next_frame) % self.interval
+        self.next_frame += len(xy)
+
+        points = np.concatenate((self.carry, xy[first::self.interval]))
+        self.carry = points[-2:].copy()
+
+        angles = turning_angles_array(points)
+        self.absolute.update(np.abs(angles))
+
+        self.pending = np.concatenate((self.pending, angles))
+        full = len(self.pending) // self.chunk_size * self.chunk_size
+        if full > 0:
+            self.velocity.update(angular_velocity_bins(self.pending[:full], self.chunk_size, ragged = "drop"))
+            self.pending = self.pending[full:]
+
+    def finish(self):
+
+        # The last, shorter second
+        if self.pending.size > 0:
+            self.velocity.update(angular_velocity_bins(self.pending, self.chunk_size, ragged = self.ragged))
+            self.pending = self.pending[:0]
+
+    @property
+    def total(self):
+        return self.absolute.total
+
+    @property
+    def avg(self):
+        return self.absolute.avg
+
+
+
+class RunningFDEntropy():
+    """
+    Fractal dimension and entropy of an XY trajectory arriving in chunks.
+    Step lengths are counted at the regression thresholds (a histogram whose counts add up across chunks),
+    and the last point and displacement are carried to the next chunk for the turns.
+    """
+
+    def __init__(self):
+
+        self.thresholds = fd_thresholds(FD_MIN_FRAMES) # the same for any trajectory long enough
+        self.counts = np.zeros(len(self.thresholds), dtype=np.int64)
+        self.frames = 0
+        self.last_point = np.empty((0, 2), dtype=np.float64)
+        self.last_delta = np.empty((0, 2), dtype=np.float64)
+        self.last_r = np.empty(0, dtype=np.float64)
+        self.wide_count = 0
+        self.turn_count = 0
+
+    def update(self, xy):
+
+        self.frames += len(xy)
+        points = np.concatenate((self.last_point, xy))
+        self.last_point = points[-1:].copy()
+
+        deltas = np.diff(points, axis=0)
+        squared = deltas[:, 0] ** 2
+        squared += deltas[:, 1] ** 2
+        delta_r = np.sqrt(squared)
+
+        self.counts += correlation_counts(delta_r, self.thresholds)
+
+        deltas = np.concatenate((self.last_delta, deltas))
+        delta_r = np.concatenate((self.last_r, delta_r))
+        if len(deltas) >= 2:
+            wide = wide_turns(deltas, delta_r)
+            self.wide_count += int(np.count_nonzero(wide))
+            self.turn_count += wide.size
+        self.last_delta = deltas[-1:].copy()
+        self.last_r = delta_r[-1:].copy()
+
+    def result(self):
+
+        logr, logCr = log_correlation_from_counts(self.counts, self.frames)
+        FractalDimension = loglog_fit([logr], [logCr])[0]
+        Entropy = entropy_from_counts(self.wide_count, self.turn_count)
+
+        return FractalDimension, Entropy
+
+
+
+class StreamingAnalysis():
+    """
+    Bounded-memory counterpart of analyzer.GeneralAnalysis, for recordings too long to hold in memory.
+    The position csv is read STREAM_CHUNK_FRAMES frames at a time and every endpoint is kept in a running
+    accumulator, exposing the attributes read by executor.EndPoints_Adder.
+    Counts, angles, bins and the fractal dimension are exact, sums and averages match to ALLOWED_DECIMALS.
+    """
+
+    def __init__(self, project_dir, day_num, treatment_char, group_num, worm_num, params, chunk_frames = STREAM_CHUNK_FRAMES):
+
+        self.project_dir = project_dir
+        self.day_num = day_num
+        self.treatment_char = treatment_char
+        self.worm_num = worm_num
+        self.PARAMS = params
+        self.chunk_frames = chunk_frames
+
+        self.group_name = BATCH_FOLDER_FORMAT.format(group_num)
+
+        try:
+            self.TOTAL_FRAMES = int(self.PARAMS["DURATION"] * self.PARAMS["FRAME RATE"])
+        except:
+            logger.error("Failed to load 'DURATION' and 'FRAME RATE' from parameters.json")
+            raise ValueError("Failed to load 'DURATION' and 'FRAME RATE' from parameters.json")
+
+        self.treatment_dir = get_treatment_dir(project_dir = self.project_dir,
+                                               day_num = self.day_num,
+                                               treatment_char = self.treatment_char)
+
+        try:
+            self.csv_path = find_worm_files(self.treatment_dir / self.group_name)[str(self.worm_num)]
+            self.Loaded = True
+        except KeyError:
+            logger.error(f"Failed to load worm {self.worm_num} from {self.group_name}")
+            self.csv_path = None
+            self.Loaded = False
+
+    def center_params(self, axes, TARGET = "CENTER"):
+
+        all_worm_target_params = self.PARAMS[TARGET]
+        if all_worm_target_params is None:
+            logger.error(f"Failed to load {TARGET} from parameters.json")
+            raise KeyError(f"Failed to load {TARGET} from parameters.json")
+
+        try:
+            target_params = all_worm_target_params[str(self.worm_num)]
+        except KeyError:
+            logger.error(f"Failed to load {TARGET} for worm {self.worm_num}")
+            raise KeyError(f"Failed to load {TARGET} for worm {self.worm_num}")
+
+        target_axes, target_point = center_points(target_params)
+        for axis in target_axes:
+            if axis not in axes:
+                _message = f"No {axis} coordinate found in Treatment {self.treatment_char}, {self.group_name}, Worm {self.worm_num}"
+                logger.error(_message)
+                raise KeyError(_message)
+
+        return [axes.index(axis) for axis in target_axes], target_point
+
+    def BasicCalculation(self, DEFAULT_INTERVAL = 1, SPIKE_POLICY = SPEED_SPIKE_POLICY, AV_PROFILE = None):
+
+        if not self.Loaded:
+            logger.error(f"No position file of worm {self.worm_num} in {self.treatment_dir / self.group_name}")
+            raise FileNotFoundError(f"No position file of worm {self.worm_num} in {self.treatment_dir / self.group_name}")
+
+        FRAME_RATE = self.PARAMS["FRAME RATE"]
+
+        if DEFAULT_INTERVAL > FRAME_RATE:
+            logger.error(f"User set {DEFAULT_INTERVAL=} but {FRAME_RATE=} is smaller than {DEFAULT_INTERVAL=}. Please check the code.")
+            raise Exception(f"{FRAME_RATE=} is smaller than {DEFAULT_INTERVAL=}. Please check the code.")
+
+        if FRAME_RATE % DEFAULT_INTERVAL != 0:
+            logger.error(f"User set {DEFAULT_INTERVAL=} but {FRAME_RATE=} is not divisible by {DEFAULT_INTERVAL=}. Please check the code.")
+            raise Exception(f"{FRAME_RATE=} is not divisible by {DEFAULT_INTERVAL=}. Please check the code.")
+
+        # "interpolate" and "median" need the frames after a spike, which may be in the next chunk
+        if SPIKE_POLICY != "previous":
+            logger.error(f"Streaming analysis only supports the 'previous' spike policy, got {SPIKE_POLICY=}")
+            raise ValueError(f"Streaming analysis only supports the 'previous' spike policy, got {SPIKE_POLICY=}")
+
+        angles = {DEFAULT_INTERVAL: RunningAngle(frame_rate = FRAME_RATE, interval = DEFAULT_INTERVAL)}
+        AV_PROFILE = profile_intervals(AV_PROFILE or [], FRAME_RATE)
+        for interval in AV_PROFILE:
+            if interval not in angles:
+                angles[interval] = RunningAngle(frame_rate = FRAME_RATE, interval = interval)
+
+        NORMALIZED_SPEED_THRESHOLD = SPEED_THRESHOLD * FAST_FORWARD_FACTOR
+
+        self.distance = RunningStats(unit = 'cm')
+        self.speed = RunningClasses(unit = 'cm/s', threshold = FREEZING_THRESHOLD, total_frames = self.TOTAL_FRAMES)
+        self.speed_replaced = 0
+        self.distance_to_center = RunningStats(unit = 'cm')
+        self.time_in_center = RunningTime()
+        self.travel_in_center = RunningEvents(duration = self.PARAMS["DURATION"])
+        fd_entropy = RunningFDEntropy()
+
+        last_point = None
+        last_valid_speed = np.empty(0, dtype=np.float64)
+        center_axes = None
+
+        for coords, axes in iter_trajectory(self.csv_path, self.chunk_frames):
+            if len(coords) == 0:
+                continue
+            if center_axes is None:
+                center_axes, center_point = self.center_params(axes)
+
+            xy = coords[:, :2]
+
+            #####################################################################################
+
+            steps = step_lengths(coords = coords if last_point is None else np.concatenate((last_point, coords)),
+                                 conversion_rate = self.PARAMS["CONVERSION RATE"],
+                                 decimals = ALLOWED_DECIMALS)
+            last_point = coords[-1:].copy()
+            self.distance.update(steps)
+
+            # The last valid speed of the previous chunks leads the chunk, so spikes at its start can use it
+            raw_speeds = steps/(1/FRAME_RATE)
+            speeds, replaced = correct_speed_spikes(speeds = np.concatenate((last_valid_speed, raw_speeds)),
+                                                    threshold = NORMALIZED_SPEED_THRESHOLD,
+                                                    policy = SPIKE_POLICY)
+            speeds = speeds[len(last_valid_speed):]
+            self.speed_replaced += replaced
+            self.speed.update(speeds)
+            valid = np.flatnonzero(raw_speeds < NORMALIZED_SPEED_THRESHOLD)
+            if valid.size > 0:
+                last_valid_speed = raw_speeds[valid[-1:]]
+
+            #####################################################################################
+
+            for angle in angles.values():
+                angle.update(xy)
+
+            #####################################################################################
+
+            distances, in_center = center_distances(coords = coords[:, center_axes],
+                                                    centers = center_point,
+                                                    conversion_rate = self.PARAMS["CONVERSION RATE"],
+                                                    center_range = self.PARAMS["THIGMOTAXIS RANGE"],
+                                                    decimals = ALLOWED_DECIMALS)
+            self.distance_to_center.update(distances)
+            self.time_in_center.update(in_center)
+            self.travel_in_center.update(in_center)
+
+            #####################################################################################
+
+            fd_entropy.update(xy)
+
+        for angle in angles.values():
+            angle.finish()
+
+        logger.debug(f"Speed replaced {self.speed_replaced} times ({SPIKE_POLICY=}) due to speed > {NORMALIZED_SPEED_THRESHOLD} cm/s, FAST_FORWARD_FACTOR = {FAST_FORWARD_FACTOR}")
+
+        self.turning_angle = angles[DEFAULT_INTERVAL]
+        self.angular_velocity_profile = {interval: angles[interval].velocity for interval in AV_PROFILE}
+
+        self.meandering = self.turning_angle.total / self.distance.total * 100
+
+        self.fractal_dimension, self.entropy = fd_entropy.result()
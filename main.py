@@ -16,12 +16,13 @@ import logging
 from colorlog import ColoredFormatter
 
 import threading
+import multiprocessing
 
-from Libs import CHARS, ORDINALS, HISTORY_PATH
+from Libs import CHARS, ORDINALS, HISTORY_PATH, AV_INTERVAL
 from Libs.misc import initiator, open_explorer
 from Libs.classes import *
 from Libs.project import CreateProject
-from Libs.executor import Executor
+from Libs.scheduler import ProjectScheduler
 
 
 customtkinter.set_appearance_mode("Light")  # Modes: "System" (standard), "Dark", "Light"
@@ -894,165 +895,79 @@ class MainApp(customtkinter.CTk):
         
         return True
 
-    def analyze_treatment(self, PROGRESS_WINDOW, treatment_char = None, treatment_name = None):
+    def analyze_project(self):
 
         if self.CURRENT_PROJECT == "":
             tkinter.messagebox.showerror("Error", "Please select a project")
             return
-        
-        project_dir = Path(THE_HISTORY.get_project_dir(self.CURRENT_PROJECT))
-
-        try:
-            day_num = int(self.get_day_num())
-        except ValueError:
-            day_num = 1
-
-        if treatment_char == None:
-            treatment_char = self.get_treatment_char()
-        else:
-            treatment_char = treatment_char
-
-        logger.info(f"Start analyzing treatment: {treatment_char}")
-
-        static_path = get_static_dir(project_dir, day_num, treatment_char)
-
-        #######################################################################
-
-        EXECUTOR = Executor(project_dir=project_dir, 
-                            day_num = day_num, 
-                            treatment_char=treatment_char, 
-                            treatment_name=treatment_name,
-                            EndPointsAnalyze=self.EPA,
-                            progress_window=PROGRESS_WINDOW)
-        
-        #######################################################################
-        PROGRESS_WINDOW.lift()
-        PROGRESS_WINDOW.step_update(0, text = "Loading parameters...")
-        
-        while True:
-            ERROR = EXECUTOR.PARAMS_LOADING()
-            if ERROR == None:
-                logger.debug("Parameters loaded successfully")
-                break
-            else:
-                tkinter.messagebox.showerror("ERROR", ERROR)
-                logger.error(ERROR)
-                PROGRESS_WINDOW.destroy()
-                return
-            
-        time.sleep(1)
-        #######################################################################
-
-        PROGRESS_WINDOW.lift()
-        PROGRESS_WINDOW.step_update(20, text = "Loading parameters...")
-        
-        while True:
-            ERROR = EXECUTOR.GROUP_LOADING()
-            if ERROR == None:
-                logger.debug("Group loaded successfully")
-                break
-            else:
-                tkinter.messagebox.showerror("ERROR", ERROR)
-                logger.error(ERROR)
-                PROGRESS_WINDOW.destroy()
-                return
-            
-        time.sleep(1)
-        #######################################################################
-
-        PROGRESS_WINDOW.step_update(40, text = "Analyzing...")
-        # Lift the window to the front
-
-        OVERWRITE = False
-        while True:
-            PROGRESS_WINDOW.lift()
-            REPORT, EPA_path = EXECUTOR.ENDPOINTS_ANALYSIS(OVERWRITE=OVERWRITE, AV_interval=30)
-            if REPORT == "Completed":
-                logger.debug("Analysis completed successfully")
-                break
-            elif REPORT == "Existed":
-                choice = tkinter.messagebox.askyesno("Error",  f"Sheet name {treatment_char} existed.\nDo you want to overwrite? Y/N?")
-                if choice:
-                    logger.debug("User chose to overwrite")
-                    OVERWRITE = True
-                else:
-                    logger.debug("User chose not to overwrite")
-                    return EPA_path, static_path
-            elif REPORT == "Skip":
-                _message = f"Skip analysis of {treatment_char}"
-                tkinter.messagebox.showinfo(REPORT, _message)
-                logger.debug(_message)
-                return EPA_path, static_path
-            elif REPORT == "Error":
-                tkinter.messagebox.showerror(REPORT, f"Error during analysis of {treatment_char}")
-                logger.error(f"Error during analysis of {treatment_char}")
-                return None, None
-            
-        PROGRESS_WINDOW.step_update(100, text = "Completed")
-
-        #######################################################################
-
-        return EPA_path, static_path
-
-    def analyze_project(self):
 
         PROGRESS_WINDOW = ProgressWindow(self)
 
-        time00 = time.time()
-        time0 = time.time()
-
-        time_for_treatment = {}
+        try:
+            time00 = time.time()
 
-        CHAR_TREATMENT_DICT = {self.treatment_to_treatment_char(treatment): treatment for treatment in self.TREATMENTLIST}
-        # TREATMENT_LIST_CHAR = [self.treatment_to_treatment_char(treatment) for treatment in self.TREATMENTLIST]
+            CHAR_TREATMENT_DICT = {self.treatment_to_treatment_char(treatment): treatment for treatment in self.TREATMENTLIST}
 
-        # for i, treatment_char in enumerate(TREATMENT_LIST_CHAR):
-        i = 0
-        for treatment_char, treatment_name in CHAR_TREATMENT_DICT.items():
-
-            # _message = f"Analyzing treatment {treatment_char}"
-            # _progress = (i+1) / len(TREATMENT_LIST_CHAR) * 100
-            _message = f"Analyzing {treatment_name}"
-            _progress = (i+1) / len(CHAR_TREATMENT_DICT) * 100
-            PROGRESS_WINDOW.group_update(_progress, text = _message)
-            logger.info(_message)
-            EPA_path, static_path = self.analyze_treatment(PROGRESS_WINDOW, 
-                                                           treatment_char=treatment_char, 
-                                                           treatment_name=treatment_name)
-
-            i+= 1
-            
-            if EPA_path == None and static_path == None:
-                PROGRESS_WINDOW.destroy()
-                return
+            project_dir = Path(THE_HISTORY.get_project_dir(self.CURRENT_PROJECT))
+            try:
+                day_num = int(self.get_day_num())
+            except ValueError:
+                day_num = 1
+
+            # Treatments run concurrently, the EndPoints of the day are written once when they are all done
+            SCHEDULER = ProjectScheduler(project_dir = project_dir,
+                                         jobs = [(day_num, treatment_char, treatment_name) for treatment_char, treatment_name in CHAR_TREATMENT_DICT.items()],
+                                         AV_interval = AV_INTERVAL,
+                                         progress = PROGRESS_WINDOW.group_update,
+                                         EPA = self.EPA)
+
+            existed = SCHEDULER.existing()
+            if len(existed) > 0:
+                existed_names = ", ".join([treatment_name for _, _, treatment_name in existed])
+                choice = tkinter.messagebox.askyesno("Error",  f"Sheet name {existed_names} existed.\nDo you want to overwrite? Y/N?")
+                logger.debug(f"User chose {'to' if choice else 'not to'} overwrite")
+                SCHEDULER.OVERWRITE = choice
 
-            time_for_treatment[treatment_char] = time.time() - time0
-            time0 = time.time()
+            PROGRESS_WINDOW.lift()
+            PROGRESS_WINDOW.group_update(0, text = f"Analyzing {len(CHAR_TREATMENT_DICT)} treatments...")
+            REPORTS = SCHEDULER.run()
+        finally:
+            # Destroy the progress window, also when the run failed
+            logger.debug("Destroying the progress window")
+            PROGRESS_WINDOW.destroy()
 
-        # Destroy the progress window
-        logger.debug("Destroying the progress window")
-        PROGRESS_WINDOW.destroy()
+        errors = [treatment_name for treatment_char, treatment_name in CHAR_TREATMENT_DICT.items() if REPORTS[(day_num, treatment_char)]["report"] == "Error"]
+        if len(errors) > 0:
+            tkinter.messagebox.showerror("Error", f"Error during analysis of {', '.join(errors)}")
 
         _message = f"Time taken: {round(time.time() - time00, 2)} seconds"
         _message += f"\nTime taken for each treatment:"
-        # for treatment_char in TREATMENT_LIST_CHAR:
         for treatment_char, treatment_name in CHAR_TREATMENT_DICT.items():
-            _message += f"\n  {treatment_name}: {round(time_for_treatment[treatment_char], 2)} seconds"
+            timing = REPORTS[(day_num, treatment_char)]["timing"]
+            if "Total" not in timing:
+                _message += f"\n  {treatment_name}: {REPORTS[(day_num, treatment_char)]['report']}"
+                continue
+            _message += f"\n  {treatment_name}: {round(timing['Total'], 2)} seconds"
+            _message += f" (loading {round(timing.get('Parameters loading', 0) + timing.get('Group loading', 0), 2)} s, analysis {round(timing.get('EndPoints analysis', 0), 2)} s)"
         tkinter.messagebox.showinfo("Completion time", _message)
 
-
-        logger.debug("EPA_path is not None")
-        if EPA_path.exists():
+        # EndPoints.xlsx, or the EndPoints folder of the csv/parquet/feather exports
+        EPA_path = SCHEDULER.output_paths.get(day_num)
+        if EPA_path is None:
+            message = f"Nothing analyzed, no treatment found for Day {day_num}"
+            tkinter.messagebox.showinfo("Analysis Complete", message)
+            logger.info(message)
+        elif EPA_path.exists():
             logger.debug("EPA_path exists")
-            open_path = EPA_path.parent
+            open_path = EPA_path if EPA_path.is_dir() else EPA_path.parent
             _ = CustomDialog(self, title = "Analysis Complete",
-                                message =  "Click GO button to go to the saved directory of EndPoints.xlsx", 
+                                message =  f"Click GO button to go to the saved directory of {EPA_path.name}", 
                                 button_text = "GO",
                                 button_command = lambda : open_explorer(path=open_path))
             logger.info("Analysis complete")
         else:
             logger.debug("EPA_path does not exist")
-            message = "Something went wrong during the analysis, no exported EndPoints.xlsx found"
+            message = f"Something went wrong during the analysis, no exported {EPA_path.name} found"
             tkinter.messagebox.showerror("Error", message)
             logger.info(message)
 
@@ -1082,5 +997,7 @@ class MainApp(customtkinter.CTk):
         self.quit()
 
 if __name__ == "__main__":
+    # analysis workers are separate processes, needed for frozen Windows builds
+    multiprocessing.freeze_support()
     app = MainApp()
     app.mainloop()
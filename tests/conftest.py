@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+
+# Libs is imported from the repository root, as main.py does
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def position_day(tmp_path):
+    """
+    Day folder of position csv files: 2 treatments, 2 batches of 3 wells, 300 frames each with a few tracking jumps
+    :return: path of the Day folder
+    """
+    rng = np.random.default_rng(0)
+    day_dir = tmp_path / "Day 1"
+    for treatment_name in ("A - Control", "B - Eu 0.5 ppm"):
+        for batch_num in (1, 2):
+            batch_dir = day_dir / treatment_name / f"Batch {batch_num}"
+            batch_dir.mkdir(parents=True)
+            for worm_num in (1, 2, 3):
+                coords = 250 + np.cumsum(rng.normal(0, 1, size = (300, 2)), axis = 0).round(3)
+                coords[[100, 201, 202]] += 20 # tracking jumps, speed spikes
+                pd.DataFrame(coords, columns = ["x", "y"]).to_csv(batch_dir / f"Trial-Well {worm_num}-position.csv")
+    return day_dir
+
+
+@pytest.fixture
+def position_project(position_day):
+    """
+    Project folder around position_day, with the parameters.json of both treatments
+    :return: path of the project folder
+    """
+    params = {"CONVERSION RATE": 82,
+              "FRAME RATE": 30,
+              "DURATION": 10,
+              "AV SPEED THREDHOLD": 90,
+              "FREEZING THRESHOLD": 0.06,
+              "SPEED THRESHOLD": 0.16666666666666666,
+              "FAST FORWARD FACTOR": 10,
+              "THIGMOTAXIS RANGE": 0.1,
+              "CENTER": {str(worm_num): {"X": 250, "Y": 250} for worm_num in (1, 2, 3)}}
+    for treatment_char in ("A", "B"):
+        static_dir = position_day / "static" / treatment_char
+        static_dir.mkdir(parents=True)
+        with open(static_dir / "parameters.json", "w") as file:
+            json.dump(params, file, indent=4)
+    return position_day.parent
@@ -0,0 +1,127 @@
+import json
+import os
+import time
+
+import pytest
+
+import Libs.batchqueue as batchqueue
+from Libs.batchqueue import BatchQueue
+
+
+@pytest.fixture
+def project(tmp_path):
+    # Day 1 with treatments A and B, one batch of one worm each
+    project_dir = tmp_path / "project"
+    for treatment in ("A - Control", "B - Drug"):
+        batch_dir = project_dir / "Day 1" / treatment / "Batch 1"
+        batch_dir.mkdir(parents=True)
+        (batch_dir / "Trial-Well 1-position.csv").write_text(",x,y\n0,1,2\n1,3,4\n")
+    return project_dir
+
+
+@pytest.fixture
+def queue(tmp_path, project, monkeypatch):
+    history = {"P1": {"DIRECTORY": str(project),
+                      "Day 1": {"Treatment A": ["Control", "", "", ""],
+                                "Treatment B": ["Drug", "1", "ppm", ""]}}}
+    monkeypatch.setattr(batchqueue, "load_history", lambda: history)
+    return BatchQueue(tmp_path / "queue.json", lock_timeout = 0.2)
+
+
+def test_add_does_not_queue_open_jobs_twice(queue):
+    added = queue.add_projects()
+    assert [(job["treatment"], job["name"]) for job in added] == [("A", "Control"), ("B", "Drug 1 ppm")]
+
+    assert queue.add_projects() == []
+    assert len(queue.jobs()) == 2
+
+
+def test_add_queues_finished_jobs_again(queue):
+    first = queue.add_projects(treatments = ["A"])[0]
+    queue.finish(first["id"], "completed")
+
+    again = queue.add_projects(treatments = ["A"])
+    assert len(again) == 1 and again[0]["id"] != first["id"]
+
+
+def test_cancel_only_touches_pending_jobs(queue):
+    queue.add_projects()
+    running = queue.claim_next()
+
+    cancelled = queue.cancel()
+
+    statuses = {job["id"]: job["status"] for job in queue.jobs()}
+    assert running["id"] not in cancelled
+    assert statuses[running["id"]] == "running"
+    assert all(statuses[job_id] == "cancelled" for job_id in cancelled)
+    assert queue.cancel() == []
+
+
+def test_priority_orders_claims(queue):
+    jobs = queue.add_projects()
+    queue.set_priority([jobs[-1]["id"]], 5)
+
+    assert queue.claim_next()["id"] == jobs[-1]["id"]
+
+
+def test_lock_timeout(queue):
+    queue.lock_path.touch()
+    with pytest.raises(TimeoutError):
+        queue.cancel()
+    queue.unlock()
+    assert queue.cancel() == []
+
+
+def test_stale_lock_is_broken(queue):
+    # Left by a queue process that died while holding it
+    queue.lock_path.write_text(json.dumps({"owner": "elsewhere:1", "host": "elsewhere", "pid": 1, "time": time.time() - 3600}))
+
+    assert queue.cancel() == []
+    assert not queue.lock_path.exists()
+
+
+def test_reset_only_jobs_of_dead_runners(queue):
+    queue.add_projects()
+
+    # A live runner of another process owns the claimed job
+    other = BatchQueue(queue.queue_path)
+    other.owner = "elsewhere:1"
+    def change(state):
+        state["runner"] = {"owner": other.owner, "host": "elsewhere", "pid": 1, "heartbeat": time.time()}
+    queue.update(change)
+    claimed = other.claim_next()
+
+    assert queue.reset_running() == []
+    with pytest.raises(RuntimeError):
+        queue.acquire_runner()
+
+    # Its heartbeat goes stale, the job is put back to pending and the queue can be taken over
+    def stale(state):
+        state["runner"]["heartbeat"] = time.time() - 3600
+    queue.update(stale)
+
+    assert queue.reset_running() == [claimed["id"]]
+    queue.acquire_runner()
+    assert queue.load()["runner"]["pid"] == os.getpid()
+
+
+def test_run_skips_analyzed_jobs_without_writing(queue, monkeypatch):
+    class AnalyzedExporter():
+        closed = []
+
+        def __init__(self, project_dir, day_num, export_format):
+            self.output_path = None
+
+        def exists(self, sheet_name):
+            return True
+
+        def close(self):
+            self.closed.append(self)
+
+    monkeypatch.setattr(batchqueue, "get_exporter", AnalyzedExporter)
+    queue.add_projects()
+
+    finished = queue.run(workers = 1, results_store = None)
+
+    assert [job["status"] for job in finished] == ["existed", "existed"]
+    assert AnalyzedExporter.closed == []
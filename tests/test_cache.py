@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+import pytest
+
+from Libs.cache import SidecarCache, TrajectoryCache
+from Libs.loader import read_trajectory
+
+
+@pytest.fixture
+def csv_paths(position_day):
+    return sorted(position_day.glob("*/Batch */*-position.csv"))
+
+
+def test_sidecar_round_trip(tmp_path, csv_paths):
+    cache = SidecarCache(tmp_path / "cache")
+    for csv_path in csv_paths:
+        cache.read(csv_path)
+    cache.flush()
+
+    # A new run reads the memory-mapped copies back
+    cache = SidecarCache(tmp_path / "cache")
+    for csv_path in csv_paths:
+        coords, frames, axes = cache.read(csv_path)
+        expected_coords, expected_frames, expected_axes = read_trajectory(csv_path)
+        assert isinstance(coords, np.memmap)
+        assert np.array_equal(coords, expected_coords)
+        assert np.array_equal(frames, expected_frames)
+        assert axes == expected_axes
+
+    assert (cache.hits, cache.misses) == (len(csv_paths), 0)
+
+
+def test_sidecar_invalidation(tmp_path, csv_paths):
+    cache = SidecarCache(tmp_path / "cache")
+    cache.read(csv_paths[0])
+    cache.read(csv_paths[1])
+    cache.flush()
+
+    # Touched with the same content: still valid. Appended: parsed again
+    stat = os.stat(csv_paths[0])
+    os.utime(csv_paths[0], ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    with open(csv_paths[1], "a") as file:
+        file.write("300,1.0,2.0\n")
+
+    cache = SidecarCache(tmp_path / "cache")
+    cache.read(csv_paths[0])
+    coords, _, _ = cache.read(csv_paths[1])
+
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(coords) == 301
+
+
+def test_sidecar_budget(tmp_path, csv_paths):
+    cache = SidecarCache(tmp_path / "cache")
+    cache.read(csv_paths[0])
+    entry_bytes = cache.total_bytes()
+
+    cache = SidecarCache(tmp_path / "cache", budget = 2 * entry_bytes)
+    for csv_path in csv_paths[:4]:
+        cache.read(csv_path)
+    cache.flush()
+
+    assert cache.total_bytes() <= 2 * entry_bytes
+    assert len(cache.index) == 2
+    assert len(list((tmp_path / "cache").glob("*.npy"))) == 4
+    assert list((tmp_path / "cache").glob("*.tmp")) == []
+
+
+def test_sidecar_runs_keep_each_other_entries(tmp_path, csv_paths):
+    # Two runs on the same project, each flushing what it parsed
+    first = SidecarCache(tmp_path / "cache")
+    second = SidecarCache(tmp_path / "cache")
+    for csv_path in csv_paths[:3]:
+        first.read(csv_path)
+    for csv_path in csv_paths[3:6]:
+        second.read(csv_path)
+    first.flush()
+    second.flush()
+
+    cache = SidecarCache(tmp_path / "cache")
+    for csv_path in csv_paths[:6]:
+        cache.read(csv_path)
+    assert (cache.hits, cache.misses) == (6, 0)
+    assert not (tmp_path / "cache" / SidecarCache.LOCK_NAME).exists()
+
+
+def test_sidecar_sweeps_orphans(tmp_path, csv_paths):
+    cache = SidecarCache(tmp_path / "cache")
+    cache.read(csv_paths[0])
+    cache.flush()
+    orphan = tmp_path / "cache" / "0123456789abcdef.npy"
+    np.save(orphan, np.zeros(3))
+    recent = tmp_path / "cache" / "fedcba9876543210.npy"
+    np.save(recent, np.zeros(3))
+    os.utime(orphan, (0, 0))
+
+    cache.read(csv_paths[1])
+    cache.flush()
+
+    assert not orphan.exists()
+    assert recent.exists()
+    assert len(list((tmp_path / "cache").glob("*.npy"))) == 5
+
+
+def test_trajectory_cache_parses_a_batch_once(position_day):
+    group_path = position_day / "A - Control" / "Batch 1"
+    parsed = []
+
+    def group_reader(path):
+        parsed.append(path)
+        return {"1": read_trajectory(path / "Trial-Well 1-position.csv")}
+
+    cache = TrajectoryCache()
+    first = cache.get_group(group_path, group_reader)
+    second = cache.get_group(group_path, group_reader)
+    cache.evict(group_path)
+    cache.get_group(group_path, group_reader)
+
+    assert first is second
+    assert len(parsed) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
@@ -0,0 +1,352 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Libs import ALLOWED_DECIMALS
+from Libs.calculation import step_lengths, center_points, center_distances
+from Libs.calculation import fd_thresholds, log_correlation, turning_entropy
+from Libs.calculation import loglog_fit, FD_Entropy_Calculator, FD_Entropy_Calculator_2D, FD_Entropy_Calculator_3D
+from Libs.calculation import correct_speed_spikes, calculate_turning_angle, angular_velocity_bins, turning_angles_array
+from Libs.calculation import profile_intervals
+
+CONVERSION_RATE = 37.5
+CENTER = {"1": {"X": 252, "Y": 209}, "2": {"X": 240, "Y": 265}}
+THIGMOTAXIS_RANGE = 1.2
+
+
+@pytest.fixture
+def trajectory():
+    # Random walk in pixels with a few tracking jumps, as in a position csv
+    rng = np.random.default_rng(7)
+    steps = rng.normal(0, 3, size = (600, 2))
+    steps[rng.choice(600, size = 8, replace = False)] *= 40
+    return pd.DataFrame(250 + np.cumsum(steps, axis = 0), columns = ["X", "Y"])
+
+
+def test_step_lengths_match_scalar_loop(trajectory):
+    # Loader.distance_traveled before vectorization
+    expected = []
+    for i in range(len(trajectory) - 1):
+        distance = 0
+        for axis in trajectory.columns:
+            distance += (trajectory[axis].iloc[i+1] - trajectory[axis].iloc[i])**2
+        distance = math.sqrt(distance)
+        distance = distance / CONVERSION_RATE
+        expected.append(round(distance, ALLOWED_DECIMALS))
+
+    steps = step_lengths(trajectory.to_numpy(), conversion_rate = CONVERSION_RATE, decimals = ALLOWED_DECIMALS)
+
+    assert steps.tolist() == expected
+
+
+def scalar_center_distances(trajectory, target_params):
+    # Loader.distance_to and Loader.within_range before vectorization
+    distance_list = []
+    for _, row in trajectory.iterrows():
+        distance = 0
+        for axis, param_coord in target_params.items():
+            distance += (row[axis] - param_coord) ** 2
+        distance = np.sqrt(distance)
+        distance = distance / CONVERSION_RATE
+        distance_list.append(round(distance, ALLOWED_DECIMALS))
+    return distance_list, [1 if distance <= THIGMOTAXIS_RANGE else 0 for distance in distance_list]
+
+
+def test_center_distances_match_iterrows(trajectory):
+    expected_distances, expected_mask = scalar_center_distances(trajectory, CENTER["1"])
+
+    _, center = center_points(CENTER["1"])
+    distances, in_center = center_distances(trajectory.to_numpy(), center,
+                                            conversion_rate = CONVERSION_RATE,
+                                            center_range = THIGMOTAXIS_RANGE,
+                                            decimals = ALLOWED_DECIMALS)
+
+    assert distances.tolist() == expected_distances
+    assert in_center.astype(int).tolist() == expected_mask
+    assert 0 < sum(expected_mask) < len(expected_mask)
+
+
+def test_center_distances_of_a_stack(trajectory):
+    # Each worm of a stack is measured against its own center
+    axes, centers = center_points(CENTER, worm_nums = ["1", "2"])
+    stack = np.stack([trajectory[axes].to_numpy(), trajectory[axes].to_numpy()[::-1]])
+    distances, in_center = center_distances(stack, centers,
+                                            conversion_rate = CONVERSION_RATE,
+                                            center_range = THIGMOTAXIS_RANGE,
+                                            decimals = ALLOWED_DECIMALS)
+
+    for row, (worm_num, worm) in enumerate(zip(["1", "2"], [trajectory, trajectory[::-1].reset_index(drop = True)])):
+        expected_distances, expected_mask = scalar_center_distances(worm, CENTER[worm_num])
+        assert distances[row].tolist() == expected_distances
+        assert in_center[row].astype(int).tolist() == expected_mask
+
+
+def baseline_fd_table(input_df):
+    # Fractal dimension table and turning angles of FD_Entropy_Calculator_2D/3D before the rewrite
+    EPSILON = 1e-10
+    coords = [input_df[axis] for axis in input_df.columns]
+    FRAMES = len(input_df)
+
+    deltas = {}
+    delta_r = {}
+    thetas = {}
+    for i in range(1, FRAMES):
+        deltas[i] = [coord[i] - coord[i-1] for coord in coords]
+        delta_r[i] = math.sqrt(sum(delta**2 for delta in deltas[i]))
+        if i > 1:
+            dot_product = sum(a*b for a, b in zip(deltas[i], deltas[i-1]))
+            value = dot_product / (delta_r[i]*delta_r[i-1] + EPSILON)
+            value = max(-1, min(1, value))
+            thetas[i] = math.acos(value)*180/math.pi
+
+    thresholds = [(i+1)/10 for i in range(FRAMES)]
+    index_1 = thresholds.index(1)
+    thresholds = thresholds[:index_1] + [1.01] + thresholds[(index_1+1):]
+
+    logr = {}
+    logCr = {}
+    for i in range(FRAMES):
+        Cr = len([r for r in delta_r.values() if r < thresholds[i]]) / (FRAMES - 1)
+        if Cr == 0:
+            Cr = 10e-10
+        logCr[i] = math.log10(Cr)
+        logr[i] = math.log10(thresholds[i])
+
+    neg_close = -math.inf
+    neg_close_pos = -1
+    for i, value in enumerate(logr.values()):
+        if value < 0 and value > neg_close:
+            neg_close = value
+            neg_close_pos = i
+
+    table_index = list(range(5, -6, -1))
+    rows = [num + neg_close_pos for num in table_index]
+
+    return [thresholds[row] for row in rows], [logr[row] for row in rows], [logCr[row] for row in rows], list(thetas.values())
+
+
+def baseline_entropy(thetas):
+    G_array = np.array(thetas)
+    G_count = (G_array >= 90).sum()
+    G_count2 = (G_array < 90).sum()
+    G_len = G_array.size
+    return (-1) * G_count/G_len * np.log2(G_count/G_len) - G_count2/G_len * np.log2(G_count2/G_len)
+
+
+def test_log_correlation_matches_countif(trajectory):
+    expected_thresholds, expected_logr, expected_logCr, _ = baseline_fd_table(trajectory)
+
+    coords = trajectory.to_numpy()
+    delta_r = np.sqrt(np.sum(np.diff(coords, axis = 0)**2, axis = 1))
+    logr, logCr = log_correlation(delta_r, len(coords))
+
+    assert fd_thresholds(len(coords)) == expected_thresholds
+    assert logr == expected_logr
+    assert logCr == expected_logCr
+
+
+def test_turning_entropy_matches_acos(trajectory):
+    *_, thetas = baseline_fd_table(trajectory)
+
+    coords = trajectory.to_numpy()
+    deltas = np.diff(coords, axis = 0)
+    delta_r = np.sqrt(deltas[:, 0]**2 + deltas[:, 1]**2)
+
+    assert turning_entropy(deltas, delta_r) == baseline_entropy(thetas)
+
+
+def test_fd_thresholds_need_14_frames():
+    with pytest.raises(ValueError):
+        fd_thresholds(13)
+
+
+def baseline_loglog_fit(logr, logCr):
+    # Spreadsheet regression of FD_Entropy_Calculator_2D before the closed form
+    FD_df = pd.DataFrame(columns=['number', 'logr', 'logCr', 'x-xbar', 'y-ybar',
+                                  '(x-xbar)(y-ybar)', '(x-xbar)2', '(y-ybar)2', '[yi-(a+bxi)]2'])
+    FD_df['number'] = list(range(5, -6, -1))
+    LEN = len(FD_df)
+    for row in range(LEN):
+        FD_df.iloc[row, 1] = logr[row]
+        FD_df.iloc[row, 2] = logCr[row]
+
+    col1 = np.array(FD_df['logr'])
+    col2 = np.array(FD_df['logCr'])
+    col1_avg = np.average(col1)
+    col2_avg = np.average(col2)
+    for row in range(LEN):
+        FD_df.iloc[row, 3] = FD_df.iloc[row, 1] - col1_avg
+        FD_df.iloc[row, 4] = FD_df.iloc[row, 2] - col2_avg
+        FD_df.iloc[row, 5] = FD_df.iloc[row, 3] * FD_df.iloc[row, 4]
+        FD_df.iloc[row, 6] = FD_df.iloc[row, 3]**2
+        FD_df.iloc[row, 7] = FD_df.iloc[row, 4]**2
+
+    variable_b = np.sum(np.array(list(FD_df['(x-xbar)(y-ybar)']))) / np.sum(np.array(list(FD_df['(x-xbar)2'])))
+    variable_a = col2_avg - col1_avg * variable_b
+    for row in range(LEN):
+        FD_df.iloc[row, 8] = (FD_df.iloc[row, 2] - (variable_a + variable_b * FD_df.iloc[row, 1]))**2
+
+    variable_s = np.sqrt(np.sum(np.array(list(FD_df['[yi-(a+bxi)]2']))) / (LEN - 2))
+    sum_xx = np.sum(np.array(list(FD_df['(x-xbar)2'])))
+    return variable_b, {"a": variable_a,
+                        "s": variable_s,
+                        "bErr": variable_s / np.sqrt(sum_xx),
+                        "aErr": variable_s * np.sqrt((1 / LEN) + col1_avg**2 / sum_xx),
+                        "RR": np.sum(np.array(list(FD_df['(x-xbar)(y-ybar)'])))**2 / (sum_xx * np.sum(np.array(list(FD_df['(y-ybar)2']))))}
+
+
+def test_loglog_fit_is_bit_identical(trajectory):
+    _, logr, logCr, _ = baseline_fd_table(trajectory)
+    expected_b, expected_stats = baseline_loglog_fit(logr, logCr)
+
+    slope, stats = loglog_fit([logr], [logCr], fit_stats = True)
+
+    assert slope[0] == expected_b
+    for name, value in expected_stats.items():
+        assert stats[name][0] == value, name
+
+
+@pytest.mark.parametrize("axes", [["X", "Y"], ["X", "Y", "Z"]])
+def test_fd_entropy_matches_baseline(trajectory, axes):
+    worm = trajectory.copy()
+    worm["Z"] = np.cumsum(np.random.default_rng(3).normal(0, 2, size = len(worm)))
+    worm = worm[axes]
+
+    _, logr, logCr, thetas = baseline_fd_table(worm)
+    calculator = FD_Entropy_Calculator_2D if len(axes) == 2 else FD_Entropy_Calculator_3D
+
+    assert calculator(worm) == (baseline_loglog_fit(logr, logCr)[0], baseline_entropy(thetas))
+
+
+def test_fd_entropy_of_a_batch(trajectory):
+    # Trajectories of different lengths in one call give the values of separate calls
+    worms = [trajectory.to_numpy(), trajectory.to_numpy()[:250], trajectory.to_numpy()[100:]]
+
+    fractal_dimensions, entropies = FD_Entropy_Calculator(worms)
+
+    for worm, fractal_dimension, entropy in zip(worms, fractal_dimensions, entropies):
+        assert (fractal_dimension, entropy) == FD_Entropy_Calculator(worm)
+
+
+SPIKE_THRESHOLD = 6 * 100 / 3600 * 10 # SPEED_THRESHOLD * FAST_FORWARD_FACTOR, cm/s
+
+
+@pytest.fixture
+def speeds():
+    # cm/s, spikes are kept out of the first two frames, which the old backward search never reached
+    speeds = np.random.default_rng(11).uniform(0.1, 1.6, size = 600)
+    speeds[[40, 41, 42, 300, 301, 599]] = 20
+    return speeds
+
+
+def test_previous_policy_matches_backward_search(speeds):
+    # BasicCalculation before the linear-time correction
+    expected = []
+    replace_count = 0
+    for i in range(len(speeds)):
+        speed = speeds[i]
+        if speed >= SPIKE_THRESHOLD:
+            for j in range(i-1, 0, -1):
+                if expected[j] < SPIKE_THRESHOLD:
+                    speed = expected[j]
+                    replace_count += 1
+                    break
+        expected.append(speed)
+
+    corrected, replaced = correct_speed_spikes(speeds, SPIKE_THRESHOLD, policy = "previous")
+
+    assert replace_count > 4
+    assert (corrected.tolist(), replaced) == (expected, replace_count)
+
+
+def test_interpolate_policy(speeds):
+    corrected, replaced = correct_speed_spikes(speeds, SPIKE_THRESHOLD, policy = "interpolate")
+
+    valid = np.flatnonzero(speeds < SPIKE_THRESHOLD)
+    spikes = np.flatnonzero(speeds >= SPIKE_THRESHOLD)
+    assert replaced == len(spikes)
+    assert corrected[spikes].tolist() == np.interp(spikes, valid, speeds[valid]).tolist()
+    assert corrected[valid].tolist() == speeds[valid].tolist()
+    # Between the valid frames 39 and 43
+    assert corrected[41] == pytest.approx((speeds[39] + speeds[43]) / 2)
+
+
+def test_median_policy(speeds):
+    window = 5
+    corrected, replaced = correct_speed_spikes(speeds, SPIKE_THRESHOLD, policy = "median", window = window)
+
+    spikes = np.flatnonzero(speeds >= SPIKE_THRESHOLD)
+    assert replaced == len(spikes)
+    for i in spikes:
+        around = speeds[max(0, i - window//2):i + window//2 + 1]
+        assert corrected[i] == np.median(around[around < SPIKE_THRESHOLD])
+
+
+def test_unknown_spike_policy(speeds):
+    with pytest.raises(ValueError):
+        correct_speed_spikes(speeds, SPIKE_THRESHOLD, policy = "zero")
+
+
+def scalar_turning_angles(trajectory, interval = 1):
+    # TurningAngles.turning_angles before the array version
+    X_coords = trajectory["X"].tolist()[::interval]
+    Y_coords = trajectory["Y"].tolist()[::interval]
+    return [calculate_turning_angle(X_coords[i], Y_coords[i], X_coords[i+1], Y_coords[i+1], X_coords[i+2], Y_coords[i+2])
+            for i in range(len(X_coords) - 2)]
+
+
+@pytest.mark.parametrize("frame_rate, interval", [(50, 1), (50, 2), (30, 1), (25, 5)])
+def test_angular_velocity_bins_match_chunk_calc(trajectory, frame_rate, interval):
+    turning_angles = scalar_turning_angles(trajectory, interval)
+    chunk_size = int(frame_rate/interval)
+    # Angle.calculate_velocity before vectorization, the last chunk may be shorter
+    expected = [abs(sum(turning_angles[i:i+chunk_size]))%180 for i in range(0, len(turning_angles), chunk_size)]
+
+    velocities = angular_velocity_bins(turning_angles, chunk_size)
+
+    assert len(turning_angles) % chunk_size != 0
+    assert velocities.tolist() == expected
+
+
+def test_angular_velocity_bins_drop_ragged_chunk(trajectory):
+    turning_angles = scalar_turning_angles(trajectory)
+
+    kept = angular_velocity_bins(turning_angles, 50, ragged = "keep")
+    dropped = angular_velocity_bins(turning_angles, 50, ragged = "drop")
+
+    assert len(dropped) == len(turning_angles) // 50
+    assert dropped.tolist() == kept[:-1].tolist()
+
+
+@pytest.mark.parametrize("frame_rate, expected", [(30, [1, 5, 10, 15, 30]), (25, [1, 5]), (24, [1])])
+def test_profile_intervals(frame_rate, expected):
+    assert profile_intervals([1, 5, 10, 15, 30, 5], frame_rate) == expected
+
+
+@pytest.mark.parametrize("interval", [1, 3])
+def test_turning_angles_match_scalar(trajectory, interval):
+    worm = trajectory.copy()
+    worm.iloc[50:53] = worm.iloc[50].to_numpy() # zero-length steps
+    worm.iloc[80:83] = np.nan # lost tracking
+
+    expected = np.array(scalar_turning_angles(worm, interval))
+    turning_angles = turning_angles_array(worm.to_numpy(), interval = interval)
+
+    assert turning_angles == pytest.approx(expected, rel = 1e-13, abs = 1e-12)
+    assert np.array_equal(np.signbit(turning_angles), np.signbit(expected))
+
+
+def test_back_and_forth_track():
+    # Exact reversals keep the arccos magnitude of the scalar version, 179.9999988 and not 180,
+    # so their per-second sums stay fast instead of folding to 0 under the modulo 180
+    track = pd.DataFrame([[101.209, 283.476], [161.873, 97.714]] * 46, columns = ["X", "Y"])
+
+    expected = scalar_turning_angles(track)
+    turning_angles = turning_angles_array(track.to_numpy())
+
+    assert turning_angles.tolist() == expected
+    assert 179.99 < turning_angles[0] < 180
+    assert angular_velocity_bins(turning_angles, 30).tolist() == [abs(sum(expected[i:i+30]))%180 for i in range(0, 90, 30)]
+    assert all(velocity > 90 for velocity in angular_velocity_bins(turning_angles, 30))
@@ -0,0 +1,73 @@
+import pytest
+
+from Libs.analyzer import GeneralAnalysis
+from Libs.executor import EndPoints_Adder, Executor
+from Libs.export import MemoryExporter
+from Libs.general import Parameters
+
+
+# EndPoints of position_project computed by the list-based containers before they were moved to
+# NumPy arrays, NumPy sums in another order so these pin the rounded values to the old ones
+BASELINE_ENDPOINTS = {
+    ("A", 1, 1, 1): {"Total Distance": 5.8727,
+                     "Average Speed": 0.455,
+                     "Total Absolute Turn Angle": 27241.9544,
+                     "Average Angular Velocity": 78.1808,
+                     "Slow Angular Velocity Percentage": 60.0,
+                     "Fast Angular Velocity Percentage": 40.0,
+                     "Meandering": 463874.44276057003,
+                     "Freezing Time": 0.3333,
+                     "Moving Time": 99.3333,
+                     "Average distance to Center of the Tank": 0.233,
+                     "Time spent in Center": 14.333333333333334,
+                     "Total entries to the Center": 5,
+                     "Fractal Dimension": 2.102155628537435,
+                     "Entropy": 0.9994800708509495},
+    ("B", 2, 3, 5): {"Total Distance": 6.076,
+                     "Average Speed": 0.4767,
+                     "Total Absolute Turn Angle": 5064.8959,
+                     "Average Angular Velocity": 109.0609,
+                     "Slow Angular Velocity Percentage": 30.0,
+                     "Fast Angular Velocity Percentage": 70.0,
+                     "Meandering": 83359.05036208032,
+                     "Freezing Time": 1.3333,
+                     "Moving Time": 98.3333,
+                     "Average distance to Center of the Tank": 0.1025,
+                     "Time spent in Center": 52.33333333333333,
+                     "Total entries to the Center": 10,
+                     "Fractal Dimension": 1.8376451869757282,
+                     "Entropy": 0.9984073220991563},
+}
+
+
+@pytest.mark.parametrize("treatment_char, group_num, worm_num, interval", sorted(BASELINE_ENDPOINTS))
+def test_endpoints_match_baseline(position_project, treatment_char, group_num, worm_num, interval):
+    params = Parameters(project_dir = position_project, day_num = 1, treatment_char = treatment_char)
+    analysis = GeneralAnalysis(position_project, 1, treatment_char, group_num, worm_num, params)
+    analysis.BasicCalculation(DEFAULT_INTERVAL = interval)
+
+    endpoints = {name: endpoint["value"] for name, endpoint in EndPoints_Adder(analysis).items()}
+
+    assert endpoints == pytest.approx(BASELINE_ENDPOINTS[(treatment_char, group_num, worm_num, interval)], rel = 1e-12)
+
+
+def test_parallel_progress_per_worm(position_project):
+    class Progress():
+        def __init__(self):
+            self.updates = []
+
+        def task_update(self, value, text):
+            self.updates.append((value, text))
+
+    progress = Progress()
+    executor = Executor(project_dir = position_project, day_num = 1, treatment_char = "A", treatment_name = "Control",
+                        progress_window = progress, writer = MemoryExporter(), results_store = None, manifest = False, workers = 2)
+    executor.PARAMS_LOADING()
+    executor.GROUP_LOADING()
+    executor.ENDPOINTS_ANALYSIS(OVERWRITE = True)
+
+    # One update per worm, whichever batch finishes first
+    assert [value for value, _ in progress.updates][-6:] == pytest.approx([100 * i / 6 for i in range(1, 7)])
+    assert sorted(text for _, text in progress.updates[-6:]) == [f"Analyze Group {group_num} - Well {worm_num}"
+                                                                  for group_num in (1, 2) for worm_num in (1, 2, 3)]
+    assert len(executor.EndPoints) == 6
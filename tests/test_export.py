@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+
+from Libs.export import EndpointsExporter, DayExcelWriter, CSVExporter, MemoryExporter, EXPORTERS, get_exporter
+from Libs.misc import list_sheet_names
+
+
+def endpoints_frame(scale = 1.0):
+    # Executor.endpoints_frame layout: one row per worm, one "Endpoint (unit)" column per endpoint
+    return pd.DataFrame({"Total Distance (cm)": [1.5 * scale, 2.25 * scale],
+                         "Time spent in Center (%)": [10.0, 32.5]},
+                        index = ["Batch 1 - Worm 1", "Batch 1 - Worm 2"])
+
+
+def test_excel_round_trip(tmp_path):
+    excel_path = tmp_path / "EndPoints.xlsx"
+    writer = DayExcelWriter(excel_path)
+    writer.add("A - Control", endpoints_frame())
+    writer.add("B - Eu 0.5 ppm", endpoints_frame(2))
+    assert writer.close() == excel_path
+
+    # A second run of the day replaces one sheet and drops the other
+    writer = DayExcelWriter(excel_path)
+    assert writer.exists("A - Control") and writer.exists("B - Eu 0.5 ppm")
+    writer.remove("B - Eu 0.5 ppm")
+    writer.add("A - Control", endpoints_frame(3))
+    writer.add("C - Eu 1 ppm", endpoints_frame(4))
+    writer.close()
+
+    assert list_sheet_names(excel_path) == ["A - Control", "C - Eu 1 ppm"]
+    pd.testing.assert_frame_equal(pd.read_excel(excel_path, sheet_name = "A - Control", index_col = 0), endpoints_frame(3),
+                                  check_names = False)
+    assert list(tmp_path.iterdir()) == [excel_path]
+
+
+def test_excel_writer_without_tables(tmp_path):
+    assert DayExcelWriter(tmp_path / "EndPoints.xlsx").close() is None
+    assert not (tmp_path / "EndPoints.xlsx").exists()
+
+
+def test_csv_round_trip(tmp_path):
+    writer = CSVExporter(tmp_path / "EndPoints")
+    writer.add("A - Control", endpoints_frame())
+    writer.add("B - Eu 0.5 ppm / 2", endpoints_frame(2))
+    assert writer.close() == tmp_path / "EndPoints"
+
+    assert sorted(path.name for path in (tmp_path / "EndPoints").iterdir()) == ["A - Control.csv", "B - Eu 0.5 ppm _ 2.csv"]
+    table = pd.read_csv(tmp_path / "EndPoints" / "A - Control.csv", index_col = "Worm")
+    pd.testing.assert_frame_equal(table, endpoints_frame(), check_names = False)
+
+    writer = CSVExporter(tmp_path / "EndPoints")
+    assert writer.exists("B - Eu 0.5 ppm / 2")
+    writer.remove("B - Eu 0.5 ppm / 2")
+    writer.close()
+    assert [path.name for path in (tmp_path / "EndPoints").iterdir()] == ["A - Control.csv"]
+
+
+@pytest.mark.parametrize("export_format, suffix", [("parquet", ".parquet"), ("feather", ".feather")])
+def test_arrow_round_trip(tmp_path, export_format, suffix):
+    pytest.importorskip("pyarrow")
+    writer = EXPORTERS[export_format](tmp_path / "EndPoints")
+    writer.add("A - Control", endpoints_frame())
+    writer.close()
+
+    table = getattr(pd, f"read_{export_format}")(tmp_path / "EndPoints" / f"A - Control{suffix}").set_index("Worm")
+    pd.testing.assert_frame_equal(table, endpoints_frame(), check_names = False)
+
+
+def test_memory_exporter():
+    exporter = MemoryExporter()
+    exporter.add("A - Control", endpoints_frame())
+    assert exporter.exists("A - Control")
+    exporter.remove("A - Control")
+    assert not exporter.exists("A - Control")
+    assert exporter.close() is None
+
+
+def test_exporter_interface():
+    with pytest.raises(TypeError):
+        EndpointsExporter()
+    with pytest.raises(ValueError):
+        get_exporter("project", 1, export_format = "xls")
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Libs.loader import read_trajectory, iter_trajectory, trajectory_axes
+
+
+@pytest.fixture
+def positions():
+    rng = np.random.default_rng(2)
+    return pd.DataFrame({"X": rng.uniform(0, 640, 500).round(3),
+                         "Y": rng.uniform(0, 480, 500).round(3),
+                         "Z": rng.uniform(0, 100, 500).round(3)})
+
+
+def old_worm_loader(csv_path):
+    # Loader.WormLoader before the typed reader
+    df = pd.read_csv(csv_path, header=0, index_col=0)
+    if len(df.columns) == 2:
+        df.columns = ["X", "Y"]
+    elif len(df.columns) == 3:
+        df.columns = ["X", "Y", "Z"]
+    return df
+
+
+@pytest.mark.parametrize("axes", [["X", "Y"], ["X", "Y", "Z"]])
+def test_read_trajectory_matches_read_csv(tmp_path, positions, axes):
+    csv_path = tmp_path / "Trial-Well 1-position.csv"
+    positions[axes].rename(columns = str.lower).to_csv(csv_path)
+
+    coords, frames, read_axes = read_trajectory(csv_path)
+    expected = old_worm_loader(csv_path)
+
+    assert read_axes == axes
+    assert np.array_equal(coords, expected.to_numpy())
+    assert np.array_equal(frames, expected.index.to_numpy())
+    assert coords.flags["C_CONTIGUOUS"]
+
+
+def test_read_trajectory_ignores_extra_columns(tmp_path, positions):
+    # Named coordinates are found in any order among other tracker columns
+    csv_path = tmp_path / "Trial-Well 1-position.csv"
+    extended = pd.DataFrame({"likelihood": 0.9, "y": positions["Y"], "area": 12, "x": positions["X"]})
+    extended.to_csv(csv_path)
+
+    coords, _, axes = read_trajectory(csv_path)
+
+    assert axes == ["X", "Y"]
+    assert np.array_equal(coords, positions[["X", "Y"]].to_numpy())
+
+
+def test_read_trajectory_unnamed_extra_columns(tmp_path, positions):
+    # Without coordinate names, the first two columns after the frame index are X and Y
+    csv_path = tmp_path / "Trial-Well 1-position.csv"
+    unnamed = positions.copy()
+    unnamed["area"] = 12
+    unnamed.columns = ["a", "b", "c", "d"]
+    unnamed.to_csv(csv_path)
+
+    coords, _, axes = read_trajectory(csv_path)
+
+    assert axes == ["X", "Y"]
+    assert np.array_equal(coords, positions[["X", "Y"]].to_numpy())
+    assert trajectory_axes(csv_path) == ["X", "Y"]
+
+
+def test_read_trajectory_float32(tmp_path, positions):
+    csv_path = tmp_path / "Trial-Well 1-position.csv"
+    positions[["X", "Y"]].to_csv(csv_path)
+
+    coords, _, _ = read_trajectory(csv_path, dtype = np.float32)
+
+    assert coords.dtype == np.float32
+    assert np.array_equal(coords, positions[["X", "Y"]].to_numpy(dtype = np.float32))
+
+
+def test_iter_trajectory_chunks(tmp_path, positions):
+    csv_path = tmp_path / "Trial-Well 1-position.csv"
+    pd.DataFrame({"y": positions["Y"], "x": positions["X"], "speed": 1.0}).to_csv(csv_path)
+
+    chunks = list(iter_trajectory(csv_path, chunk_frames = 64))
+
+    assert all(axes == ["X", "Y"] for _, axes in chunks)
+    assert np.array_equal(np.concatenate([coords for coords, _ in chunks]), read_trajectory(csv_path)[0])
@@ -0,0 +1,72 @@
+import pytest
+
+from Libs.manifest import RunManifest, options_digest
+
+ENDPOINTS = {"Total Distance": {"value": 1.5, "unit": "cm"}}
+
+
+@pytest.fixture
+def day_dir(tmp_path):
+    batch_dir = tmp_path / "Day 1" / "A - Control" / "Batch 1"
+    batch_dir.mkdir(parents=True)
+    for worm_num in (1, 2):
+        (batch_dir / f"Trial-Well {worm_num}-position.csv").write_text(f",x,y\n0,{worm_num},2\n1,3,4\n")
+    return tmp_path / "Day 1"
+
+
+def csv_of(day_dir, worm_num):
+    return day_dir / "A - Control" / "Batch 1" / f"Trial-Well {worm_num}-position.csv"
+
+
+def record_run(day_dir, worm_nums = (1, 2), params_hash = "params", options_hash = None):
+    # One analysis: every worm missing from the manifest is recorded, then the manifest is saved
+    options_hash = options_hash or options_digest(30, None)
+    manifest = RunManifest(day_dir, "A")
+    for worm_num in worm_nums:
+        inputs = manifest.inputs(1, worm_num, csv_of(day_dir, worm_num), params_hash, options_hash)
+        if manifest.lookup(1, worm_num, inputs) is None:
+            manifest.record(1, worm_num, inputs, ENDPOINTS)
+    manifest.save()
+    return manifest
+
+
+def test_unchanged_inputs_hit(day_dir):
+    record_run(day_dir)
+    manifest = record_run(day_dir)
+    assert (manifest.hits, manifest.misses) == (2, 0)
+
+
+def test_csv_change_misses(day_dir):
+    record_run(day_dir)
+    with open(csv_of(day_dir, 2), "a") as file:
+        file.write("2,5,6\n")
+
+    manifest = record_run(day_dir)
+    assert (manifest.hits, manifest.misses) == (1, 1)
+
+
+def test_parameters_change_misses(day_dir):
+    record_run(day_dir)
+    manifest = record_run(day_dir, params_hash = "other params")
+    assert (manifest.hits, manifest.misses) == (0, 2)
+
+
+@pytest.mark.parametrize("options", [(15, None, False), (30, [1, 5], False), (30, None, True)])
+def test_options_change_misses(day_dir, options):
+    record_run(day_dir)
+    manifest = record_run(day_dir, options_hash = options_digest(*options))
+    assert (manifest.hits, manifest.misses) == (0, 2)
+
+
+def test_gone_worms_are_dropped_on_save(day_dir):
+    record_run(day_dir)
+    record_run(day_dir, worm_nums = (1,))
+
+    assert list(RunManifest(day_dir, "A").load()) == ["1/1"]
+
+
+def test_reused_endpoints_round_trip(day_dir):
+    record_run(day_dir)
+    manifest = RunManifest(day_dir, "A")
+    inputs = manifest.inputs(1, 1, csv_of(day_dir, 1), "params", options_digest(30, None))
+    assert manifest.lookup(1, 1, inputs) == ENDPOINTS
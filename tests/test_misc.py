@@ -0,0 +1,132 @@
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+from Libs.general import Events
+from Libs.misc import event_runs, event_extractor, copy_files, is_same_file, FileLock
+
+
+def scalar_event_extractor(binary_list, positive_token):
+    # misc.event_extractor before the run-length engine
+    binary_list = [1 if i == positive_token else 0 for i in binary_list]
+
+    result = {}
+    start, end = None, None
+    for i in range(len(binary_list)):
+        if binary_list[i] == 1:
+            if start is None:
+                start = i
+            end = i
+        elif start is not None:
+            result[(start, end)] = end - start + 1
+            start, end = None, None
+    if start is not None:
+        result[(start, end)] = end - start + 1
+
+    return result
+
+
+@pytest.fixture
+def in_center():
+    # Time in center of a worm, with runs touching both ends of the recording
+    mask = (np.random.default_rng(5).random(2000) < 0.3).astype(int)
+    mask[:3] = 1
+    mask[-4:] = 1
+    return mask
+
+
+def test_event_extractor_matches_scalar_loop(in_center):
+    assert event_extractor(in_center, positive_token = 1) == scalar_event_extractor(in_center.tolist(), 1)
+
+
+@pytest.mark.parametrize("events", [[], [0, 0, 0], [1, 1, 1], [0, 1, 0]])
+def test_event_extractor_edge_cases(events):
+    assert event_extractor(events, positive_token = 1) == scalar_event_extractor(events, 1)
+
+
+def test_event_runs_token():
+    tokens = ["L", "R", "R", "S", "R", "L", "L"]
+    starts, ends, lengths = event_runs(tokens, positive_token = "R")
+
+    assert (starts.tolist(), ends.tolist(), lengths.tolist()) == ([1, 4], [2, 4], [2, 1])
+    with pytest.raises(ValueError):
+        event_runs(tokens)
+
+
+def test_event_runs_merge_and_min_duration():
+    mask = [1, 1, 0, 1, 0, 0, 0, 1, 0, 1, 1, 1]
+
+    starts, ends, lengths = event_runs(mask, merge_gap = 1)
+    assert (starts.tolist(), ends.tolist(), lengths.tolist()) == ([0, 7], [3, 11], [4, 5])
+
+    starts, ends, lengths = event_runs(mask, min_duration = 2)
+    assert (starts.tolist(), ends.tolist(), lengths.tolist()) == ([0, 9], [1, 11], [2, 3])
+
+
+def test_events_from_runs_and_dict(in_center):
+    from_runs = Events(runs = event_runs(in_center, positive_token = 1), duration = 2000)
+    from_dict = Events(event_dict = scalar_event_extractor(in_center.tolist(), 1), duration = 2000)
+
+    assert (from_runs.count, from_runs.longest, from_runs.percentage) == (from_dict.count, from_dict.longest, from_dict.percentage)
+    assert from_runs.dict == from_dict.dict
+
+
+def test_copy_files_skips_unchanged(tmp_path):
+    source_dir, destination_dir = tmp_path / "raw", tmp_path / "project"
+    source_dir.mkdir()
+    destination_dir.mkdir()
+    copy_pairs = []
+    for worm_num in range(1, 7):
+        source = source_dir / f"Trial-Well {worm_num}-position.csv"
+        source.write_text(f",x,y\n0,{worm_num},2\n")
+        copy_pairs.append((source, destination_dir / source.name))
+
+    assert copy_files(copy_pairs, workers = 3)[:2] == (6, 0)
+    assert all(is_same_file(source, destination) for source, destination in copy_pairs)
+
+    # Re-run after an edit and a deleted copy: only those two are copied
+    copy_pairs[0][0].write_text(",x,y\n0,1,2\n1,3,4\n")
+    copy_pairs[1][1].unlink()
+    copied, skipped, total_bytes = copy_files(copy_pairs, workers = 3)
+
+    assert (copied, skipped) == (2, 4)
+    assert total_bytes == os.path.getsize(copy_pairs[0][1]) + os.path.getsize(copy_pairs[1][1])
+    assert copy_pairs[0][1].read_text() == copy_pairs[0][0].read_text()
+    assert list(destination_dir.glob("*.part")) == []
+
+
+def test_is_same_file_mtime_tolerance(tmp_path):
+    source, destination = tmp_path / "source.csv", tmp_path / "destination.csv"
+    source.write_text("0,1,2\n")
+    destination.write_text("0,1,2\n")
+    stat = os.stat(source)
+
+    os.utime(destination, (stat.st_atime, stat.st_mtime + 1))
+    assert is_same_file(source, destination)
+    os.utime(destination, (stat.st_atime, stat.st_mtime + 5))
+    assert not is_same_file(source, destination)
+
+
+def test_file_lock(tmp_path):
+    lock_path = tmp_path / "index.lock"
+    with FileLock(lock_path) as lock:
+        assert lock.read()["pid"] == os.getpid()
+        with pytest.raises(TimeoutError):
+            FileLock(lock_path, timeout = 0.2).acquire()
+    assert not lock_path.exists()
+
+
+@pytest.mark.parametrize("holder", [{"time": 0}, {"pid": 2**22 + 12345}])
+def test_file_lock_breaks_stale_locks(tmp_path, holder):
+    # Left by a process that died long ago, or by a process of this host that is gone
+    lock_path = tmp_path / "index.lock"
+    stale = FileLock(lock_path)
+    stale_holder = {"owner": stale.owner, "host": stale.owner.rsplit(":", 1)[0], "pid": os.getpid(), "time": time.time()}
+    lock_path.write_text(json.dumps(dict(stale_holder, **holder)))
+
+    with FileLock(lock_path, timeout = 0.2) as lock:
+        assert lock.read()["time"] > time.time() - 5
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,33 @@
+import sqlite3
+
+from Libs import results
+from Libs.results import ResultsStore, open_results_store
+
+
+def worm_endpoints(worm_nums, distance = 1.5):
+    return {(1, worm_num): {"Total Distance": {"value": distance * worm_num, "unit": "cm"},
+                            "Entropy": {"value": 0.9, "unit": ""}} for worm_num in worm_nums}
+
+
+def test_write_run_replaces_its_parameter_set(tmp_path):
+    store = ResultsStore(tmp_path / "results.sqlite")
+    store.write_run(tmp_path / "P", 1, "A", "A - Control", "params 1", worm_endpoints([1, 2, 3]))
+    store.write_run(tmp_path / "P", 1, "A", "A - Control", "params 2", worm_endpoints([1, 2, 3]))
+    # Worm 3 is gone from the new run of params 1
+    store.write_run(tmp_path / "P", 1, "A", "A - Control", "params 1", worm_endpoints([1, 2], distance = 2.0))
+
+    rows = store.query(project = "P", endpoint = "Total Distance")
+    store.close()
+
+    assert rows.groupby("params_hash")["well"].apply(list).to_dict() == {"params 1": [1, 2], "params 2": [1, 2, 3]}
+    assert rows[rows["params_hash"] == "params 1"]["value"].tolist() == [2.0, 4.0]
+
+
+def test_open_results_store_failure(monkeypatch, caplog):
+    def refuse(*args, **kwargs):
+        raise sqlite3.OperationalError("unable to open database file")
+    monkeypatch.setattr(results, "ResultsStore", refuse)
+
+    assert open_results_store(True) == (None, False)
+    assert "endpoints will not be stored" in caplog.text
+    assert open_results_store(None) == (None, False)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from Libs.loader import read_trajectory
+from Libs.store import DayStore
+
+
+def test_day_store_round_trip(position_day):
+    store = DayStore.build(position_day)
+
+    sources = DayStore.find_sources(position_day)
+    assert len(store.entries) == len(sources) == 12
+    for treatment_name, group_name, worm_num, csv_path in sources:
+        coords, frames, axes = store.trajectory(treatment_name, group_name, worm_num)
+        expected_coords, expected_frames, expected_axes = read_trajectory(csv_path)
+        assert np.array_equal(coords, expected_coords)
+        assert np.array_equal(frames, expected_frames)
+        assert axes == expected_axes
+
+
+def test_day_store_group(position_day):
+    store = DayStore.build(position_day)
+
+    group = store.group("B - Eu 0.5 ppm", "Batch 2")
+
+    assert sorted(group) == ["1", "2", "3"]
+    expected, _, _ = read_trajectory(position_day / "B - Eu 0.5 ppm" / "Batch 2" / "Trial-Well 3-position.csv")
+    assert np.array_equal(group["3"].to_numpy(), expected)
+    with pytest.raises(FileNotFoundError):
+        store.group("B - Eu 0.5 ppm", "Batch 3")
+
+
+def test_day_store_rebuilds_when_outdated(position_day):
+    DayStore.build(position_day)
+    assert DayStore.open(position_day, rebuild = False).is_current()
+
+    csv_path = position_day / "A - Control" / "Batch 1" / "Trial-Well 2-position.csv"
+    with open(csv_path, "a") as file:
+        file.write("300,1.0,2.0\n")
+
+    with pytest.raises(FileNotFoundError):
+        DayStore.open(position_day, rebuild = False)
+    coords, _, _ = DayStore.open(position_day).trajectory("A - Control", "Batch 1", "2")
+    assert len(coords) == 301
+
+
+def test_day_store_build_leaves_no_temp_files(position_day):
+    DayStore.build(position_day)
+    DayStore.open(position_day)
+
+    assert list(position_day.glob("*.tmp")) == list(position_day.glob(".*.tmp")) == []
+    assert list(position_day.glob("*.lock")) == []
+
+
+def test_scheduler_builds_the_day_store_once(position_project, monkeypatch):
+    from Libs import scheduler
+    from Libs.scheduler import ProjectScheduler
+
+    built = []
+    build = DayStore.build.__func__
+    monkeypatch.setattr(DayStore, "build", classmethod(lambda cls, day_dir: built.append(day_dir) or build(cls, day_dir)))
+    jobs = [(1, "A", "Control"), (1, "B", "Eu 0.5 ppm")]
+
+    def endpoints(day_store):
+        reports = ProjectScheduler(position_project, jobs, workers = 2, export_format = "csv", results_store = None,
+                                   OVERWRITE = True, day_store = day_store).run()
+        assert all(report["report"] == "Completed" for report in reports.values())
+        return {key: report["endpoints"] for key, report in reports.items()}
+
+    assert endpoints(day_store = True) == endpoints(day_store = False)
+    assert len(built) == 1
+    assert scheduler.prepare_day_store(position_project, 1)
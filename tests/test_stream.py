@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from Libs import AV_PROFILE_INTERVALS
+
+from Libs.analyzer import GeneralAnalysis
+from Libs.executor import EndPoints_Adder
+from Libs.general import Parameters
+from Libs.stream import StreamingAnalysis
+
+
+@pytest.mark.parametrize("interval", [1, 5])
+@pytest.mark.parametrize("chunk_frames", [7, 64, 100000])
+def test_streaming_matches_in_memory(position_project, interval, chunk_frames):
+    params = Parameters(project_dir = position_project, day_num = 1, treatment_char = "B")
+    for group_num, worm_num in ((1, 1), (2, 3)):
+        analysis = GeneralAnalysis(position_project, 1, "B", group_num, worm_num, params)
+        analysis.BasicCalculation(DEFAULT_INTERVAL = interval, AV_PROFILE = [1, 5, 10, 15, 30])
+        streaming = StreamingAnalysis(position_project, 1, "B", group_num, worm_num, params, chunk_frames = chunk_frames)
+        streaming.BasicCalculation(DEFAULT_INTERVAL = interval, AV_PROFILE = [1, 5, 10, 15, 30])
+
+        assert streaming.speed_replaced == analysis.speed_replaced
+        assert EndPoints_Adder(streaming) == EndPoints_Adder(analysis)
+
+
+def test_profile_at_25_fps(position_project):
+    # The default intervals that do not divide 25 fps are left out, the same way in both modes
+    param_path = position_project / "Day 1" / "static" / "A" / "parameters.json"
+    params = json.loads(param_path.read_text())
+    param_path.write_text(json.dumps(dict(params, **{"FRAME RATE": 25})))
+
+    params = Parameters(project_dir = position_project, day_num = 1, treatment_char = "A")
+    analysis = GeneralAnalysis(position_project, 1, "A", 1, 2, params)
+    analysis.BasicCalculation(DEFAULT_INTERVAL = 5, AV_PROFILE = AV_PROFILE_INTERVALS)
+    streaming = StreamingAnalysis(position_project, 1, "A", 1, 2, params, chunk_frames = 64)
+    streaming.BasicCalculation(DEFAULT_INTERVAL = 5, AV_PROFILE = AV_PROFILE_INTERVALS)
+
+    assert list(analysis.angular_velocity_profile) == list(streaming.angular_velocity_profile) == [1, 5]
+    assert EndPoints_Adder(streaming) == EndPoints_Adder(analysis)
+
+
+@pytest.mark.parametrize("analysis_class", [GeneralAnalysis, StreamingAnalysis])
+def test_missing_worm(position_project, analysis_class):
+    params = Parameters(project_dir = position_project, day_num = 1, treatment_char = "A")
+    (position_project / "Day 1" / "A - Control" / "Batch 1" / "Trial-Well 2-position.csv").unlink()
+
+    analysis = analysis_class(position_project, 1, "A", 1, 2, params)
+
+    assert not analysis.Loaded
+    with pytest.raises(FileNotFoundError):
+        analysis.BasicCalculation()
+
+
+def test_streaming_spike_policy(position_project):
+    params = Parameters(project_dir = position_project, day_num = 1, treatment_char = "A")
+    with pytest.raises(ValueError):
+        StreamingAnalysis(position_project, 1, "A", 1, 2, params).BasicCalculation(SPIKE_POLICY = "median")